@@ -0,0 +1,254 @@
+"""
+In-process stand-ins for Google Sheets/Drive and Groq, plus synthetic data.
+
+They implement just the client surface the app calls (values().get/batchGet/
+append/batchUpdate, files().get, chat.completions.create with and without
+stream=True), add a configurable delay to every call and fail a configurable
+fraction of them with the same exception types the real clients raise.
+"""
+import re, json, time, random, threading
+from types import SimpleNamespace
+
+import httplib2
+import httpx
+from googleapiclient.errors import HttpError
+from groq import APIConnectionError
+
+SCHEDULE_HEADERS = ["Class Name", "Day", "Time", "Instructor", "Location", "Price", "Duration", "Notes"]
+SERVICES_HEADERS = ["Class Name", "Duration", "Price", "Location"]
+APPOINTMENTS_HEADERS = [
+    "Name", "Email", "Phone", "Service", "Total Sessions",
+    "Sessions (Format: Session 1: Date at Time | Session 2: Date at Time | etc.)",
+    "Booking ID", "Timestamp",
+]
+# no intent keywords ("classes", "book", "change", ...) in generated names
+CRAFTS = ["Pottery", "Ceramics", "Watercolor", "Sketching", "Weaving", "Calligraphy",
+          "Glass Fusing", "Printmaking", "Woodcarving", "Jewelry", "Embroidery", "Mosaic"]
+LEVELS = ["Intro", "Open Studio", "Intermediate", "Advanced", "Evening", "Weekend", "Kids", "Masterclass"]
+DAYS = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+INSTRUCTORS = ["Alex Kim", "Maria Lopez", "Sam Patel", "Jo Chen", "Priya Nair", "Tom Berg", "Ana Costa"]
+LOCATIONS = ["Studio A", "Studio B", "Main Hall", "Garden Room", "Online"]
+
+
+class _Call:
+    def __init__(self, fn):
+        self._fn = fn
+
+    def execute(self, **kw):
+        return self._fn()
+
+
+class _Faults:
+    """Delay (mean seconds, +/-50%) and error rate shared by a fake's calls."""
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0, seed: int = 0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.calls = self.errors = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def hit(self) -> bool:
+        """Sleep for one call; True when the call should fail."""
+        with self._lock:
+            self.calls += 1
+            delay = self.latency * self._rng.uniform(0.5, 1.5)
+            fail = self._rng.random() < self.error_rate
+            self.errors += fail
+        if delay:
+            time.sleep(delay)
+        return fail
+
+
+class FakeSheets:
+    """Sheets v4 + Drive v3 metadata over {tab: [[cell, ...], ...]}; row 1 is the header."""
+    def __init__(self, tabs: dict, latency: float = 0.0, error_rate: float = 0.0, seed: int = 0):
+        self.tabs = tabs
+        self.faults = _Faults(latency, error_rate, seed)
+        self.versions = {}  # tab -> edit counter, summed into the Drive version
+        self._lock = threading.Lock()
+
+    # service(...).spreadsheets().values() and service(...).files() all land here
+    def spreadsheets(self):
+        return self
+
+    def values(self):
+        return self
+
+    def files(self):
+        return self
+
+    def _call(self, uri: str, fn):
+        def run():
+            if self.faults.hit():
+                raise HttpError(httplib2.Response({"status": "503"}),
+                                b'{"error": {"code": 503, "message": "The service is currently unavailable."}}',
+                                uri=uri)
+            return fn()
+        return _Call(run)
+
+    @staticmethod
+    def _parse(rng: str):
+        tab, _, cells = rng.partition("!")
+        m = re.fullmatch(r"([A-Z]+)(\d*)(?::([A-Z]+)(\d*))?", cells or "A1:ZZ")
+        col = lambda s: sum((ord(ch) - 64) * 26 ** i for i, ch in enumerate(reversed(s))) - 1
+        c0, r0 = col(m.group(1)), int(m.group(2) or 1)
+        c1 = col(m.group(3)) if m.group(3) else c0
+        r1 = int(m.group(4)) if m.group(4) else (None if m.group(3) else r0)
+        return tab.strip("'"), c0, c1, r0, r1
+
+    def _read(self, rng: str):
+        tab, c0, c1, r0, r1 = self._parse(rng)
+        if tab not in self.tabs:  # like Sheets, which fails the whole batchGet too
+            raise HttpError(httplib2.Response({"status": "400"}),
+                            f'{{"error": {{"code": 400, "message": "Unable to parse range: {rng}"}}}}'.encode(),
+                            uri=f"values/{rng}")
+        rows = self.tabs[tab]
+        out = [r[c0:c1 + 1] for r in rows[r0 - 1:r1]]
+        while out and not out[-1]:
+            out.pop()
+        return out
+
+    def edit(self, tab: str, rownum: int, col: int, value: str):
+        with self._lock:
+            row = self.tabs[tab][rownum - 1]
+            row.extend([""] * (col + 1 - len(row)))
+            row[col] = value
+            self.versions[tab] = self.versions.get(tab, 0) + 1
+
+    def get(self, spreadsheetId=None, range=None, fileId=None, **kw):
+        if fileId is not None:  # drive files().get
+            return self._call(f"drive/files/{fileId}",
+                              lambda: {"version": str(sum(self.versions.values()) + 1)})
+        return self._call(f"values/{range}", lambda: {"range": range, "values": self._read(range)})
+
+    def batchGet(self, spreadsheetId, ranges, **kw):
+        return self._call("values:batchGet", lambda: {
+            "valueRanges": [{"range": r, "values": self._read(r)} for r in ranges]})
+
+    def append(self, spreadsheetId, range, body, **kw):
+        def run():
+            tab = self._parse(range)[0]
+            with self._lock:
+                rows = self.tabs.setdefault(tab, [])
+                start = len(rows) + 1
+                rows.extend(list(r) for r in body["values"])
+                self.versions[tab] = self.versions.get(tab, 0) + 1
+            return {"updates": {"updatedRange": f"{tab}!A{start}:H{start + len(body['values']) - 1}"}}
+        return self._call(f"values/{range}:append", run)
+
+    def batchUpdate(self, spreadsheetId, body, **kw):
+        def run():
+            for d in body["data"]:
+                tab, c0, _, r0, _ = self._parse(d["range"])
+                self.edit(tab, r0, c0, d["values"][0][0])
+            return {"totalUpdatedCells": len(body["data"])}
+        return self._call("values:batchUpdate", run)
+
+
+class FakeGroq:
+    """
+    chat.completions.create: sleeps `latency` (time to first token) plus the
+    completion length at `tokens_per_s`, then answers from the first context
+    row. JSON extraction prompts get JSON built from the user text.
+    """
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0, tokens_per_s: float = 0.0, seed: int = 0):
+        self.faults = _Faults(latency, error_rate, seed)
+        self.tokens_per_s = tokens_per_s
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    @staticmethod
+    def _reply(messages) -> str:
+        system, user = messages[0]["content"], messages[-1]["content"]
+        if "JSON" in system:
+            booking = re.search(r"\b([A-Z0-9]{8})\b", user)
+            phone = re.search(r"\bphone (?:to )?(\d{7,15})\b", user)
+            return json.dumps({"booking_id": booking.group(1) if booking else "",
+                               "phone": phone.group(1) if phone else None})
+        row = re.search(r"\[([^\]]+)\] ([^\n]{0,160})", user)
+        if not row:
+            return "I don't know based on the spreadsheet."
+        return f"According to {row.group(1)}: {row.group(2)}."
+
+    def create(self, model=None, messages=(), stream=False, **kw):
+        failed = self.faults.hit()
+        if failed:
+            raise APIConnectionError(request=httpx.Request("POST", "https://api.groq.com/openai/v1/chat/completions"))
+        text = self._reply(messages)
+        pieces = re.findall(r"\S+\s*", text)
+        usage = SimpleNamespace(prompt_tokens=sum(len(m["content"]) // 4 for m in messages),
+                                completion_tokens=len(pieces))
+        if not stream:
+            if self.tokens_per_s:
+                time.sleep(len(pieces) / self.tokens_per_s)
+            return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=text))], usage=usage)
+        return self._stream(pieces)
+
+    def _stream(self, pieces):
+        for p in pieces:
+            if self.tokens_per_s:
+                time.sleep(1 / self.tokens_per_s)
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=p))])
+
+
+# -------------------------
+# Synthetic sheets and questions
+# -------------------------
+def schedule_row(i: int, rng: random.Random) -> list:
+    craft, level = CRAFTS[i % len(CRAFTS)], LEVELS[(i // len(CRAFTS)) % len(LEVELS)]
+    return [
+        f"{level} {craft} {i // (len(CRAFTS) * len(LEVELS)) + 1}",
+        DAYS[rng.randrange(7)],
+        f"{rng.randrange(8, 21):02d}:{rng.choice(['00', '30'])}",
+        rng.choice(INSTRUCTORS),
+        rng.choice(LOCATIONS),
+        str(rng.randrange(15, 120, 5)),
+        str(rng.choice([60, 90, 120, 180])),
+        f"Cohort {i}; bring an apron" if rng.random() < 0.5 else f"Cohort {i}",
+    ]
+
+
+def schedule_tab(rows: int, seed: int = 0) -> list:
+    rng = random.Random(seed)
+    return [list(SCHEDULE_HEADERS)] + [schedule_row(i, rng) for i in range(rows)]
+
+
+def services_tab() -> list:
+    return [list(SERVICES_HEADERS)] + [
+        [f"{level} {craft}", "90", str(30 + 5 * i), LOCATIONS[i % len(LOCATIONS)]]
+        for i, (level, craft) in enumerate((l, c) for l in LEVELS[:3] for c in CRAFTS)
+    ]
+
+
+def appointments_tab(bookings: int, seed: int = 0) -> list:
+    rng = random.Random(seed)
+    out = [list(APPOINTMENTS_HEADERS)]
+    for i in range(bookings):
+        out.append([f"Client {i}", f"client{i}@example.com", f"555{rng.randrange(10**7):07d}",
+                    f"Intro {CRAFTS[i % len(CRAFTS)]}", "5", "Session 1: 2025-08-15 at 19:00",
+                    f"{rng.getrandbits(32):08X}", "2025-08-01 10:00:00Z"])
+    return out
+
+
+def qa_questions(tab: list, n: int, seed: int = 0) -> list:
+    rng = random.Random(seed)
+    rows = tab[1:]
+    templates = ["What time does {0} start on {1}?", "Who teaches {0}?",
+                 "How much is {0} and where is it held?", "How long is {0}?"]
+    return [rng.choice(templates).format(r[0], r[1]) for r in (rng.choice(rows) for _ in range(n))]
+
+
+def create_questions(n: int, seed: int = 0) -> list:
+    rng = random.Random(seed)
+    names = [row[0] for row in services_tab()[1:]]
+    return [f"Book {rng.choice(names)} for Jamie Rivera (jamie{i}@example.com, 555{i % 10**7:07d}), "
+            f"5 sessions, first session 2025-09-0{1 + i % 9} 18:00" for i in range(n)]
+
+
+def update_questions(appointments: list, n: int, seed: int = 0) -> list:
+    rng = random.Random(seed)
+    ids = [r[6] for r in appointments[1:]]
+    return [f"Please change booking {rng.choice(ids)} phone to 555{rng.randrange(10**7):07d}" for _ in range(n)]
+
+
+def services_questions(n: int) -> list:
+    return ["What services do you offer?"] * n
@@ -0,0 +1,400 @@
+"""
+Offline benchmark of sync, retrieval and /api/ask, with no Google or Groq credentials.
+
+    cd backend
+    python -m benchmarks.run [--rows 1k,10k,100k,1m] [--requests 200] [--concurrency 4]
+                             [--sheets-latency 0.08] [--sheets-error-rate 0.01]
+                             [--groq-latency 0.3] [--groq-tokens-per-s 250] [--groq-error-rate 0.01]
+                             [--out results.json] [--compare previous.json]
+
+For each sheet size it times a cold sync, an unchanged resync and a resync
+after editing 1% of the rows, then QAEngine.retrieve, then POST /api/ask per
+intent (qa, services.list, appointments.create, appointments.update) through
+the Django test client from --concurrency threads, then the QA questions
+again through POST /api/ask_batch in batches of --batch-size. Each phase records
+p50/p95/p99 latency, throughput, errors and peak RSS. Sheets and Groq are the
+stand-ins in benchmarks/fakes.py; the embedder is the real one.
+
+The run uses a throwaway RAG_INDEX_DIR and turns the answer and embedding
+caches off (--answer-cache / --embed-cache keep them), so every run measures
+the same work. Results go to benchmarks/results/<timestamp>.json; --compare
+prints the change against an earlier file and exits 1 when a latency or
+sync time got worse by more than --threshold.
+"""
+import os, sys, json, time, random, argparse, platform, tempfile, threading, subprocess, logging
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+SPREADSHEET_ID = "bench-spreadsheet"
+ENV_KNOBS = ["EMBED_MODEL", "EMBED_BACKEND", "EMBED_BATCH_SIZE", "EMBED_CHUNK_ROWS", "RAG_RETRIEVAL",
+             "RAG_TOP_K", "RAG_CANDIDATES", "RAG_ANN", "RAG_CONTEXT_TOKENS", "RAG_SYNC_MODE", "RAG_CHANGE_DETECTION"]
+
+
+def _setup_django(args):
+    """Point the app at throwaway state before anything under notes/ is imported."""
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "core.settings")
+    os.environ.setdefault("SPREADSHEET_ID", SPREADSHEET_ID)
+    os.environ.setdefault("GROQ_API_KEY", "bench")
+    os.environ.setdefault("ALLOWED_HOSTS", "testserver")
+    os.environ["DJANGO_SECURE_SSL_REDIRECT"] = "false"
+    os.environ["RAG_INDEX_DIR"] = args.index_dir or tempfile.mkdtemp(prefix="heysheet-bench-")
+    os.environ.pop("SYNC_POLL_INTERVAL", None)
+    os.environ["BOOKING_WRITE_BEHIND"] = "false"
+    if not args.answer_cache:
+        os.environ["ANSWER_CACHE"] = "off"
+    if not args.embed_cache:
+        os.environ["EMBED_CACHE"] = "off"
+    import django
+    django.setup()
+    if not args.verbose:
+        logging.disable(logging.ERROR)  # injected failures are counted, not logged
+
+
+def parse_rows(spec: str) -> list:
+    out = []
+    for part in spec.lower().split(","):
+        part = part.strip()
+        mult = {"k": 1_000, "m": 1_000_000}.get(part[-1:], 1)
+        out.append(int(float(part.rstrip("km")) * mult))
+    return out
+
+
+# -------------------------
+# Measurement helpers
+# -------------------------
+def _rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        import resource  # no /proc (macOS): peak so far, in bytes there
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class PeakRSS:
+    """Samples resident memory on a thread while the block runs."""
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.peak = self.start = 0
+        self._stop = threading.Event()
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, _rss_bytes())
+
+    def __enter__(self):
+        self.start = self.peak = _rss_bytes()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, _rss_bytes())
+
+    def as_dict(self) -> dict:
+        return {"rss_start_mb": round(self.start / 2**20, 1), "rss_peak_mb": round(self.peak / 2**20, 1)}
+
+
+def latency_stats(ms, wall_s: float = None, errors: int = 0) -> dict:
+    ms = np.asarray(ms, dtype="float64")
+    if not len(ms):
+        return {"n": 0, "errors": errors}
+    out = {"n": int(len(ms)), "errors": errors,
+           "mean_ms": round(float(ms.mean()), 3),
+           **{f"p{p}_ms": round(float(np.percentile(ms, p)), 3) for p in (50, 95, 99)},
+           "max_ms": round(float(ms.max()), 3)}
+    if wall_s:
+        out["wall_s"] = round(wall_s, 3)
+        out["throughput_rps"] = round(len(ms) / wall_s, 2)
+    return out
+
+
+def _dir_bytes(path: Path) -> int:
+    return sum(p.stat().st_size for p in path.rglob("*") if p.is_file())
+
+
+# -------------------------
+# Phases
+# -------------------------
+def bench_sync(label: str, edit=None) -> dict:
+    from notes.sheets_rag import sync_sheet
+    counts = {}
+
+    def progress(stage=None, **kw):
+        for k, n in kw.items():
+            counts[k] = counts.get(k, 0) + n
+
+    if edit:
+        edit()
+    with PeakRSS() as mem:
+        t0 = time.perf_counter()
+        rows = sync_sheet(progress=progress)
+        seconds = time.perf_counter() - t0
+    print(f"  sync {label:<10} {seconds:8.2f}s  rows rebuilt {rows}", file=sys.stderr)
+    return {"seconds": round(seconds, 3), "rows_rebuilt": rows, **counts, **mem.as_dict()}
+
+
+def bench_retrieve(engine, questions) -> dict:
+    for q in questions[:5]:
+        engine.retrieve(q)  # warm-up
+    ms = []
+    with PeakRSS() as mem:
+        t0 = time.perf_counter()
+        for q in questions:
+            t = time.perf_counter()
+            engine.retrieve(q)
+            ms.append((time.perf_counter() - t) * 1000)
+        wall = time.perf_counter() - t0
+    return {**latency_stats(ms, wall), **mem.as_dict()}
+
+
+def bench_intent(intent: str, questions, concurrency: int, warmup: int) -> dict:
+    """POST each question to /api/ask from `concurrency` threads, one test client per thread."""
+    from django.test import Client
+    local = threading.local()
+
+    def one(q):
+        client = getattr(local, "client", None)
+        if client is None:
+            client = local.client = Client(raise_request_exception=False)
+        t = time.perf_counter()
+        resp = client.post("/api/ask", data=json.dumps({"question": q}), content_type="application/json")
+        ms = (time.perf_counter() - t) * 1000
+        ok = resp.status_code == 200 and resp.json().get("intent") == intent
+        return ms, ok, resp.status_code
+
+    for q in questions[:warmup]:
+        one(q)
+    with PeakRSS() as mem, ThreadPoolExecutor(concurrency) as pool:
+        t0 = time.perf_counter()
+        results = list(pool.map(one, questions[warmup:]))
+        wall = time.perf_counter() - t0
+    statuses = {}
+    for _, _, code in results:
+        statuses[str(code)] = statuses.get(str(code), 0) + 1
+    errors = sum(not ok for _, ok, _ in results)
+    stats = latency_stats([ms for ms, _, _ in results], wall, errors)
+    print(f"  ask  {intent:<20} p50 {stats['p50_ms']:8.1f}ms  p95 {stats['p95_ms']:8.1f}ms  "
+          f"p99 {stats['p99_ms']:8.1f}ms  {stats['throughput_rps']:7.1f} req/s  errors {errors}",
+          file=sys.stderr)
+    return {**stats, "status_codes": statuses, **mem.as_dict()}
+
+
+def bench_batch(questions, batch_size: int) -> dict:
+    """POST /api/ask_batch with the QA questions in batches of batch_size, one at a time."""
+    from django.test import Client
+    client = Client(raise_request_exception=False)
+    batches = [questions[i:i + batch_size] for i in range(0, len(questions), batch_size)]
+    ms, errors = [], 0
+    with PeakRSS() as mem:
+        t0 = time.perf_counter()
+        for batch in batches:
+            t = time.perf_counter()
+            resp = client.post("/api/ask_batch", data=json.dumps({"questions": batch}),
+                               content_type="application/json")
+            ms.append((time.perf_counter() - t) * 1000)
+            results = resp.json().get("results", []) if resp.status_code == 200 else []
+            errors += len(batch) - sum(r.get("intent") == "qa" and "error" not in r for r in results)
+        wall = time.perf_counter() - t0
+    stats = latency_stats(ms, wall, errors)
+    stats["questions_per_s"] = round(len(questions) / wall, 2)
+    print(f"  ask_batch x{batch_size:<14} p50 {stats['p50_ms']:8.1f}ms  p95 {stats['p95_ms']:8.1f}ms  "
+          f"{'':14}{stats['questions_per_s']:7.1f} q/s    errors {errors}", file=sys.stderr)
+    return {**stats, "batch_size": batch_size, **mem.as_dict()}
+
+
+def bench_size(rows: int, args, sheets, groq) -> dict:
+    from benchmarks import fakes
+    from notes import views
+    from notes.sheets_rag import rag_sources
+    from notes.index_store import INDEX_DIR
+
+    tab = f"Schedule{rows}"
+    print(f"{rows} rows", file=sys.stderr)
+    t0 = time.perf_counter()
+    sheets.tabs[tab] = fakes.schedule_tab(rows, seed=args.seed)
+    generate_s = time.perf_counter() - t0
+    os.environ["RAG_SOURCES"] = f"{tab}!A1:Z"
+
+    # sync runs without injected faults; they apply to the request phases
+    sheets.faults.error_rate = 0.0
+    rng = random.Random(args.seed)
+
+    def edit_one_percent():
+        for r in rng.sample(range(2, rows + 2), max(1, rows // 100)):
+            sheets.edit(tab, r, 7, f"Edited {r}")
+
+    sync = {
+        "cold": bench_sync("cold"),
+        "unchanged": bench_sync("unchanged"),
+        "edit_1pct": bench_sync("edit 1%", edit=edit_one_percent),
+    }
+
+    with PeakRSS() as mem:
+        t0 = time.perf_counter()
+        views._engine = None
+        views._build_engine_async()
+        engine_s = time.perf_counter() - t0
+    engine = views._engine
+    if engine is None:
+        raise RuntimeError("QA engine did not load; run with --verbose for the traceback")
+    shard = rag_sources()[0].shard
+    info = engine.shards().get(shard, {})
+    index = {"engine_load_s": round(engine_s, 3), "rows": info.get("rows"), "ann": info.get("ann"),
+             "disk_mb": round(_dir_bytes(INDEX_DIR / shard) / 2**20, 1), **mem.as_dict()}
+
+    n = args.requests + args.warmup
+    tabs = sheets.tabs
+    questions = {
+        "qa": fakes.qa_questions(tabs[tab], n, seed=args.seed),
+        "services.list": fakes.services_questions(n),
+        "appointments.create": fakes.create_questions(n, seed=args.seed),
+        "appointments.update": fakes.update_questions(tabs["Appointments"], n, seed=args.seed),
+    }
+    retrieve = bench_retrieve(engine, questions["qa"])
+    print(f"  retrieve             p50 {retrieve['p50_ms']:8.2f}ms  p95 {retrieve['p95_ms']:8.2f}ms",
+          file=sys.stderr)
+
+    sheets.faults.error_rate = args.sheets_error_rate
+    intents = {intent: bench_intent(intent, qs, args.concurrency, args.warmup)
+               for intent, qs in questions.items() if intent in args.intents}
+    batch = bench_batch(questions["qa"][args.warmup:], args.batch_size) if args.batch_size else None
+    del sheets.tabs[tab]
+    return {"rows": rows, "generate_s": round(generate_s, 3), "sync": sync, "index": index,
+            "retrieve": retrieve, "ask": intents, "ask_batch": batch}
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=Path(__file__).resolve().parent, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run(args) -> dict:
+    from benchmarks import fakes
+    from notes import google_sheets, views
+    from notes.sheets_rag import embedder_stats, get_embedder
+
+    sheets = fakes.FakeSheets(
+        {"Services": fakes.services_tab(), "Appointments": fakes.appointments_tab(args.bookings, seed=args.seed)},
+        latency=args.sheets_latency, seed=args.seed)
+    groq = fakes.FakeGroq(latency=args.groq_latency, error_rate=args.groq_error_rate,
+                          tokens_per_s=args.groq_tokens_per_s, seed=args.seed)
+    # every Sheets/Drive client in the app comes from google_sheets._service
+    google_sheets._service = lambda api, version, scope: sheets
+    views._groq = groq
+
+    t0 = time.perf_counter()
+    get_embedder()
+    embedder_load_s = time.perf_counter() - t0
+
+    sizes = [bench_size(rows, args, sheets, groq) for rows in parse_rows(args.rows)]
+    return {
+        "meta": {
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "embedder_load_s": round(embedder_load_s, 3),
+            "embedder": embedder_stats(),
+            "env": {k: os.environ[k] for k in ENV_KNOBS if k in os.environ},
+            "args": {k: v for k, v in vars(args).items() if k not in ("out", "compare")},
+            "fake_calls": {"sheets": sheets.faults.calls, "sheets_errors": sheets.faults.errors,
+                           "groq": groq.faults.calls, "groq_errors": groq.faults.errors},
+        },
+        "sizes": sizes,
+    }
+
+
+# -------------------------
+# Run-to-run comparison
+# -------------------------
+def _metrics(result: dict) -> dict:
+    """Flat {name: value} of the numbers worth comparing; lower is better for all of them."""
+    out = {}
+    for size in result["sizes"]:
+        rows = size["rows"]
+        for phase, s in size["sync"].items():
+            out[f"{rows}/sync/{phase}/seconds"] = s["seconds"]
+            out[f"{rows}/sync/{phase}/rss_peak_mb"] = s["rss_peak_mb"]
+        for p in ("p50_ms", "p95_ms", "p99_ms"):
+            out[f"{rows}/retrieve/{p}"] = size["retrieve"].get(p)
+            for intent, s in size["ask"].items():
+                out[f"{rows}/ask/{intent}/{p}"] = s.get(p)
+            if size.get("ask_batch"):
+                out[f"{rows}/ask_batch/{p}"] = size["ask_batch"].get(p)
+    return {k: v for k, v in out.items() if v is not None}
+
+
+# changes smaller than this are noise whatever the ratio (sub-ms searches, no-op syncs)
+NOISE_FLOOR = {"_ms": 1.0, "seconds": 0.05, "rss_peak_mb": 5.0}
+
+
+def compare(old: dict, new: dict, threshold: float) -> list:
+    """Print old -> new for shared metrics; return the names that regressed beyond threshold."""
+    before, after = _metrics(old), _metrics(new)
+    regressed = []
+    print(f"\n{'metric':<52} {'before':>10} {'after':>10} {'change':>8}")
+    for name in sorted(before.keys() & after.keys()):
+        a, b = before[name], after[name]
+        change = (b - a) / a if a else 0.0
+        floor = next((v for suffix, v in NOISE_FLOOR.items() if name.endswith(suffix)), 0.0)
+        flag = ""
+        if change > threshold and b - a > floor:
+            regressed.append(name)
+            flag = "  REGRESSED"
+        print(f"{name:<52} {a:>10.2f} {b:>10.2f} {change:>+8.1%}{flag}")
+    return regressed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rows", default="1k,10k", help="Comma-separated sheet sizes, e.g. 1k,10k,100k,1m")
+    parser.add_argument("--requests", type=int, default=200, help="Timed requests per intent and size")
+    parser.add_argument("--warmup", type=int, default=5, help="Untimed requests per intent first")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--intents", default="qa,services.list,appointments.create,appointments.update")
+    parser.add_argument("--batch-size", type=int, default=20, help="Questions per /api/ask_batch call (0 skips)")
+    parser.add_argument("--bookings", type=int, default=1000, help="Rows in the fake Appointments tab")
+    parser.add_argument("--sheets-latency", type=float, default=0.08, help="Mean seconds per Sheets call")
+    parser.add_argument("--sheets-error-rate", type=float, default=0.0)
+    parser.add_argument("--groq-latency", type=float, default=0.3, help="Mean seconds to the first token")
+    parser.add_argument("--groq-tokens-per-s", type=float, default=250.0)
+    parser.add_argument("--groq-error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--answer-cache", action="store_true", help="Keep the QA answer cache on")
+    parser.add_argument("--embed-cache", action="store_true", help="Keep the embedding cache on")
+    parser.add_argument("--index-dir", help="RAG_INDEX_DIR to use (default: a new temp dir)")
+    parser.add_argument("--out", help="Result file (default: benchmarks/results/<timestamp>.json)")
+    parser.add_argument("--compare", help="Earlier result file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Regression threshold for --compare")
+    parser.add_argument("--verbose", action="store_true", help="Keep app logging")
+    args = parser.parse_args(argv)
+    args.intents = [x.strip() for x in args.intents.split(",") if x.strip()]
+
+    _setup_django(args)
+    result = run(args)
+
+    out = Path(args.out) if args.out else RESULTS_DIR / f"{time.strftime('%Y%m%d-%H%M%S')}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(result, indent=2))
+    print(f"\nwrote {out}", file=sys.stderr)
+
+    if args.compare:
+        regressed = compare(json.loads(Path(args.compare).read_text()), result, args.threshold)
+        if regressed:
+            print(f"\n{len(regressed)} metric(s) regressed by more than {args.threshold:.0%}", file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
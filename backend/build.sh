@@ -38,6 +38,6 @@ python manage.py migrate --noinput
 echo "Testing Django setup..."
 python manage.py check --deploy
 
-# Start the application
-echo "Starting gunicorn server on port $PORT..."
-gunicorn core.wsgi:application --bind 0.0.0.0:$PORT --workers 1 --timeout 120 --worker-class sync --max-requests 100 --max-requests-jitter 10 --log-level info
+# Start the application (app and worker class come from gunicorn.conf.py)
+echo "Starting gunicorn server on port $PORT (${GUNICORN_WORKER_CLASS:-sync})..."
+gunicorn --bind 0.0.0.0:$PORT --workers 1 --timeout 120 --max-requests 100 --max-requests-jitter 10 --log-level info
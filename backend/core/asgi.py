@@ -12,5 +12,13 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+# read by core/settings.py: drop WhiteNoise, static files are served below
+os.environ['HEYSHEET_ASGI'] = 'true'
 
 application = get_asgi_application()
+
+from django.conf import settings  # noqa: E402  (settings are configured above)
+
+if settings.ASGI_WORKERS:
+    from django.contrib.staticfiles.handlers import ASGIStaticFilesHandler
+    application = ASGIStaticFilesHandler(application)
@@ -64,6 +64,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'notes.metrics.TimingMiddleware',  # outermost: Server-Timing total covers the whole stack
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
@@ -75,6 +76,13 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# WhiteNoise is sync-only middleware: under uvicorn workers it would push every async
+# view back through one thread, so core/asgi.py serves static files instead. Set by
+# core/asgi.py itself, so it follows the app that was actually loaded.
+ASGI_WORKERS = os.getenv("HEYSHEET_ASGI", "false").lower() == "true"
+if ASGI_WORKERS:
+    MIDDLEWARE.remove('whitenoise.middleware.WhiteNoiseMiddleware')
+
 ROOT_URLCONF = 'core.urls'
 
 TEMPLATES = [
@@ -108,6 +116,15 @@ DATABASES = {
 }
 
 
+# Cache (used by the QA answer cache when ANSWER_CACHE=django). Point
+# DJANGO_CACHE_BACKEND/LOCATION at a shared backend so all workers share it.
+CACHES = {
+    "default": {
+        "BACKEND": os.getenv("DJANGO_CACHE_BACKEND", "django.core.cache.backends.locmem.LocMemCache"),
+        "LOCATION": os.getenv("DJANGO_CACHE_LOCATION", "heysheet"),
+    }
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
@@ -0,0 +1,52 @@
+# Picked up automatically by gunicorn from the working directory.
+import logging
+import os
+
+# web: never load the QA stack (no embedder, engine or sync poller);
+# qa: preload embedder and engine unless told otherwise; all: as configured
+ROLE = os.getenv("HEYSHEET_WORKER_ROLE", "all").lower()
+
+# GUNICORN_WORKER_CLASS=uvicorn.workers.UvicornWorker serves the ASGI app, where
+# /api/ask/async keeps many questions in flight per worker. The app is picked
+# here so every launcher (Procfile, App Platform, build.sh) runs the matching one.
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "sync")
+wsgi_app = "core.asgi:application" if worker_class.startswith("uvicorn") else "core.wsgi:application"
+
+
+def _preload(var):
+    if ROLE == "web":
+        return False
+    return os.getenv(var, "true" if ROLE == "qa" else "false").lower() == "true"
+
+
+def post_fork(server, worker):
+    # Load the sentence-transformer in each worker before it takes traffic, so the
+    # first /api/ask after a deploy doesn't wait on the model load.
+    if not _preload("EMBEDDER_PRELOAD"):
+        return
+    try:
+        from notes.sheets_rag import warm_embedder
+        stats = warm_embedder()
+        server.log.info("Embedder preloaded in worker %s: %s", worker.pid, stats)
+    except Exception:
+        logging.exception("Embedder preload failed; it will load on first use")
+
+
+def post_worker_init(worker):
+    # Django is set up by now; resume flushing any write-behind bookings left
+    # pending by a previous worker.
+    if os.getenv("BOOKING_WRITE_BEHIND", "false").lower() == "true":
+        from notes.booking_queue import start_flusher
+        start_flusher()
+    if os.getenv("SYNC_POLL_INTERVAL") and ROLE != "web":
+        from notes.change_detector import start_poller
+        from notes.views import _poll_sync
+        start_poller(_poll_sync)
+    # Load the persisted index snapshot in the background now rather than on
+    # the first question.
+    if _preload("ENGINE_PRELOAD"):
+        from notes.views import _get_engine_nonblocking
+        try:
+            _get_engine_nonblocking()
+        except RuntimeError:
+            pass  # engine_initializing: the build thread is running
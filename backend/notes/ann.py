@@ -0,0 +1,136 @@
+"""
+Approximate nearest-neighbour indexes for large index generations.
+
+RAG_ANN picks the search structure: "flat" is the exact numpy search over
+vectors.npy, "hnsw" a faiss HNSW graph, "ivfpq" a faiss IVF index with
+product-quantised codes (a fraction of the float32 memory, opened with
+IO_FLAG_MMAP). "auto" (default) stays flat for small shards and switches by
+row count. The index is written as ann.faiss next to the generation's arrays;
+vectors.npy is kept either way, for incremental rebuilds and filtered search.
+faiss is imported by the functions that need it, so a worker that never
+builds or opens an ANN index never loads it.
+"""
+import os, math, time, logging
+import numpy as np
+
+RAG_ANN = os.getenv("RAG_ANN", "auto").lower()
+HNSW_MIN_ROWS = int(os.getenv("RAG_ANN_HNSW_ROWS", "50000"))
+IVFPQ_MIN_ROWS = int(os.getenv("RAG_ANN_IVFPQ_ROWS", "500000"))
+HNSW_M = int(os.getenv("RAG_HNSW_M", "32"))
+EF_CONSTRUCTION = int(os.getenv("RAG_HNSW_EF_CONSTRUCTION", "80"))
+EF_SEARCH = int(os.getenv("RAG_HNSW_EF_SEARCH", "64"))
+NPROBE = int(os.getenv("RAG_IVF_NPROBE", "16"))
+RERANK = int(os.getenv("RAG_PQ_RERANK", "10"))  # PQ candidates per result, re-scored exactly
+TRAIN_SAMPLE = int(os.getenv("RAG_ANN_TRAIN_SAMPLE", "100000"))
+FILENAME = "ann.faiss"
+
+
+def choose_kind(rows: int, kind: str = None) -> str:
+    kind = (kind or RAG_ANN).lower()
+    if kind != "auto":
+        return kind
+    if rows >= IVFPQ_MIN_ROWS:
+        return "ivfpq"
+    if rows >= HNSW_MIN_ROWS:
+        return "hnsw"
+    return "flat"
+
+
+def _ivfpq_params(rows: int, dim: int) -> dict:
+    # ~4*sqrt(rows) lists, rounded to a power of two so small growth keeps the trained index
+    nlist = int(os.getenv("RAG_IVF_NLIST", "0")) or min(65536, 2 ** round(math.log2(4 * math.sqrt(max(rows, 1)))))
+    m = int(os.getenv("RAG_PQ_M", "0")) or max(d for d in range(1, dim // 8 + 1) if dim % d == 0)
+    # 256 centroids per sub-quantiser want ~39 training points each
+    nbits = max(4, min(8, int(math.log2(max(rows, 16) / 39))))
+    return {"nlist": nlist, "m": m, "nbits": nbits}
+
+
+def _train_sample(vectors: np.ndarray) -> np.ndarray:
+    if len(vectors) <= TRAIN_SAMPLE:
+        return np.ascontiguousarray(vectors, dtype="float32")
+    pick = np.sort(np.random.default_rng(0).choice(len(vectors), TRAIN_SAMPLE, replace=False))
+    return np.ascontiguousarray(vectors[pick], dtype="float32")
+
+
+def build(vectors: np.ndarray, kind: str = None, prev_path=None, prev_meta: dict = None):
+    """
+    (faiss index or None, manifest meta) for L2-normalised vectors. An IVF-PQ
+    build reuses the previous generation's trained quantisers when the
+    parameters still match, so incremental syncs skip training.
+    """
+    rows, dim = vectors.shape
+    kind = choose_kind(rows, kind)
+    if kind == "flat" or rows == 0:
+        return None, {"kind": "flat"}
+    import faiss
+    t0 = time.perf_counter()
+    if kind == "hnsw":
+        meta = {"kind": kind, "m": HNSW_M, "ef_construction": EF_CONSTRUCTION}
+        index = faiss.IndexHNSWFlat(dim, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = EF_CONSTRUCTION
+    elif kind == "ivfpq":
+        meta = {"kind": kind, **_ivfpq_params(rows, dim)}
+        same = {k: v for k, v in (prev_meta or {}).items() if k != "trained_rows"} == meta
+        if same and prev_path is not None and prev_path.exists():
+            index = faiss.read_index(str(prev_path))
+            index.reset()
+            meta["trained_rows"] = prev_meta.get("trained_rows")
+        else:
+            quantizer = faiss.IndexFlatIP(dim)
+            index = faiss.IndexIVFPQ(quantizer, dim, meta["nlist"], meta["m"], meta["nbits"],
+                                     faiss.METRIC_INNER_PRODUCT)
+            sample = _train_sample(vectors)
+            index.train(sample)
+            meta["trained_rows"] = len(sample)
+    else:
+        raise ValueError(f"Unknown RAG_ANN index kind: {kind}")
+    for start in range(0, rows, 65536):
+        index.add(np.ascontiguousarray(vectors[start:start + 65536], dtype="float32"))
+    logging.info("Built %s ANN index over %s rows in %.1fs", kind, rows, time.perf_counter() - t0)
+    return index, meta
+
+
+def save(index, path):
+    import faiss
+    faiss.write_index(index, str(path))
+
+
+def load(path, meta: dict, nprobe: int = None, ef_search: int = None):
+    """Open a generation's ANN index (IVF lists via mmap) with the search-time knobs applied."""
+    import faiss
+    if meta.get("kind") == "ivfpq":
+        index = faiss.read_index(str(path), faiss.IO_FLAG_MMAP)
+        faiss.extract_index_ivf(index).nprobe = nprobe or NPROBE
+    else:
+        index = faiss.read_index(str(path))
+        index.hnsw.efSearch = ef_search or EF_SEARCH
+    return index
+
+
+def search(index, qv: np.ndarray, k: int, vectors: np.ndarray = None, rerank: int = None):
+    """
+    faiss search with missing results as (-inf, -1), like the flat search.
+    With `vectors`, PQ results are over-fetched rerank-fold and re-scored
+    against the exact vectors, which recovers most of the quantisation loss.
+    """
+    import faiss
+    qv = np.ascontiguousarray(qv, dtype="float32")
+    rerank = rerank or RERANK
+    if vectors is None or rerank <= 1 or not isinstance(index, faiss.IndexIVF):
+        D, I = index.search(qv, k)
+        D[I == -1] = -np.inf
+        return D, I
+    _, cand = index.search(qv, k * rerank)
+    D = np.full((len(qv), k), -np.inf, dtype="float32")
+    I = np.full((len(qv), k), -1, dtype="int64")
+    for row, (q, c) in enumerate(zip(qv, cand)):
+        c = np.sort(c[c != -1])  # sorted: sequential reads from the mmap
+        scores = np.asarray(vectors[c]) @ q
+        top = np.argsort(-scores)[:k]
+        D[row, :len(top)], I[row, :len(top)] = scores[top], c[top]
+    return D, I
+
+
+def index_bytes(index) -> int:
+    import faiss
+    return int(faiss.serialize_index(index).nbytes) if index is not None else 0
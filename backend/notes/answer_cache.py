@@ -0,0 +1,131 @@
+"""
+Answer cache for QAEngine.ask.
+
+Entries are keyed on the normalised question and the index version, so a new
+index generation invalidates everything without an explicit flush. The
+"local" backend is an in-process LRU with TTL; the "django" backend stores
+entries in a Django cache (configure CACHES with a shared backend so all
+workers see them). With ANSWER_CACHE_SIMILARITY set, a question whose
+embedding is at least that similar to a previously answered one reuses its
+answer; the vectors for that lookup are kept per process. A scope (the
+retrieval filters) is part of the key, and scoped questions only hit exactly.
+"""
+import os, re, json, time, hashlib, threading, logging
+from collections import OrderedDict
+import numpy as np
+
+
+def normalize_question(q: str) -> str:
+    q = re.sub(r"[^\w\s]", " ", q.lower())
+    return " ".join(q.split())
+
+
+class AnswerCache:
+    def __init__(self, backend: str = "local", ttl: int = 3600, max_entries: int = 1024,
+                 similarity: float = None, alias: str = "default"):
+        self.backend = backend
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.similarity = similarity
+        self.alias = alias
+        self._lock = threading.Lock()
+        self._local = OrderedDict()  # key -> (expires_at, value)
+        self._version = None
+        self._vec_keys = []          # keys aligned with _vecs, for the similarity lookup
+        self._vecs = None
+        self.hits = self.misses = 0
+
+    @classmethod
+    def from_env(cls):
+        backend = os.getenv("ANSWER_CACHE", "local").lower()
+        if backend in ("", "off", "false", "0"):
+            return None
+        sim = os.getenv("ANSWER_CACHE_SIMILARITY")
+        return cls(
+            backend=backend,
+            ttl=int(os.getenv("ANSWER_CACHE_TTL", "3600")),
+            max_entries=int(os.getenv("ANSWER_CACHE_SIZE", "1024")),
+            similarity=float(sim) if sim else None,
+            alias=os.getenv("ANSWER_CACHE_ALIAS", "default"),
+        )
+
+    def _key(self, question: str, version: str, scope: dict = None) -> str:
+        text = normalize_question(question)
+        if scope:
+            text += "\0" + json.dumps(scope, sort_keys=True)
+        digest = hashlib.sha1(text.encode("utf-8")).hexdigest()
+        return f"heysheet:answer:{version}:{digest}"
+
+    def _on_version(self, version: str):
+        # caller holds the lock; drop everything that belonged to the old index
+        if version != self._version:
+            self._version = version
+            self._local.clear()
+            self._vec_keys, self._vecs = [], None
+
+    # ---- storage ----
+    def _load(self, key):
+        if self.backend == "django":
+            from django.core.cache import caches
+            return caches[self.alias].get(key)
+        hit = self._local.get(key)
+        if hit is None:
+            return None
+        expires_at, value = hit
+        if expires_at < time.monotonic():
+            del self._local[key]
+            return None
+        self._local.move_to_end(key)
+        return value
+
+    def _store(self, key, value):
+        if self.backend == "django":
+            from django.core.cache import caches
+            caches[self.alias].set(key, value, timeout=self.ttl)
+            return
+        self._local[key] = (time.monotonic() + self.ttl, value)
+        self._local.move_to_end(key)
+        while len(self._local) > self.max_entries:
+            self._local.popitem(last=False)
+
+    # ---- public ----
+    def get(self, question: str, version: str, qv: np.ndarray = None, scope: dict = None):
+        """Return the cached (answer, matches) or None."""
+        with self._lock:
+            self._on_version(version)
+            try:
+                value = self._load(self._key(question, version, scope))
+                if (value is None and not scope and self.similarity is not None
+                        and qv is not None and self._vecs is not None):
+                    sims = self._vecs @ np.asarray(qv, dtype="float32").reshape(-1)
+                    best = int(np.argmax(sims))
+                    if sims[best] >= self.similarity:
+                        value = self._load(self._vec_keys[best])
+            except Exception:
+                logging.exception("Answer cache lookup failed")
+                value = None
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return value
+
+    def set(self, question: str, version: str, answer: str, matches, qv: np.ndarray = None,
+            scope: dict = None):
+        with self._lock:
+            self._on_version(version)
+            key = self._key(question, version, scope)
+            try:
+                self._store(key, (answer, matches))
+            except Exception:
+                logging.exception("Answer cache store failed")
+                return
+            if self.similarity is not None and qv is not None and not scope and key not in self._vec_keys:
+                v = np.asarray(qv, dtype="float32").reshape(1, -1)
+                self._vecs = v if self._vecs is None else np.vstack([self._vecs, v])[-self.max_entries:]
+                self._vec_keys = (self._vec_keys + [key])[-self.max_entries:]
+
+    def stats(self) -> dict:
+        return {"backend": self.backend, "ttl": self.ttl, "similarity": self.similarity,
+                "entries": len(self._local) if self.backend != "django" else None,
+                "hits": self.hits, "misses": self.misses, "version": self._version}
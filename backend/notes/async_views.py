@@ -0,0 +1,73 @@
+"""
+Async variant of /api/ask for ASGI servers (gunicorn -k uvicorn.workers.UvicornWorker).
+
+The Groq call is awaited on the async client, embedding/search run in a bounded
+thread pool, and the Sheets-backed intents (which use the sync Google client)
+are offloaded to threads, so one worker process can hold many in-flight
+questions instead of one per sync worker.
+"""
+import os, json, logging
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from groq import AsyncGroq
+
+from . import metrics
+from .views import (
+    _intent, _handle_action, _get_engine_nonblocking, _engine_unavailable, _parse_filters,
+    _HELP_ANSWER,
+)
+
+# embedding + search are CPU-bound; more threads than cores just adds contention
+_qa_pool = ThreadPoolExecutor(
+    max_workers=int(os.getenv("QA_THREADPOOL_SIZE", str(min(4, os.cpu_count() or 1)))),
+    thread_name_prefix="qa",
+)
+_agroq = AsyncGroq(api_key=os.getenv("GROQ_API_KEY"))
+
+
+@csrf_exempt
+async def ask_async(request):
+    """Same request/response contract as POST /api/ask."""
+    if request.method != "POST":
+        return JsonResponse({"error": "POST required"}, status=405)
+    try:
+        data = json.loads(request.body or b"{}")
+        q = (data.get("question") or "").strip()
+        filters = _parse_filters(data.get("filters"))
+    except (json.JSONDecodeError, AttributeError):
+        return JsonResponse({"error": "Invalid JSON body"}, status=400)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    if not q:
+        return JsonResponse(_HELP_ANSWER)
+
+    with metrics.span("intent"):
+        intent = _intent(q)
+    metrics.annotate(intent=intent)
+    logging.info("=== /api/ask/async === %s", {"q": q, "intent": intent})
+
+    # 1-3) services list / create / update: blocking Sheets + Groq calls, off the loop
+    if intent != "qa":
+        payload = await sync_to_async(_handle_action, thread_sensitive=False)(q, intent)
+        return JsonResponse(payload)
+
+    # 4) business-hours RAG
+    try:
+        engine = _get_engine_nonblocking()
+    except RuntimeError as e:
+        unavailable = _engine_unavailable(e)
+        if unavailable is None:
+            raise
+        payload, status = unavailable
+        return JsonResponse(payload, status=status)
+
+    answer, matches, prompt = await engine.aask(q, _agroq, executor=_qa_pool, filters=filters)
+    return JsonResponse({
+        "answer": answer,
+        "intent": "qa",
+        "matches": matches,
+        "prompt": prompt
+    })
@@ -0,0 +1,140 @@
+"""
+Write-behind queue for new bookings (BOOKING_WRITE_BEHIND=true).
+
+create_appointment stores the row in the local DB and returns the Booking ID
+right away; a background flusher appends everything that is pending to the
+Appointments tab in a single values().append per interval, retrying with
+exponential backoff. Rows are claimed with a conditional UPDATE, so several
+workers can run flushers against the same DB without double-appending.
+"""
+import os, time, random, threading, logging
+from datetime import timedelta
+
+from django.db import close_old_connections
+from django.utils import timezone
+
+from .models import PendingAppointment
+
+FLUSH_INTERVAL = float(os.getenv("BOOKING_FLUSH_INTERVAL", "2"))
+FLUSH_BATCH = int(os.getenv("BOOKING_FLUSH_BATCH", "500"))
+BACKOFF_MAX = 300          # seconds between retries, at most
+CLAIM_TIMEOUT = timedelta(minutes=5)  # a claim older than this belongs to a dead flusher
+
+_flusher = None
+_flusher_lock = threading.Lock()
+
+
+def enabled() -> bool:
+    return os.getenv("BOOKING_WRITE_BEHIND", "false").lower() == "true"
+
+
+def enqueue(booking_id: str, row: list) -> PendingAppointment:
+    pa = PendingAppointment.objects.create(booking_id=booking_id, row=row)
+    start_flusher()
+    return pa
+
+
+def patch_pending(booking_id: str, values: dict) -> bool:
+    """Apply {column index: value} to a booking that hasn't been flushed yet."""
+    pa = PendingAppointment.objects.filter(booking_id=booking_id, status=PendingAppointment.PENDING).first()
+    if pa is None:
+        return False
+    row = list(pa.row)
+    for ix, v in values.items():
+        row[ix] = str(v)
+    # only if the flusher hasn't claimed it in the meantime
+    return PendingAppointment.objects.filter(pk=pa.pk, status=PendingAppointment.PENDING).update(row=row) == 1
+
+
+def booking_status(booking_id: str):
+    pa = PendingAppointment.objects.filter(booking_id=booking_id).first()
+    if pa is None:
+        return None
+    return {
+        "booking_id": pa.booking_id,
+        "status": pa.status,
+        "attempts": pa.attempts,
+        "last_error": pa.last_error or None,
+        "sheet_row": pa.sheet_row,
+        "created_at": pa.created_at.isoformat(),
+        "written_at": pa.written_at.isoformat() if pa.written_at else None,
+    }
+
+
+def _claim_batch():
+    now = timezone.now()
+    # give back rows whose flusher died mid-append
+    PendingAppointment.objects.filter(
+        status=PendingAppointment.FLUSHING, claimed_at__lt=now - CLAIM_TIMEOUT
+    ).update(status=PendingAppointment.PENDING)
+
+    ids = list(
+        PendingAppointment.objects
+        .filter(status=PendingAppointment.PENDING)
+        .exclude(next_attempt_at__gt=now)
+        .order_by("id").values_list("id", flat=True)[:FLUSH_BATCH]
+    )
+    if not ids:
+        return []
+    PendingAppointment.objects.filter(id__in=ids, status=PendingAppointment.PENDING).update(
+        status=PendingAppointment.FLUSHING, claimed_at=now
+    )
+    return list(
+        PendingAppointment.objects
+        .filter(id__in=ids, status=PendingAppointment.FLUSHING, claimed_at=now)
+        .order_by("id")
+    )
+
+
+def flush_once() -> int:
+    """Append one batch of pending bookings. Returns how many were written."""
+    from .sheets_booking import append_appointment_rows
+
+    batch = _claim_batch()
+    if not batch:
+        return 0
+    try:
+        start_row = append_appointment_rows([(pa.booking_id, pa.row) for pa in batch])
+    except Exception as e:
+        attempts = max(pa.attempts for pa in batch) + 1
+        delay = min(BACKOFF_MAX, 2 ** attempts) * random.uniform(0.8, 1.2)
+        for pa in batch:
+            pa.status = PendingAppointment.PENDING
+            pa.attempts += 1
+            pa.last_error = str(e)[:1000]
+            pa.next_attempt_at = timezone.now() + timedelta(seconds=delay)
+        PendingAppointment.objects.bulk_update(batch, ["status", "attempts", "last_error", "next_attempt_at"])
+        logging.warning("Booking flush of %s rows failed (attempt %s), retrying in %.0fs: %s",
+                        len(batch), attempts, delay, e)
+        return 0
+
+    now = timezone.now()
+    for i, pa in enumerate(batch):
+        pa.status = PendingAppointment.WRITTEN
+        pa.sheet_row = start_row + i if start_row else None
+        pa.written_at = now
+        pa.last_error = ""
+    PendingAppointment.objects.bulk_update(batch, ["status", "sheet_row", "written_at", "last_error"])
+    logging.info("Flushed %s bookings to the sheet", len(batch))
+    return len(batch)
+
+
+def _flush_loop():
+    while True:
+        time.sleep(FLUSH_INTERVAL)
+        try:
+            while flush_once() >= FLUSH_BATCH:
+                pass
+        except Exception:
+            logging.exception("Booking flusher error")
+        finally:
+            close_old_connections()
+
+
+def start_flusher():
+    """Start this process's flusher thread (idempotent)."""
+    global _flusher
+    with _flusher_lock:
+        if _flusher is None or not _flusher.is_alive():
+            _flusher = threading.Thread(target=_flush_loop, name="booking-flusher", daemon=True)
+            _flusher.start()
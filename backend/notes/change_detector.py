@@ -0,0 +1,123 @@
+"""
+Change detection for the RAG sources, so frequent syncs are cheap no-ops.
+
+RAG_CHANGE_DETECTION=fingerprint (default) fetches the ranges and skips the
+rebuild of any whose values hash the same as last time; that saves the
+rebuild but not the read, and needs nothing beyond the Sheets scope.
+"drive" also asks Drive for each spreadsheet's version -- one metadata call
+per spreadsheet, no values read -- and only fetches spreadsheets whose
+version moved since their last successful sync; it needs the
+drive.metadata.readonly scope and the Drive API enabled. A Drive error
+(API disabled, no access) falls back to fingerprints for that sync.
+"off" always rebuilds. A shard whose live generation was built by another
+EMBED_MODEL/EMBED_BACKEND counts as unindexed, so switching encoders
+re-embeds on the next sync whatever the sheet did. State is kept in INDEX_DIR/sources.json, next to the
+index it describes, so all workers share it.
+
+With SYNC_POLL_INTERVAL set, each worker runs a poller thread that starts an
+incremental sync every interval +/- SYNC_POLL_JITTER (a fraction).
+"""
+import os, json, time, random, hashlib, threading, logging
+import pandas as pd
+
+from .google_sheets import drive_service
+from .embedders import EMBED_MODEL, EMBED_BACKEND
+from .index_store import INDEX_DIR, current_manifest
+
+MODE = os.getenv("RAG_CHANGE_DETECTION", "fingerprint").lower()
+POLL_INTERVAL = float(os.getenv("SYNC_POLL_INTERVAL", "0"))
+POLL_JITTER = float(os.getenv("SYNC_POLL_JITTER", "0.2"))
+STATE_PATH = INDEX_DIR / "sources.json"
+
+_state_lock = threading.Lock()
+_poller = None
+_poller_lock = threading.Lock()
+
+
+def _load_state() -> dict:
+    try:
+        return json.loads(STATE_PATH.read_text())
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def record(revisions: dict = None, fingerprints: dict = None):
+    """Remember what was just indexed: {spreadsheet id: version}, {shard: fingerprint}."""
+    with _state_lock:
+        state = _load_state()
+        state.setdefault("drive", {}).update(revisions or {})
+        state.setdefault("fingerprints", {}).update(fingerprints or {})
+        state["checked_at"] = time.time()
+        STATE_PATH.parent.mkdir(parents=True, exist_ok=True)
+        tmp = STATE_PATH.with_name(f".sources.{os.getpid()}.{threading.get_ident()}")
+        tmp.write_text(json.dumps(state))
+        os.replace(tmp, STATE_PATH)
+
+
+def indexed(shard: str) -> bool:
+    """The shard has a live generation the configured encoder can serve."""
+    manifest = current_manifest(shard)
+    return (manifest is not None and manifest.get("model") == EMBED_MODEL
+            and (manifest.get("backend") or "torch") == EMBED_BACKEND)
+
+
+def drive_versions(spreadsheet_ids) -> dict:
+    """{spreadsheet id: Drive version} for the ones Drive answered for."""
+    out = {}
+    for sid in spreadsheet_ids:
+        try:
+            meta = drive_service().files().get(
+                fileId=sid, fields="version,modifiedTime", supportsAllDrives=True,
+            ).execute()
+            out[sid] = str(meta["version"])
+        except Exception as e:
+            logging.warning("Drive version check failed for %s, comparing values instead: %s", sid, e)
+    return out
+
+
+def changed_spreadsheets(sources):
+    """
+    (spreadsheet ids to fetch, their Drive versions). A spreadsheet is fetched
+    when its version moved, Drive couldn't tell, or one of its shards has no
+    index the current encoder can serve.
+    """
+    sids = {src.spreadsheet_id for src in sources}
+    if MODE != "drive":
+        return sids, {}
+    seen = _load_state().get("drive", {})
+    revisions = drive_versions(sids)
+    unindexed = {src.spreadsheet_id for src in sources if not indexed(src.shard)}
+    changed = {sid for sid in sids if sid not in revisions or seen.get(sid) != revisions[sid]} | unindexed
+    return changed, revisions
+
+
+def fingerprint(df: pd.DataFrame) -> str:
+    h = hashlib.sha1("\x1f".join(map(str, df.columns)).encode("utf-8"))
+    h.update(pd.util.hash_pandas_object(df.astype(str), index=False).to_numpy().tobytes())
+    return h.hexdigest()
+
+
+def values_changed(src, fp: str) -> bool:
+    if MODE == "off" or not indexed(src.shard):
+        return True
+    return _load_state().get("fingerprints", {}).get(src.shard) != fp
+
+
+def _poll_loop(sync):
+    while True:
+        time.sleep(POLL_INTERVAL * random.uniform(1 - POLL_JITTER, 1 + POLL_JITTER))
+        try:
+            sync()
+        except Exception:
+            logging.exception("Sync poller error")
+
+
+def start_poller(sync):
+    """Run sync() every SYNC_POLL_INTERVAL seconds with jitter (idempotent; no-op when unset)."""
+    global _poller
+    if POLL_INTERVAL <= 0:
+        return
+    with _poller_lock:
+        if _poller is None or not _poller.is_alive():
+            _poller = threading.Thread(target=_poll_loop, args=(sync,), name="sync-poller", daemon=True)
+            _poller.start()
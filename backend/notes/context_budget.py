@@ -0,0 +1,116 @@
+"""
+Context assembly for QA prompts.
+
+Retrieved rows ("col: value | ...", best first) are packed into at most
+RAG_CONTEXT_TOKENS tokens:
+  - rows whose cosine similarity is below RAG_MIN_SCORE_RATIO of the best
+    one are dropped (keyword-only hits have none and are kept);
+  - empty cells are dropped;
+  - a cell that every candidate row repeats is stated once, up front (as
+    long as those cells fit in a row's share of the budget);
+  - a row wider than RAG_CONTEXT_ROW_TOKENS (or than what is left) keeps the
+    cells that mention the question first, then the rest in column order.
+Token counts are an estimate (one per 4 letters/digits or punctuation mark),
+which runs a little above the Llama tokenizer -- close enough to budget by.
+"""
+import os, re
+
+CONTEXT_TOKENS = int(os.getenv("RAG_CONTEXT_TOKENS", "1200"))
+ROW_TOKENS = int(os.getenv("RAG_CONTEXT_ROW_TOKENS", "300"))
+MIN_SCORE_RATIO = float(os.getenv("RAG_MIN_SCORE_RATIO", "0.5"))
+_PIECE = re.compile(r"\w{1,4}|[^\w\s]")
+_WORD = re.compile(r"\w+")
+_EMPTY = {"", "none", "nan", "null", "-", "n/a"}
+
+
+def count_tokens(text: str) -> int:
+    return len(_PIECE.findall(text))
+
+
+def _cells(text: str):
+    cells = []
+    for seg in text.split(" | "):
+        col, sep, value = seg.partition(": ")
+        cells.append((col, value) if sep else ("", seg))
+    return cells
+
+
+def _fmt(cells) -> str:
+    return " | ".join(f"{c}: {v}" if c else v for c, v in cells)
+
+
+def _fit(label: str, cells, terms: set, limit: int):
+    """Cells of one row within `limit` tokens, question matches first, original order kept."""
+    rank = sorted(range(len(cells)),
+                  key=lambda i: (not terms & set(_WORD.findall(" ".join(cells[i]).lower())), i))
+    keep, used = set(), count_tokens(label)
+    for i in rank:
+        n = count_tokens(_fmt([cells[i]])) + 1  # + separator
+        if used + n <= limit:
+            keep.add(i)
+            used += n
+    return [cells[i] for i in sorted(keep)]
+
+
+def assemble(question: str, ctxs, budget: int = None, min_ratio: float = None):
+    """
+    (context block, rows used, stats). Rows keep their retrieval order; the
+    first row is always included, trimmed if it has to be.
+    """
+    budget = CONTEXT_TOKENS if budget is None else budget
+    min_ratio = MIN_SCORE_RATIO if min_ratio is None else min_ratio
+    stats = {"budget": budget, "rows_retrieved": len(ctxs), "rows_used": 0,
+             "rows_below_score": 0, "rows_over_budget": 0,
+             "cells_empty": 0, "cells_shared": 0, "cells_trimmed": 0, "context_tokens": 0}
+    if not ctxs:
+        return "", [], stats
+
+    # hybrid scores are RRF sums, which only say how many retrievers agreed,
+    # so the cutoff uses the cosine each row carries (plain score if none given)
+    cosines = [c.get("cosine", c["score"]) for c in ctxs]
+    top = max((s for s in cosines if s is not None), default=0)
+    rows = []
+    for c, cos in zip(ctxs, cosines):
+        if cos is not None and top > 0 and cos < top * min_ratio:
+            stats["rows_below_score"] += 1
+            continue
+        cells = _cells(c["text"])
+        kept = [(col, v) for col, v in cells if v.strip().lower() not in _EMPTY]
+        stats["cells_empty"] += len(cells) - len(kept)
+        rows.append((c, kept))
+
+    shared = []
+    if len(rows) > 1:
+        common = set(rows[0][1]).intersection(*(set(cells) for _, cells in rows[1:]))
+        shared = [cell for cell in rows[0][1] if cell in common]
+        # the shared line isn't trimmed, so it only pays off while it is a row's worth or less
+        if count_tokens(f"[all rows] {_fmt(shared)}") > min(ROW_TOKENS, budget // 2):
+            shared = []
+    lines = [f"[all rows] {_fmt(shared)}"] if shared else []
+    tokens = count_tokens(lines[0]) if shared else 0
+
+    terms = set(_WORD.findall(question.lower()))
+    used = []
+    for c, cells in rows:
+        if shared:
+            stats["cells_shared"] += len(cells)
+            cells = [cell for cell in cells if cell not in common]
+            stats["cells_shared"] -= len(cells)
+        label = f"[{c.get('source', 'Row')} row {c['row']}] "
+        line = label + _fmt(cells)
+        n = count_tokens(line)
+        limit = min(ROW_TOKENS, budget - tokens)
+        if n > limit:
+            if used and budget - tokens < ROW_TOKENS // 2:
+                stats["rows_over_budget"] += 1
+                continue
+            fitted = _fit(label, cells, terms, limit)
+            stats["cells_trimmed"] += len(cells) - len(fitted)
+            line = label + _fmt(fitted)
+            n = count_tokens(line)
+        lines.append(line)
+        used.append(c)
+        tokens += n
+
+    stats.update(rows_used=len(used), context_tokens=tokens)
+    return "\n\n".join(lines), used, stats
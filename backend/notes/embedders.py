@@ -0,0 +1,157 @@
+"""
+Embedding backends for the sheet index.
+
+EMBED_BACKEND picks how EMBED_MODEL runs on CPU:
+  torch (default)  the SentenceTransformer as-is
+  torch-int8       its Linear layers dynamically quantised to int8 (no extra packages)
+  onnx             the transformer exported to ONNX and run by onnxruntime
+  onnx-int8        that export with int8 weights (onnxruntime.quantization)
+The ONNX export is written once to EMBED_ONNX_DIR, together with the
+tokenizer, and reused by every worker and restart. The backends' vectors are
+close but not identical, so index manifests and the embedding cache record
+encoder_id(): generations built by another backend are neither served nor
+patched, and switching backends re-embeds everything on the next sync.
+`python manage.py embed_check` compares a backend with the torch vectors.
+sentence-transformers (and with it torch) is imported by load(), not at import time.
+"""
+import os, re, json, logging
+from pathlib import Path
+import numpy as np
+
+from .index_store import INDEX_DIR
+
+EMBED_MODEL = os.getenv("EMBED_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+EMBED_BACKEND = os.getenv("EMBED_BACKEND", "torch").lower()
+ONNX_DIR = os.getenv("EMBED_ONNX_DIR") or str(INDEX_DIR / "onnx")
+BACKENDS = ("torch", "torch-int8", "onnx", "onnx-int8")
+_INPUTS = ("input_ids", "attention_mask", "token_type_ids")
+
+
+def encoder_id(backend: str = None) -> str:
+    """What built a vector: the model name, plus the backend unless it is plain torch."""
+    backend = backend or EMBED_BACKEND
+    return EMBED_MODEL if backend == "torch" else f"{EMBED_MODEL}@{backend}"
+
+
+def load(backend: str = None):
+    """An encoder with SentenceTransformer's encode()/get_sentence_embedding_dimension()."""
+    backend = backend or EMBED_BACKEND
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown EMBED_BACKEND {backend!r}; expected one of {', '.join(BACKENDS)}")
+    if backend.startswith("onnx"):
+        return OnnxEncoder.load(EMBED_MODEL, quantized=backend == "onnx-int8")
+    from sentence_transformers import SentenceTransformer
+    model = SentenceTransformer(EMBED_MODEL, device="cpu")
+    if backend == "torch-int8":
+        import torch
+        transformer = model[0]
+        transformer.auto_model = torch.ao.quantization.quantize_dynamic(
+            transformer.auto_model, {torch.nn.Linear}, dtype=torch.qint8)
+    return model
+
+
+# -------------------------
+# ONNX Runtime
+# -------------------------
+def _export_dir(model_name: str) -> Path:
+    return Path(ONNX_DIR) / re.sub(r"[^A-Za-z0-9._-]+", "--", model_name)
+
+
+def _check_pooling(model):
+    """Only transformer -> mean pooling (-> normalize) pipelines can be rebuilt around the export."""
+    names = [type(m).__name__ for m in model]
+    pooling = model[1].get_pooling_mode_str() if len(model) > 1 and names[1] == "Pooling" else None
+    if names[0] != "Transformer" or pooling != "mean" or any(n != "Normalize" for n in names[2:]):
+        raise ValueError(f"EMBED_BACKEND=onnx supports mean-pooled sentence-transformers only, "
+                         f"{EMBED_MODEL} is {' -> '.join(names)}")
+
+
+def export(model_name: str = None):
+    """Export the model's transformer to ONNX (fp32 and int8) next to its tokenizer; returns the directory."""
+    import torch
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+    from sentence_transformers import SentenceTransformer
+
+    model_name = model_name or EMBED_MODEL
+    out = _export_dir(model_name)
+    out.mkdir(parents=True, exist_ok=True)
+    st = SentenceTransformer(model_name, device="cpu")
+    _check_pooling(st)
+    auto_model = st[0].auto_model.eval()
+    sample = st.tokenizer(["export sample"], return_tensors="pt")
+    names = [n for n in _INPUTS if n in sample]
+
+    class _Hidden(torch.nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.model = auto_model
+
+        def forward(self, *tensors):
+            return self.model(**dict(zip(names, tensors))).last_hidden_state
+
+    axes = {n: {0: "batch", 1: "tokens"} for n in names + ["last_hidden_state"]}
+    tmp = out / f".model.{os.getpid()}.onnx"
+    with torch.no_grad():
+        torch.onnx.export(_Hidden(), tuple(sample[n] for n in names), str(tmp), input_names=names,
+                          output_names=["last_hidden_state"], dynamic_axes=axes, opset_version=17,
+                          dynamo=False)
+    os.replace(tmp, out / "model.onnx")
+    tmp = out / f".model-int8.{os.getpid()}.onnx"
+    quantize_dynamic(str(out / "model.onnx"), str(tmp), weight_type=QuantType.QInt8)
+    os.replace(tmp, out / "model-int8.onnx")
+    st.tokenizer.save_pretrained(str(out))
+    # written last: marks the export complete for other workers
+    tmp = out / f".embedder.{os.getpid()}.json"
+    tmp.write_text(json.dumps({"model": model_name, "dim": st.get_sentence_embedding_dimension(),
+                               "max_seq_length": st.max_seq_length, "inputs": names}))
+    os.replace(tmp, out / "embedder.json")
+    logging.info("Exported %s to ONNX in %s", model_name, out)
+    return out
+
+
+class OnnxEncoder:
+    """encode() of a mean-pooled sentence-transformer over an ONNX Runtime session."""
+
+    def __init__(self, path, tokenizer, dim: int, max_seq_length: int):
+        import onnxruntime as ort
+        self.session = ort.InferenceSession(str(path), providers=["CPUExecutionProvider"])
+        self.inputs = {i.name for i in self.session.get_inputs()}
+        self.tokenizer = tokenizer
+        self.dim = dim
+        self.max_seq_length = max_seq_length
+
+    @classmethod
+    def load(cls, model_name: str, quantized: bool = False):
+        try:
+            import onnxruntime  # noqa: F401
+        except ImportError as e:
+            raise RuntimeError("EMBED_BACKEND=onnx needs onnxruntime (pip install onnxruntime onnx)") from e
+        from transformers import AutoTokenizer
+
+        d = _export_dir(model_name)
+        if not (d / "embedder.json").exists():
+            export(model_name)
+        meta = json.loads((d / "embedder.json").read_text())
+        return cls(d / ("model-int8.onnx" if quantized else "model.onnx"),
+                   AutoTokenizer.from_pretrained(str(d)), meta["dim"], meta["max_seq_length"])
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dim
+
+    def encode(self, sentences, batch_size: int = 32, convert_to_numpy: bool = True,
+               normalize_embeddings: bool = False, **kwargs):
+        single = isinstance(sentences, str)
+        sentences = [sentences] if single else list(sentences)
+        out = np.empty((len(sentences), self.dim), dtype="float32")
+        # longest first, like SentenceTransformer, so batches pad little
+        order = np.argsort([-len(s) for s in sentences], kind="stable")
+        for start in range(0, len(sentences), batch_size):
+            idx = order[start:start + batch_size]
+            enc = self.tokenizer([sentences[i] for i in idx], padding=True, truncation=True,
+                                 max_length=self.max_seq_length, return_tensors="np")
+            hidden = self.session.run(None, {k: v.astype("int64") for k, v in enc.items() if k in self.inputs})[0]
+            mask = enc["attention_mask"][..., None].astype("float32")
+            out[idx] = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        if normalize_embeddings:
+            out /= np.clip(np.linalg.norm(out, axis=1, keepdims=True), 1e-12, None)
+        return out[0] if single else out
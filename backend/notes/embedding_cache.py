@@ -0,0 +1,103 @@
+"""
+Persistent embedding cache: sha1(row text) -> float32 vector, per model.
+
+A SQLite file on a durable path (EMBED_CACHE_PATH; put it on a volume that
+survives redeploys), so rebuilding an index after a restart, a full sync or a
+new RAG_SOURCES layout only encodes text that has never been embedded. Keys
+are the same hashes build_index already computes. Past EMBED_CACHE_MAX_ROWS
+the oldest entries are evicted.
+"""
+import os, time, sqlite3, threading, logging
+from contextlib import contextmanager
+import numpy as np
+
+from .index_store import INDEX_DIR
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS embeddings (
+    model TEXT NOT NULL,
+    hash BLOB NOT NULL,
+    vec BLOB NOT NULL,
+    added INTEGER NOT NULL,
+    PRIMARY KEY (model, hash)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS embeddings_added ON embeddings (added);
+"""
+_LOOKUP_CHUNK = 500  # stay under SQLite's bound-parameter limit
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+class EmbeddingCache:
+    def __init__(self, path, max_rows: int = 1_000_000):
+        self.path = str(path)
+        self.max_rows = max_rows
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript(_SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        # one short-lived connection per call: builds run on background threads
+        db = sqlite3.connect(self.path, timeout=30)
+        try:
+            with db:  # commit on success
+                yield db
+        finally:
+            db.close()
+
+    def get_many(self, model: str, hashes, dim: int) -> dict:
+        """{hex hash: vector} for the hashes that are cached with this model and dim."""
+        keys = [bytes.fromhex(h) for h in hashes]
+        out = {}
+        with self._connect() as db:
+            for start in range(0, len(keys), _LOOKUP_CHUNK):
+                chunk = keys[start:start + _LOOKUP_CHUNK]
+                rows = db.execute(
+                    f"SELECT hash, vec FROM embeddings WHERE model = ? AND hash IN ({','.join('?' * len(chunk))})",
+                    [model, *chunk],
+                )
+                for h, vec in rows:
+                    if len(vec) == dim * 4:
+                        out[h.hex()] = np.frombuffer(vec, dtype="float32")
+        return out
+
+    def put_many(self, model: str, hashes, vectors: np.ndarray):
+        now = int(time.time())
+        vectors = np.ascontiguousarray(vectors, dtype="float32")
+        with self._connect() as db:
+            db.executemany(
+                "INSERT OR IGNORE INTO embeddings (model, hash, vec, added) VALUES (?, ?, ?, ?)",
+                ((model, bytes.fromhex(h), v.tobytes(), now) for h, v in zip(hashes, vectors)),
+            )
+            excess = db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0] - self.max_rows
+            if excess > 0:
+                db.execute("DELETE FROM embeddings WHERE (model, hash) IN "
+                           "(SELECT model, hash FROM embeddings ORDER BY added LIMIT ?)", (excess,))
+
+    def stats(self) -> dict:
+        with self._connect() as db:
+            rows = db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        return {"path": self.path, "rows": rows,
+                "bytes": os.path.getsize(self.path) if os.path.exists(self.path) else 0}
+
+
+def get_cache():
+    """Process-wide cache from the environment, or None with EMBED_CACHE=off."""
+    global _cache
+    if os.getenv("EMBED_CACHE", "on").lower() in ("off", "false", "0"):
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                try:
+                    _cache = EmbeddingCache(
+                        os.getenv("EMBED_CACHE_PATH", str(INDEX_DIR / "embeddings.sqlite3")),
+                        max_rows=int(os.getenv("EMBED_CACHE_MAX_ROWS", "1000000")),
+                    )
+                except sqlite3.Error:
+                    logging.exception("Embedding cache unavailable; embedding without it")
+                    return None
+    return _cache
@@ -0,0 +1,117 @@
+"""
+Process-wide Google Sheets client factory.
+
+Credentials are parsed once per scope and kept fresh by a background thread,
+so requests never pay for a token refresh. httplib2 connections are not
+thread-safe, so each thread gets its own built service (and keep-alive
+connection) per scope; building it happens once per thread, not per call.
+"""
+import os, json, time, threading, datetime as dt, logging
+import httplib2
+import google_auth_httplib2
+from google.oauth2 import service_account
+from googleapiclient.discovery import build
+from googleapiclient.http import HttpRequest
+
+from . import metrics
+
+SCOPE_READONLY = "https://www.googleapis.com/auth/spreadsheets.readonly"
+SCOPE_READWRITE = "https://www.googleapis.com/auth/spreadsheets"
+SCOPE_DRIVE_METADATA = "https://www.googleapis.com/auth/drive.metadata.readonly"
+HTTP_TIMEOUT = int(os.getenv("SHEETS_HTTP_TIMEOUT", "30"))
+REFRESH_MARGIN = dt.timedelta(minutes=5)  # refresh tokens this long before they expire
+
+_creds = {}
+_creds_lock = threading.Lock()
+_refresh_lock = threading.Lock()
+_refresher = None
+_local = threading.local()
+
+
+def _load_credentials(scope: str):
+    # Try to load from environment variable first (for production)
+    google_creds_json = os.getenv("GOOGLE_SHEETS_CREDENTIALS")
+    if google_creds_json:
+        try:
+            creds_info = json.loads(google_creds_json)
+            return service_account.Credentials.from_service_account_info(creds_info, scopes=[scope])
+        except (json.JSONDecodeError, KeyError) as e:
+            raise ValueError(f"Invalid GOOGLE_SHEETS_CREDENTIALS JSON: {e}")
+    # Fallback to file path (for local development)
+    creds_path = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
+    if not creds_path:
+        raise ValueError("Either GOOGLE_SHEETS_CREDENTIALS or GOOGLE_APPLICATION_CREDENTIALS must be set")
+    return service_account.Credentials.from_service_account_file(creds_path, scopes=[scope])
+
+
+def get_credentials(scope: str = SCOPE_READONLY):
+    creds = _creds.get(scope)
+    if creds is not None:
+        return creds
+    with _creds_lock:
+        if scope not in _creds:
+            _creds[scope] = _load_credentials(scope)
+            _start_refresher()
+        return _creds[scope]
+
+
+def _refresh_due(creds) -> bool:
+    if not creds.token or creds.expiry is None:
+        return True
+    # google-auth keeps expiry as a naive UTC datetime
+    return creds.expiry - dt.datetime.utcnow() < REFRESH_MARGIN
+
+
+def refresh_credentials(force: bool = False):
+    """Refresh any cached credentials that are missing a token or close to expiry."""
+    request = google_auth_httplib2.Request(httplib2.Http(timeout=HTTP_TIMEOUT))
+    for scope, creds in list(_creds.items()):
+        with _refresh_lock:
+            if force or _refresh_due(creds):
+                try:
+                    creds.refresh(request)
+                except Exception:
+                    logging.exception("Google token refresh failed for %s", scope)
+
+
+def _refresh_loop():
+    while True:
+        refresh_credentials()
+        time.sleep(60)
+
+
+def _start_refresher():
+    global _refresher
+    # is_alive: a refresher started before a fork doesn't exist in the child
+    if _refresher is None or not _refresher.is_alive():
+        _refresher = threading.Thread(target=_refresh_loop, name="sheets-token-refresh", daemon=True)
+        _refresher.start()
+
+
+class _MeteredRequest(HttpRequest):
+    """Counts and times every API call by method (sheets.spreadsheets.values.get, ...)."""
+    def execute(self, *args, **kwargs):
+        with metrics.external_call("google", self.methodId or "unknown"):
+            return super().execute(*args, **kwargs)
+
+
+def _service(api: str, version: str, scope: str):
+    services = getattr(_local, "services", None)
+    if services is None:
+        services = _local.services = {}
+    svc = services.get((api, scope))
+    if svc is None:
+        http = google_auth_httplib2.AuthorizedHttp(get_credentials(scope), http=httplib2.Http(timeout=HTTP_TIMEOUT))
+        svc = services[(api, scope)] = build(api, version, http=http, cache_discovery=False,
+                                            requestBuilder=_MeteredRequest)
+    return svc
+
+
+def sheets_service(readonly: bool = True):
+    """Sheets v4 service for the calling thread, reusing credentials and connections."""
+    return _service("sheets", "v4", SCOPE_READONLY if readonly else SCOPE_READWRITE)
+
+
+def drive_service():
+    """Drive v3 service (file metadata only) for the calling thread."""
+    return _service("drive", "v3", SCOPE_DRIVE_METADATA)
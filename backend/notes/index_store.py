@@ -0,0 +1,263 @@
+"""
+On-disk index generations for the sheet RAG.
+
+The index is split into shards (one per configured sheet tab/range), each in
+its own directory under INDEX_DIR. Each build of a shard is written to its own
+generation directory and published by atomically replacing the shard's
+CURRENT, so readers never see a half-written index. A generation is
+plain arrays that every worker opens with mmap, so the vectors and row text
+live once in the page cache instead of once per gunicorn worker:
+
+    vectors.npy       float32 (rows, dim), L2-normalised
+    row_ids.npy       int64 sheet row numbers
+    hashes.npy        S40 sha1 of each row's text
+    text_offsets.npy  int64 (rows + 1) byte offsets into text.bin
+    text.bin          UTF-8 row text, concatenated
+    manifest.json     version, created_at, model, dim, rows, source, text_sha1, files, checksum
+    kw_*              BM25 postings and column-value keys (see keyword_index.py)
+    ann.faiss         HNSW / IVF-PQ index for large shards (see ann.py)
+"""
+import os, json, time, shutil, hashlib, logging
+from pathlib import Path
+import numpy as np
+
+from . import ann, keyword_index
+
+BASE_DIR = Path("/tmp")  # Use /tmp directory which is writable
+INDEX_DIR = Path(os.getenv("RAG_INDEX_DIR", str(BASE_DIR / "sheet_index")))
+KEEP_GENERATIONS = 2
+
+
+def shard_dir(shard: str) -> Path:
+    return INDEX_DIR / shard
+
+
+def current_version(shard: str):
+    try:
+        return (shard_dir(shard) / "CURRENT").read_text().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def text_digest(texts) -> str:
+    """sha1 over the row texts in order: tells whether a generation's display text is still current."""
+    h = hashlib.sha1()
+    for t in texts:
+        b = t.encode("utf-8")
+        h.update(len(b).to_bytes(8, "little"))
+        h.update(b)
+    return h.hexdigest()
+
+
+def current_manifest(shard: str):
+    """The manifest of the shard's CURRENT generation, or None (no index, or unreadable)."""
+    version = current_version(shard)
+    if version is None:
+        return None
+    try:
+        return json.loads((shard_dir(shard) / version / "manifest.json").read_text())
+    except (OSError, ValueError):
+        return None
+
+
+def _checksum(d: Path, files) -> str:
+    h = hashlib.sha256()
+    for name in files:
+        h.update(name.encode())
+        with open(d / name, "rb") as f:
+            while chunk := f.read(1 << 20):
+                h.update(chunk)
+    return "sha256:" + h.hexdigest()
+
+
+def publish_generation(shard: str, vectors: np.ndarray, row_ids, hashes, texts, model: str,
+                       backend: str = "torch", source: dict = None, keywords: dict = None,
+                       ann_index=None, ann_meta: dict = None) -> str:
+    """Write a new generation next to the shard's live one and point CURRENT at it."""
+    base = shard_dir(shard)
+    version = str(time.time_ns())
+    tmp_dir = base / f".{version}.tmp"
+    tmp_dir.mkdir(parents=True)
+
+    encoded = [t.encode("utf-8") for t in texts]
+    offsets = np.zeros(len(encoded) + 1, dtype="int64")
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+
+    np.save(tmp_dir / "vectors.npy", np.ascontiguousarray(vectors, dtype="float32"))
+    np.save(tmp_dir / "row_ids.npy", np.asarray(row_ids, dtype="int64"))
+    np.save(tmp_dir / "hashes.npy", np.asarray(hashes, dtype="S40"))
+    np.save(tmp_dir / "text_offsets.npy", offsets)
+    (tmp_dir / "text.bin").write_bytes(b"".join(encoded))
+    if keywords is not None:
+        keyword_index.save(tmp_dir, keywords)
+    if ann_index is not None:
+        ann.save(ann_index, tmp_dir / ann.FILENAME)
+    files = sorted(p.name for p in tmp_dir.iterdir())
+    (tmp_dir / "manifest.json").write_text(json.dumps({
+        "version": version, "created_at": time.time(), "model": model, "backend": backend,
+        "dim": int(vectors.shape[1]), "rows": len(encoded), "source": source or {},
+        "text_sha1": text_digest(texts),
+        "ann": ann_meta or {"kind": "flat"},
+        "files": files, "checksum": _checksum(tmp_dir, files),
+    }))
+    os.rename(tmp_dir, base / version)
+
+    tmp_current = base / f".CURRENT.{version}"
+    tmp_current.write_text(version)
+    os.replace(tmp_current, base / "CURRENT")
+
+    # open generations stay readable after unlink, so old dirs can go
+    old = sorted(p for p in base.iterdir() if p.is_dir() and not p.name.startswith("."))
+    for p in old[:-KEEP_GENERATIONS]:
+        shutil.rmtree(p, ignore_errors=True)
+    logging.info("Published %s index generation %s (%s rows)", shard, version, len(encoded))
+    return version
+
+
+class IndexGeneration:
+    """A published generation opened read-only via mmap."""
+
+    def __init__(self, shard: str, version: str):
+        d = shard_dir(shard) / version
+        self.path = d
+        self.shard = shard
+        self.version = version
+        self.manifest = json.loads((d / "manifest.json").read_text())
+        self.vectors = np.load(d / "vectors.npy", mmap_mode="r")
+        self.row_ids = np.load(d / "row_ids.npy", mmap_mode="r")
+        self.hashes = np.load(d / "hashes.npy", mmap_mode="r")
+        self._offsets = np.load(d / "text_offsets.npy", mmap_mode="r")
+        blob = d / "text.bin"
+        # np.memmap refuses zero-length files
+        self._text = np.memmap(blob, dtype=np.uint8, mode="r") if blob.stat().st_size else b""
+        self.keywords = keyword_index.KeywordIndex.open(d)
+        self.ann = ann.load(d / ann.FILENAME, self.ann_meta) if (d / ann.FILENAME).exists() else None
+
+    @classmethod
+    def current(cls, shard: str):
+        version = current_version(shard)
+        if not version:
+            return None
+        try:
+            return cls(shard, version)
+        except FileNotFoundError:
+            return None
+
+    @classmethod
+    def latest_valid(cls, shard: str, model: str = None, backend: str = None, verify: bool = True):
+        """
+        The newest loadable generation of a shard, CURRENT first, that was built
+        with `model` on `backend` and (with verify) still matches its manifest checksum.
+        """
+        current = current_version(shard)
+        try:
+            kept = sorted((p.name for p in shard_dir(shard).iterdir()
+                           if p.is_dir() and not p.name.startswith(".")), reverse=True)
+        except FileNotFoundError:
+            return None
+        for version in ([current] if current else []) + [v for v in kept if v != current]:
+            try:
+                gen = cls(shard, version)
+            except (OSError, ValueError) as e:
+                logging.warning("Skipping unreadable index generation %s/%s: %s", shard, version, e)
+                continue
+            if model and gen.model != model:
+                logging.warning("Skipping index generation %s/%s built with %s", shard, version, gen.model)
+                continue
+            if backend and gen.backend != backend:
+                logging.warning("Skipping index generation %s/%s built with the %s backend", shard, version, gen.backend)
+                continue
+            if verify and not gen.verify():
+                logging.warning("Skipping index generation %s/%s: checksum mismatch", shard, version)
+                continue
+            if version != current:
+                logging.warning("Falling back to index generation %s/%s (CURRENT is %s)", shard, version, current)
+            return gen
+        return None
+
+    def verify(self) -> bool:
+        """Re-hash the generation's files against the manifest (True for pre-checksum generations)."""
+        expected = self.manifest.get("checksum")
+        if not expected:
+            return True
+        try:
+            return _checksum(self.path, self.manifest.get("files", [])) == expected
+        except OSError:
+            return False
+
+    @property
+    def created_at(self) -> float:
+        return self.manifest.get("created_at") or int(self.version) / 1e9
+
+    @property
+    def model(self) -> str:
+        return self.manifest.get("model")
+
+    @property
+    def backend(self) -> str:
+        """Embedding backend that built the vectors (generations from before it was recorded: torch)."""
+        return self.manifest.get("backend") or "torch"
+
+    @property
+    def ann_meta(self) -> dict:
+        return self.manifest.get("ann") or {"kind": "flat"}
+
+    @property
+    def label(self) -> str:
+        """Human-readable source name (the tab), used in prompts and matches."""
+        return self.manifest.get("source", {}).get("label") or self.shard
+
+    def __len__(self):
+        return len(self.row_ids)
+
+    def text(self, pos: int) -> str:
+        return bytes(self._text[self._offsets[pos]:self._offsets[pos + 1]]).decode("utf-8")
+
+    def filter_mask(self, filters: dict):
+        """Rows whose columns equal every {column: value} in filters (case-insensitive), or None."""
+        if not filters:
+            return None
+        mask = np.zeros(len(self), dtype=bool)
+        if self.keywords is None:
+            return mask
+        mask[:] = True
+        for column, value in filters.items():
+            m = np.zeros(len(self), dtype=bool)
+            m[self.keywords.rows_with(keyword_index.field_key(column, value))] = True
+            mask &= m
+        return mask
+
+    def keyword_search(self, tokens, k: int, allowed: np.ndarray = None):
+        """BM25 (scores, positions) for one tokenised query; empty without a keyword index."""
+        if self.keywords is None or not tokens:
+            return np.empty(0, dtype="float32"), np.empty(0, dtype="int64")
+        return self.keywords.search(tokens, k, allowed)
+
+    def search(self, qv: np.ndarray, k: int, allowed: np.ndarray = None):
+        """
+        Inner-product search, faiss-style: (scores, positions), -1 padded.
+        Uses the ANN index when there is one; filtered searches score just the
+        allowed rows exactly.
+        """
+        qv = np.atleast_2d(np.asarray(qv, dtype="float32"))
+        if self.ann is not None and allowed is None:
+            return ann.search(self.ann, qv, k, vectors=self.vectors)
+        return self.exact_search(qv, k, allowed)
+
+    def exact_search(self, qv: np.ndarray, k: int, allowed: np.ndarray = None):
+        qv = np.atleast_2d(np.asarray(qv, dtype="float32"))
+        D = np.full((len(qv), k), -np.inf, dtype="float32")
+        I = np.full((len(qv), k), -1, dtype="int64")
+        rows = np.flatnonzero(allowed) if allowed is not None else None
+        n = len(self) if rows is None else len(rows)
+        if n == 0:
+            return D, I
+        scores = qv @ (self.vectors if rows is None else self.vectors[rows]).T
+        kk = min(k, n)
+        top = np.argpartition(-scores, kk - 1, axis=1)[:, :kk]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        top = np.take_along_axis(top, order, axis=1)
+        I[:, :kk] = top if rows is None else rows[top]
+        D[:, :kk] = np.take_along_axis(top_scores, order, axis=1)
+        return D, I
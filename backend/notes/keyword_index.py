@@ -0,0 +1,112 @@
+"""
+Keyword (BM25) side of the hybrid retriever.
+
+Built alongside the vectors for every index generation and stored as CSR
+postings arrays, so it is mmap-shared like the rest of the generation:
+
+    kw_vocab.json     term -> term id
+    kw_offsets.npy    int64 (terms + 1) offsets into kw_docs / kw_tf
+    kw_docs.npy       int32 row positions, sorted per term
+    kw_tf.npy         float32 term frequency per posting
+    kw_doclen.npy     float32 tokens per row
+
+Besides word tokens the vocab holds one field key per "column = value" cell,
+which is what the metadata pre-filter looks up; field keys never come out of
+tokenize(), so they don't take part in scoring.
+"""
+import re, json
+from pathlib import Path
+import numpy as np
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+_TOKEN = re.compile(r"\w+")
+
+
+def tokenize(text: str):
+    return _TOKEN.findall(text.lower())
+
+
+def field_key(column: str, value) -> str:
+    return f"={str(column).strip().lower()}\t{str(value).strip().lower()}"
+
+
+def build(token_lists, field_lists):
+    """CSR postings over word tokens and field keys, one entry per row."""
+    vocab, docs, terms, tfs = {}, [], [], []
+    doclen = np.zeros(len(token_lists), dtype="float32")
+    for pos, (tokens, fields) in enumerate(zip(token_lists, field_lists)):
+        doclen[pos] = len(tokens)
+        counts = {}
+        for t in tokens:
+            counts[t] = counts.get(t, 0) + 1
+        for f in fields:
+            counts[f] = 1
+        for t, n in counts.items():
+            docs.append(pos)
+            terms.append(vocab.setdefault(t, len(vocab)))
+            tfs.append(n)
+    terms = np.asarray(terms, dtype="int64")
+    order = np.argsort(terms, kind="stable")  # keeps row positions sorted within a term
+    offsets = np.zeros(len(vocab) + 1, dtype="int64")
+    np.cumsum(np.bincount(terms, minlength=len(vocab)), out=offsets[1:])
+    return {
+        "vocab": vocab,
+        "offsets": offsets,
+        "docs": np.asarray(docs, dtype="int32")[order],
+        "tf": np.asarray(tfs, dtype="float32")[order],
+        "doclen": doclen,
+    }
+
+
+def save(d: Path, kw: dict):
+    (d / "kw_vocab.json").write_text(json.dumps(kw["vocab"]))
+    for name in ("offsets", "docs", "tf", "doclen"):
+        np.save(d / f"kw_{name}.npy", kw[name])
+
+
+class KeywordIndex:
+    """Postings of one generation, opened via mmap."""
+
+    def __init__(self, d: Path):
+        self.vocab = json.loads((d / "kw_vocab.json").read_text())
+        self.offsets = np.load(d / "kw_offsets.npy", mmap_mode="r")
+        self.docs = np.load(d / "kw_docs.npy", mmap_mode="r")
+        self.tf = np.load(d / "kw_tf.npy", mmap_mode="r")
+        self.doclen = np.load(d / "kw_doclen.npy", mmap_mode="r")
+        self.avgdl = float(self.doclen.mean()) if len(self.doclen) else 0.0
+
+    @classmethod
+    def open(cls, d: Path):
+        """None for generations written before the keyword index existed."""
+        return cls(d) if (d / "kw_vocab.json").exists() else None
+
+    def _postings(self, term: str):
+        tid = self.vocab.get(term)
+        if tid is None:
+            return None, None
+        lo, hi = self.offsets[tid], self.offsets[tid + 1]
+        return self.docs[lo:hi], self.tf[lo:hi]
+
+    def rows_with(self, key: str) -> np.ndarray:
+        docs, _ = self._postings(key)
+        return np.asarray(docs if docs is not None else [], dtype="int64")
+
+    def search(self, tokens, k: int, allowed: np.ndarray = None):
+        """BM25 top-k: (scores, positions), best first, only rows with score > 0."""
+        n = len(self.doclen)
+        scores = np.zeros(n, dtype="float32")
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * np.asarray(self.doclen) / (self.avgdl or 1.0))
+        for term in set(tokens):
+            docs, tf = self._postings(term)
+            if docs is None:
+                continue
+            idf = np.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+            scores[docs] += idf * tf * (BM25_K1 + 1) / (tf + norm[docs])
+        if allowed is not None:
+            scores[~allowed] = 0
+        hits = np.flatnonzero(scores > 0)
+        if len(hits) > k:
+            hits = hits[np.argpartition(-scores[hits], k - 1)[:k]]
+        hits = hits[np.argsort(-scores[hits], kind="stable")]
+        return scores[hits], hits
@@ -0,0 +1,112 @@
+"""
+Recall vs latency of the ANN index modes against exact search.
+
+    python manage.py ann_report [--shard NAME] [--kinds flat,hnsw,ivfpq] [--k 10]
+                                [--nprobe 4,16,64] [--ef 32,64,128] [--rerank 1,10] [--json]
+
+Runs on the vectors of the live index generation(s). Queries are stored row
+vectors with a little noise, so no embedder or network is needed.
+"""
+import json, time
+import numpy as np
+import faiss
+from django.core.management.base import BaseCommand, CommandError
+
+from notes import ann
+from notes.index_store import IndexGeneration
+from notes.sheets_rag import rag_sources
+
+
+def _ints(s: str):
+    return [int(x) for x in s.split(",") if x.strip()]
+
+
+def _queries(vectors: np.ndarray, n: int, noise: float) -> np.ndarray:
+    rng = np.random.default_rng(0)
+    q = np.asarray(vectors[rng.choice(len(vectors), min(n, len(vectors)), replace=False)], dtype="float32")
+    q = q + rng.normal(scale=noise, size=q.shape).astype("float32")
+    return q / np.linalg.norm(q, axis=1, keepdims=True)
+
+
+def _timed(search, queries: np.ndarray, k: int):
+    """Search one query at a time, like the request path: (positions, per-query ms)."""
+    found, ms = [], []
+    for q in queries:
+        t0 = time.perf_counter()
+        _, I = search(q[None, :], k)
+        ms.append((time.perf_counter() - t0) * 1000)
+        found.append(I[0])
+    return np.stack(found), np.asarray(ms)
+
+
+def _recall(found: np.ndarray, truth: np.ndarray) -> float:
+    hits = sum(len(set(f[f != -1]) & set(t[t != -1])) for f, t in zip(found, truth))
+    return hits / max(1, int((truth != -1).sum()))
+
+
+class Command(BaseCommand):
+    help = "Report recall@k, latency and memory of the ANN index modes against exact search."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--shard", help="Shard to test (default: every configured source)")
+        parser.add_argument("--kinds", default="flat,hnsw,ivfpq")
+        parser.add_argument("--k", type=int, default=10)
+        parser.add_argument("--queries", type=int, default=200)
+        parser.add_argument("--noise", type=float, default=0.05)
+        parser.add_argument("--nprobe", default="4,16,64")
+        parser.add_argument("--ef", default="32,64,128")
+        parser.add_argument("--rerank", default="1,10", help="IVF-PQ re-rank factors (1 = PQ scores only)")
+        parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+
+    def handle(self, *args, **opts):
+        shards = [opts["shard"]] if opts["shard"] else [s.shard for s in rag_sources()]
+        k, report = opts["k"], []
+        for shard in shards:
+            gen = IndexGeneration.current(shard)
+            if gen is None or not len(gen):
+                raise CommandError(f"No index generation for shard {shard}; run a sync first.")
+            queries = _queries(gen.vectors, opts["queries"], opts["noise"])
+            truth, flat_ms = _timed(gen.exact_search, queries, k)
+            flat_bytes = int(gen.vectors.nbytes)
+
+            for kind in opts["kinds"].split(","):
+                kind = kind.strip()
+                if kind == "flat":
+                    report.append(self._row(shard, len(gen), "flat", {}, 1.0, flat_ms, flat_bytes, 0.0))
+                    continue
+                t0 = time.perf_counter()
+                index, meta = ann.build(np.asarray(gen.vectors), kind=kind)
+                build_s = time.perf_counter() - t0
+                size = ann.index_bytes(index)
+                if kind == "hnsw":
+                    sweep = [("ef_search", ef) for ef in _ints(opts["ef"])]
+                else:
+                    sweep = [("nprobe", p) for p in _ints(opts["nprobe"])]
+                for knob, value in sweep:
+                    if knob == "ef_search":
+                        index.hnsw.efSearch = value
+                    else:
+                        faiss.extract_index_ivf(index).nprobe = value
+                    for rerank in (_ints(opts["rerank"]) if kind == "ivfpq" else [1]):
+                        params = {**meta, knob: value, **({"rerank": rerank} if kind == "ivfpq" else {})}
+                        found, ms = _timed(
+                            lambda q, kk: ann.search(index, q, kk, vectors=gen.vectors, rerank=rerank), queries, k)
+                        report.append(self._row(shard, len(gen), kind, params,
+                                                _recall(found, truth), ms, size, build_s))
+
+        if opts["json"]:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        self.stdout.write(f"{'shard':<28} {'rows':>8} {'mode':<7} {'params':<44} "
+                          f"{'recall@' + str(k):>9} {'p50 ms':>8} {'p95 ms':>8} {'MB':>8}")
+        for r in report:
+            params = ",".join(f"{a}={b}" for a, b in r["params"].items() if a not in ("kind", "trained_rows"))
+            self.stdout.write(f"{r['shard']:<28} {r['rows']:>8} {r['mode']:<7} {params:<44} "
+                              f"{r['recall']:>9.3f} {r['p50_ms']:>8.3f} {r['p95_ms']:>8.3f} {r['mb']:>8.1f}")
+
+    @staticmethod
+    def _row(shard, rows, mode, params, recall, ms, size, build_s):
+        return {"shard": shard, "rows": rows, "mode": mode, "params": params,
+                "recall": round(recall, 4), "p50_ms": float(np.percentile(ms, 50)),
+                "p95_ms": float(np.percentile(ms, 95)), "mb": size / 2**20,
+                "build_s": round(build_s, 2)}
@@ -0,0 +1,87 @@
+"""
+Worker startup time and memory per HEYSHEET_WORKER_ROLE.
+
+    python manage.py boot_profile [--roles web,all,qa] [--warm] [--top 10] [--json]
+
+Each role is measured in a fresh interpreter, the way a gunicorn worker
+starts: Django setup plus the URLconf (which imports the views), then RSS and
+which heavy packages got imported. "qa" workers also load the embedder at
+boot (EMBEDDER_PRELOAD defaults on for them), so that is timed too; --warm
+times it for "all" workers as well. --top lists the slowest top-level imports
+from python -X importtime.
+"""
+import os, sys, json, subprocess
+from django.core.management.base import BaseCommand, CommandError
+
+HEAVY = ("torch", "sentence_transformers", "transformers", "onnxruntime", "faiss", "pandas", "numpy", "groq")
+
+_CHILD = """
+import sys, json, time, importlib
+t0 = time.perf_counter()
+from django.core.wsgi import get_wsgi_application
+get_wsgi_application()
+from django.conf import settings
+importlib.import_module(settings.ROOT_URLCONF)
+from notes import metrics
+out = {"boot_s": time.perf_counter() - t0, "rss_mb": metrics.rss_mb()}
+if %(warm)r:
+    t0 = time.perf_counter()
+    from notes.sheets_rag import warm_embedder
+    warm_embedder()
+    out.update(qa_load_s=time.perf_counter() - t0, qa_rss_mb=metrics.rss_mb())
+out["heavy"] = [m for m in %(heavy)r if m in sys.modules]
+print(json.dumps(out))
+"""
+
+
+def _slowest_imports(stderr: str, top: int) -> list:
+    """Top-level packages by cumulative import time, from -X importtime output."""
+    out = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if cumulative.strip().isdigit() and not name.startswith("  "):
+            out.append((name.strip(), int(cumulative) / 1e6))
+    return sorted(out, key=lambda x: -x[1])[:top]
+
+
+class Command(BaseCommand):
+    help = "Measure worker boot time and RSS for each HEYSHEET_WORKER_ROLE in fresh interpreters."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--roles", default="web,all,qa")
+        parser.add_argument("--warm", action="store_true", help="Also load the embedder in 'all' workers")
+        parser.add_argument("--top", type=int, default=10, help="Slowest top-level imports to list per role")
+        parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+
+    def handle(self, *args, **opts):
+        report = []
+        for role in [r.strip() for r in opts["roles"].split(",") if r.strip()]:
+            warm = role == "qa" or (role == "all" and opts["warm"])
+            proc = subprocess.run(
+                [sys.executable, "-X", "importtime", "-W", "ignore", "-c",
+                 _CHILD % {"warm": warm, "heavy": HEAVY}],
+                env={**os.environ, "HEYSHEET_WORKER_ROLE": role}, capture_output=True, text=True,
+            )
+            if proc.returncode != 0:
+                errors = [l for l in proc.stderr.splitlines() if not l.startswith("import time:")]
+                raise CommandError(f"Role {role} failed to boot:\n" + "\n".join(errors[-20:]))
+            row = {"role": role, **json.loads(proc.stdout.strip().splitlines()[-1]),
+                   "slowest_imports": _slowest_imports(proc.stderr, opts["top"])}
+            report.append(row)
+
+        if opts["json"]:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        self.stdout.write(f"{'role':<6} {'boot s':>8} {'RSS MB':>8} {'QA load s':>10} {'QA RSS MB':>10}  heavy imports")
+        for r in report:
+            qa_s = f"{r['qa_load_s']:>10.2f}" if "qa_load_s" in r else f"{'-':>10}"
+            qa_mb = f"{r['qa_rss_mb']:>10.1f}" if "qa_rss_mb" in r else f"{'-':>10}"
+            self.stdout.write(f"{r['role']:<6} {r['boot_s']:>8.2f} {r['rss_mb']:>8.1f} {qa_s} {qa_mb}  "
+                              f"{', '.join(r['heavy']) or '-'}")
+        for r in report:
+            if r["slowest_imports"]:
+                self.stdout.write(f"\n{r['role']}: slowest imports (cumulative s; the QA load included when timed)")
+                for name, seconds in r["slowest_imports"]:
+                    self.stdout.write(f"  {seconds:>7.3f}  {name}")
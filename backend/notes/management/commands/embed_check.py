@@ -0,0 +1,134 @@
+"""
+Accuracy and speed of an embedding backend against the SentenceTransformer.
+
+    python manage.py embed_check [--backend onnx-int8] [--rows 2000] [--queries 200]
+                                 [--k 10] [--texts FILE] [--json]
+
+Encodes the same texts with the torch reference and the backend (default
+EMBED_BACKEND) and reports how close the vectors stay: cosine between the
+two encodings of each row and query, and how many of the reference's top-k
+rows the backend's search still finds. Texts are the live index rows of every
+source (or one per line from --texts); queries are their first few words.
+Fails when the mean cosine or the top-k overlap is below --min-cosine /
+--min-overlap, so it can gate a switch of EMBED_BACKEND.
+"""
+import json, time
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from notes import embedders
+from notes.index_store import IndexGeneration
+from notes.sheets_rag import EMBED_BATCH_SIZE, rag_sources
+
+
+def _index_texts(limit: int) -> list:
+    texts = []
+    for src in rag_sources():
+        gen = IndexGeneration.current(src.shard)
+        if gen is not None:
+            texts.extend(gen.text(i) for i in range(len(gen)))
+    rng = np.random.default_rng(0)
+    if len(texts) > limit:
+        texts = [texts[i] for i in sorted(rng.choice(len(texts), limit, replace=False))]
+    return texts
+
+
+def _queries(texts: list, n: int) -> list:
+    rng = np.random.default_rng(1)
+    picks = rng.choice(len(texts), min(n, len(texts)), replace=False)
+    return [" ".join(texts[i].split()[:rng.integers(3, 9)]) for i in picks]
+
+
+def _encode(model, texts: list):
+    """(row vectors, rows/s) with the batch settings build_index uses."""
+    model.encode(texts[:8], batch_size=EMBED_BATCH_SIZE, convert_to_numpy=True, normalize_embeddings=True)
+    t0 = time.perf_counter()
+    vectors = model.encode(texts, batch_size=EMBED_BATCH_SIZE, convert_to_numpy=True, normalize_embeddings=True)
+    return np.asarray(vectors, dtype="float32"), len(texts) / (time.perf_counter() - t0)
+
+
+def _query_vectors(model, queries: list):
+    out, ms = [], []
+    for q in queries:
+        t0 = time.perf_counter()
+        out.append(model.encode([q], convert_to_numpy=True, normalize_embeddings=True)[0])
+        ms.append((time.perf_counter() - t0) * 1000)
+    return np.asarray(out, dtype="float32"), np.asarray(ms)
+
+
+def _topk(queries: np.ndarray, rows: np.ndarray, k: int) -> np.ndarray:
+    return np.argsort(-(queries @ rows.T), axis=1)[:, :k]
+
+
+class Command(BaseCommand):
+    help = "Compare an embedding backend's vectors, search results and speed with the SentenceTransformer."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--backend", default=embedders.EMBED_BACKEND, choices=embedders.BACKENDS)
+        parser.add_argument("--rows", type=int, default=2000, help="Index rows to encode (sampled)")
+        parser.add_argument("--queries", type=int, default=200)
+        parser.add_argument("--k", type=int, default=10)
+        parser.add_argument("--texts", help="Encode the lines of this file instead of the index rows")
+        parser.add_argument("--min-cosine", type=float, default=0.98)
+        parser.add_argument("--min-overlap", type=float, default=0.9)
+        parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+
+    def handle(self, *args, **opts):
+        if opts["texts"]:
+            with open(opts["texts"], encoding="utf-8") as f:
+                texts = [line.strip() for line in f if line.strip()][:opts["rows"]]
+        else:
+            texts = _index_texts(opts["rows"])
+        if not texts:
+            raise CommandError("No index rows to encode; run a sync first or pass --texts.")
+        queries = _queries(texts, opts["queries"])
+        k = min(opts["k"], len(texts))
+
+        results = {}
+        for name in ("torch", opts["backend"]):
+            if name in results:
+                continue
+            t0 = time.perf_counter()
+            model = embedders.load(name)
+            load_s = time.perf_counter() - t0
+            rows, rows_per_s = _encode(model, texts)
+            qvs, ms = _query_vectors(model, queries)
+            results[name] = {"rows": rows, "queries": qvs, "load_s": load_s, "rows_per_s": rows_per_s,
+                             "query_p50_ms": float(np.percentile(ms, 50)),
+                             "query_p95_ms": float(np.percentile(ms, 95))}
+            del model
+
+        ref, cand = results["torch"], results[opts["backend"]]
+        row_cos = (ref["rows"] * cand["rows"]).sum(axis=1)
+        query_cos = (ref["queries"] * cand["queries"]).sum(axis=1)
+        truth = _topk(ref["queries"], ref["rows"], k)
+        found = _topk(cand["queries"], cand["rows"], k)
+        overlap = float(np.mean([len(set(f) & set(t)) / k for f, t in zip(found, truth)]))
+        report = {
+            "model": embedders.EMBED_MODEL, "backend": opts["backend"],
+            "rows": len(texts), "queries": len(queries), "k": k,
+            "row_cosine_mean": float(row_cos.mean()), "row_cosine_min": float(row_cos.min()),
+            "query_cosine_mean": float(query_cos.mean()), "query_cosine_min": float(query_cos.min()),
+            "topk_overlap": overlap,
+            "speed": {name: {key: round(r[key], 3)
+                             for key in ("load_s", "rows_per_s", "query_p50_ms", "query_p95_ms")}
+                      for name, r in results.items()},
+        }
+
+        if opts["json"]:
+            self.stdout.write(json.dumps(report, indent=2))
+        else:
+            self.stdout.write(f"{report['model']} {report['backend']} vs torch: {len(texts)} rows, "
+                              f"{len(queries)} queries")
+            self.stdout.write(f"  cosine rows    mean {report['row_cosine_mean']:.4f}  min {report['row_cosine_min']:.4f}")
+            self.stdout.write(f"  cosine queries mean {report['query_cosine_mean']:.4f}  "
+                              f"min {report['query_cosine_min']:.4f}")
+            self.stdout.write(f"  top-{k} overlap {overlap:.3f}")
+            self.stdout.write(f"  {'backend':<11} {'load s':>8} {'rows/s':>10} {'query p50 ms':>13} {'p95 ms':>8}")
+            for name, s in report["speed"].items():
+                self.stdout.write(f"  {name:<11} {s['load_s']:>8.2f} {s['rows_per_s']:>10.1f} "
+                                  f"{s['query_p50_ms']:>13.2f} {s['query_p95_ms']:>8.2f}")
+
+        if report["row_cosine_mean"] < opts["min_cosine"] or overlap < opts["min_overlap"]:
+            raise CommandError(f"{opts['backend']} drifts too far from torch (mean cosine "
+                               f"{report['row_cosine_mean']:.4f}, top-{k} overlap {overlap:.3f})")
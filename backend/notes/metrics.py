@@ -0,0 +1,249 @@
+"""
+Stage timings and process metrics.
+
+    with metrics.span("embed"):
+        ...
+
+A span's duration goes into the heysheet_stage_seconds histogram and, inside
+a request (or sync job), into that unit's timings. TimingMiddleware sends a
+request's timings as a Server-Timing header (SERVER_TIMING=false turns it
+off) and logs them as one JSON "Request timing" line; sync jobs keep theirs
+in the job status. GET /api/metrics renders counters, histograms and the
+registered gauges in the Prometheus text format. Every worker process has
+its own registry, so scrape each worker (or sum them).
+"""
+import os, json, time, bisect, threading, logging, contextvars
+from contextlib import contextmanager
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+SERVER_TIMING = os.getenv("SERVER_TIMING", "true").lower() == "true"
+SECONDS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+TOKENS = (64, 128, 256, 512, 1024, 2048, 4096, 8192)
+
+HELP = {
+    "heysheet_http_requests_total": ("counter", "HTTP requests by view, intent and status."),
+    "heysheet_http_request_seconds": ("histogram", "HTTP request latency by view and intent."),
+    "heysheet_stage_seconds": ("histogram", "Time spent per pipeline stage (see Server-Timing)."),
+    "heysheet_external_calls_total": ("counter", "Calls to Google APIs and Groq by method and outcome."),
+    "heysheet_external_call_seconds": ("histogram", "Latency of calls to Google APIs and Groq."),
+    "heysheet_groq_tokens_total": ("counter", "Groq tokens reported by the API, by model and kind."),
+    "heysheet_prompt_tokens": ("histogram", "Estimated QA prompt size in tokens."),
+    "heysheet_sync_jobs_total": ("counter", "Finished sync jobs by kind and status."),
+    "heysheet_sync_seconds": ("histogram", "Sync job run time by kind."),
+    "heysheet_sync_rows_total": ("counter", "Rows fetched, embedded, cached and indexed by syncs."),
+}
+
+_lock = threading.Lock()
+_counters = {}    # (name, labels) -> value
+_histograms = {}  # (name, labels) -> [bucket counts..., +Inf count, sum]
+_buckets = {}     # name -> bucket bounds
+_collectors = []  # fn() -> [(name, type, help, labels dict, value)]
+_unit = contextvars.ContextVar("heysheet_metrics_unit", default=None)
+
+
+def _labels(labels: dict) -> tuple:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def inc(name: str, value: float = 1, **labels):
+    key = (name, _labels(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name: str, value: float, buckets=SECONDS, **labels):
+    key = (name, _labels(labels))
+    with _lock:
+        h = _histograms.get(key)
+        if h is None:
+            _buckets.setdefault(name, tuple(buckets))
+            h = _histograms[key] = [0] * (len(_buckets[name]) + 2)
+        h[bisect.bisect_left(_buckets[name], value)] += 1
+        h[-1] += value
+
+
+def rss_mb() -> float:
+    """Current resident set size of this process in MB."""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return round(pages * os.sysconf("SC_PAGE_SIZE") / 1e6, 1)
+    except (OSError, ValueError, IndexError):
+        # no /proc (e.g. macOS dev boxes): fall back to peak RSS
+        import resource
+        return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1e6, 1)
+
+
+def register_collector(fn):
+    """fn() -> [(name, type, help, labels, value)], called on every scrape (e.g. memory gauges)."""
+    _collectors.append(fn)
+    return fn
+
+
+# -------------------------
+# Spans
+# -------------------------
+class Unit:
+    """Timings and fields of one request or job."""
+    def __init__(self):
+        self.timings = {}
+        self.fields = {}
+
+
+@contextmanager
+def collect():
+    """Gather the spans and annotate() calls made inside the block (this thread or task)."""
+    unit = Unit()
+    token = _unit.set(unit)
+    try:
+        yield unit
+    finally:
+        _unit.reset(token)
+
+
+def record(stage: str, seconds: float):
+    observe("heysheet_stage_seconds", seconds, stage=stage)
+    unit = _unit.get()
+    if unit is not None:
+        unit.timings[stage] = unit.timings.get(stage, 0.0) + seconds
+
+
+@contextmanager
+def span(stage: str):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - t0)
+
+
+def annotate(**fields):
+    """Add fields to the current request's timing log line."""
+    unit = _unit.get()
+    if unit is not None:
+        unit.fields.update(fields)
+
+
+@contextmanager
+def external_call(system: str, method: str, stage: str = None):
+    """Time and count one Google/Groq call; also a span when `stage` is given."""
+    t0, outcome = time.perf_counter(), "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        seconds = time.perf_counter() - t0
+        inc("heysheet_external_calls_total", system=system, method=method, outcome=outcome)
+        observe("heysheet_external_call_seconds", seconds, system=system, method=method)
+        if stage:
+            record(stage, seconds)
+
+
+def groq_usage(resp, model: str):
+    usage = getattr(resp, "usage", None)
+    for kind in ("prompt", "completion"):
+        n = getattr(usage, f"{kind}_tokens", None)
+        if n:
+            inc("heysheet_groq_tokens_total", n, model=model, kind=kind)
+
+
+# -------------------------
+# Server-Timing + request log
+# -------------------------
+def server_timing(timings: dict, total: float) -> str:
+    parts = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings.items()]
+    return ", ".join(parts + [f"total;dur={total * 1000:.1f}"])
+
+
+class TimingMiddleware:
+    """Per-request spans -> Server-Timing header, request metrics and one structured log line."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self._acall(request)
+        t0 = time.perf_counter()
+        with collect() as unit:
+            response = self.get_response(request)
+        return self._finish(request, response, unit, time.perf_counter() - t0)
+
+    async def _acall(self, request):
+        t0 = time.perf_counter()
+        with collect() as unit:
+            response = await self.get_response(request)
+        return self._finish(request, response, unit, time.perf_counter() - t0)
+
+    @staticmethod
+    def _finish(request, response, unit, total: float):
+        match = getattr(request, "resolver_match", None)
+        view = (match.url_name or match.view_name) if match else "unmatched"
+        intent = unit.fields.get("intent", "")
+        inc("heysheet_http_requests_total", view=view, intent=intent, status=response.status_code)
+        observe("heysheet_http_request_seconds", total, view=view, intent=intent)
+        if SERVER_TIMING:
+            response["Server-Timing"] = server_timing(unit.timings, total)
+        if unit.timings or unit.fields:
+            logging.info("Request timing: %s", json.dumps({
+                "method": request.method, "path": request.path, "view": view,
+                "status": response.status_code, "ms": round(total * 1000, 1),
+                "stages_ms": {k: round(v * 1000, 1) for k, v in unit.timings.items()},
+                **unit.fields,
+            }, default=str))
+        return response
+
+
+# -------------------------
+# Prometheus text format
+# -------------------------
+def _escape(v: str) -> str:
+    return v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _fmt(name: str, labels, value) -> str:
+    inner = ",".join(f'{k}="{_escape(v)}"' for k, v in labels)
+    value = int(value) if float(value).is_integer() else value
+    return f"{name}{{{inner}}} {value}" if inner else f"{name} {value}"
+
+
+def render() -> str:
+    with _lock:
+        counters = sorted(_counters.items())
+        histograms = sorted((k, list(h)) for k, h in _histograms.items())
+    lines, seen = [], set()
+
+    def header(name, kind, text):
+        if name not in seen:
+            seen.add(name)
+            lines.append(f"# HELP {name} {text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+    for (name, labels), value in counters:
+        header(name, "counter", HELP.get(name, ("counter", name))[1])
+        lines.append(_fmt(name, labels, value))
+    for (name, labels), h in histograms:
+        header(name, "histogram", HELP.get(name, ("histogram", name))[1])
+        running = 0
+        for bound, n in zip(_buckets[name] + (float("inf"),), h[:-1]):
+            running += n
+            le = "+Inf" if bound == float("inf") else f"{bound:g}"
+            lines.append(_fmt(f"{name}_bucket", labels + (("le", le),), running))
+        lines.append(_fmt(f"{name}_count", labels, running))
+        lines.append(_fmt(f"{name}_sum", labels, h[-1]))
+    for fn in list(_collectors):
+        try:
+            samples = fn()
+        except Exception:
+            logging.exception("Metrics collector %s failed", getattr(fn, "__name__", fn))
+            continue
+        for name, kind, text, labels, value in samples:
+            if value is None:
+                continue
+            header(name, kind, text)
+            lines.append(_fmt(name, _labels(labels), float(value)))
+    return "\n".join(lines) + "\n"
@@ -6,3 +6,25 @@ class Note(models.Model):
 
     def __str__(self):
         return self.title
+
+
+class PendingAppointment(models.Model):
+    """A booking accepted in write-behind mode, waiting to be appended to the sheet."""
+    PENDING = "pending"
+    FLUSHING = "flushing"
+    WRITTEN = "written"
+    STATUS_CHOICES = [(PENDING, "Pending"), (FLUSHING, "Flushing"), (WRITTEN, "Written")]
+
+    booking_id = models.CharField(max_length=16, unique=True)
+    row = models.JSONField()  # Appointments row values, in sheet column order
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=PENDING, db_index=True)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True, default="")
+    next_attempt_at = models.DateTimeField(null=True, blank=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    sheet_row = models.PositiveIntegerField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    written_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.booking_id} ({self.status})"
@@ -1,84 +1,240 @@
-import os, uuid, datetime as dt, json
-from typing import Optional
-import pandas as pd
-from googleapiclient.discovery import build
-from google.oauth2 import service_account
+import os, re, uuid, time, threading, logging, datetime as dt
+from typing import NamedTuple, Optional
+
+from . import booking_queue, metrics
+from .google_sheets import sheets_service
 
 SPREADSHEET_ID = os.environ["SPREADSHEET_ID"]
 SERVICES_TAB = "Services"
 APPTS_TAB = "Appointments"
+BOOKING_ID_HEADER = "Booking ID"
+# Booking ID -> row number index; reloaded from the sheet on a miss or when older than this
+BOOKING_INDEX_TTL = int(os.getenv("BOOKING_INDEX_TTL", "300"))
+# re-read the Booking ID cell before writing (one extra tiny read) to guard against rows
+# being deleted/reordered by hand in the sheet between reloads
+BOOKING_INDEX_VERIFY = os.getenv("BOOKING_INDEX_VERIFY", "true").lower() == "true"
+# services catalog: fresh for SERVICES_CACHE_TTL, then served stale (while a background
+# refresh runs) up to SERVICES_STALE_TTL
+SERVICES_CACHE_TTL = int(os.getenv("SERVICES_CACHE_TTL", "300"))
+SERVICES_STALE_TTL = int(os.getenv("SERVICES_STALE_TTL", "3600"))
+# how long an update waits for a write-behind flush that has claimed the booking
+FLUSH_WAIT = 3.0
 
 def _svc(readonly: bool):
-    scope = "https://www.googleapis.com/auth/spreadsheets.readonly" if readonly \
-            else "https://www.googleapis.com/auth/spreadsheets"
-    
-    # Try to load from environment variable first (for production)
-    google_creds_json = os.getenv("GOOGLE_SHEETS_CREDENTIALS")
-    if google_creds_json:
-        try:
-            creds_info = json.loads(google_creds_json)
-            creds = service_account.Credentials.from_service_account_info(
-                creds_info, scopes=[scope]
-            )
-        except (json.JSONDecodeError, KeyError) as e:
-            raise ValueError(f"Invalid GOOGLE_SHEETS_CREDENTIALS JSON: {e}")
-    else:
-        # Fallback to file path (for local development)
-        creds_path = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
-        if not creds_path:
-            raise ValueError("Either GOOGLE_SHEETS_CREDENTIALS or GOOGLE_APPLICATION_CREDENTIALS must be set")
-        creds = service_account.Credentials.from_service_account_file(
-            creds_path, scopes=[scope]
-        )
-    
-    return build("sheets", "v4", credentials=creds)
+    return sheets_service(readonly)
 
-def list_services():
+# -------------------------
+# Services catalog (TTL cache, stale-while-revalidate)
+# -------------------------
+class ServiceCatalog(NamedTuple):
+    services: list      # rows of the Services tab as dicts
+    names: list         # service display names
+    name_tokens: list   # token set per name, aligned with names
+    loaded_at: float
+
+def service_name(s: dict):
+    return s.get("Class Name") or s.get("Service") or s.get("Name")
+
+def name_tokens(text: str) -> set:
+    return {w for w in re.findall(r"[a-z0-9]+", text.lower()) if len(w) >= 3}
+
+_catalog = None
+_catalog_lock = threading.Lock()
+_catalog_refreshing = False
+
+def _fetch_services():
     s = _svc(True)
-    vals = s.spreadsheets().values().get(
-        spreadsheetId=SPREADSHEET_ID, range=f"{SERVICES_TAB}!A1:Z"
-    ).execute().get("values", [])
+    with metrics.span("sheets_services"):
+        vals = s.spreadsheets().values().get(
+            spreadsheetId=SPREADSHEET_ID, range=f"{SERVICES_TAB}!A1:Z"
+        ).execute().get("values", [])
     if not vals: return []
     headers, rows = vals[0], vals[1:]
-    df = pd.DataFrame(rows, columns=headers[:len(rows[0])])
-    return df.fillna("").astype(str).to_dict(orient="records")
+    if not rows: return []
+    # plain dicts (no pandas) keep booking-only workers light; short rows pad with ""
+    columns = headers[:len(rows[0])]
+    return [{c: str(r[i]) if i < len(r) and r[i] is not None else "" for i, c in enumerate(columns)}
+            for r in rows]
 
-def create_appointment(name, email, phone, service_name, total_sessions, sessions_text=""):
+def refresh_services() -> ServiceCatalog:
+    global _catalog
+    services = _fetch_services()
+    names = [n for n in (service_name(s) for s in services) if n]
+    _catalog = ServiceCatalog(services, names, [name_tokens(n) for n in names], time.monotonic())
+    return _catalog
+
+def _refresh_services_bg():
+    global _catalog_refreshing
+    try:
+        refresh_services()
+    except Exception:
+        logging.exception("Background services refresh failed; serving stale catalog")
+    finally:
+        _catalog_refreshing = False
+
+def services_catalog() -> ServiceCatalog:
+    global _catalog_refreshing
+    cat = _catalog
+    age = time.monotonic() - cat.loaded_at if cat else None
+    if cat and age < SERVICES_CACHE_TTL:
+        return cat
+    if cat and age < SERVICES_STALE_TTL:
+        if not _catalog_refreshing:
+            _catalog_refreshing = True
+            threading.Thread(target=_refresh_services_bg, daemon=True).start()
+        return cat
+    with _catalog_lock:
+        # another thread may have loaded it while we waited
+        if _catalog is not cat:
+            return _catalog
+        return refresh_services()
+
+def invalidate_services(refresh: bool = False):
+    """Drop the cached catalog (e.g. after /api/sync); optionally reload it right away."""
+    global _catalog
+    _catalog = None
+    if refresh:
+        refresh_services()
+
+def list_services():
+    return services_catalog().services
+
+# Appointments columns, in the order rows are appended
+APPT_FIELDS = ["name", "email", "phone", "service", "total_sessions", "sessions_text"]
+
+def append_appointment_rows(rows) -> Optional[int]:
+    """Append [(booking_id, row), ...] in one call; returns the first sheet row written."""
     s = _svc(False)
+    with metrics.span("sheets_append"):
+        resp = s.spreadsheets().values().append(
+            spreadsheetId=SPREADSHEET_ID,
+            range=f"{APPTS_TAB}!A1:Z",
+            valueInputOption="RAW",
+            insertDataOption="INSERT_ROWS",
+            body={"values":[row for _, row in rows]}
+        ).execute()
+    m = re.search(r"![A-Z]+(\d+)", resp.get("updates", {}).get("updatedRange") or "")
+    if not m:
+        return None
+    start = int(m.group(1))
+    with _appt_lock:
+        for i, (booking_id, _) in enumerate(rows):
+            _appt_rows[booking_id] = start + i
+            _appt_misses.pop(booking_id, None)
+    return start
+
+def create_appointment(name, email, phone, service_name, total_sessions, sessions_text=""):
     booking_id = uuid.uuid4().hex[:8].upper()
     ts = dt.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%SZ")
     row = [name, email, phone, service_name, str(total_sessions), sessions_text, booking_id, ts]
-    s.spreadsheets().values().append(
-        spreadsheetId=SPREADSHEET_ID,
-        range=f"{APPTS_TAB}!A1:Z",
-        valueInputOption="RAW",
-        insertDataOption="INSERT_ROWS",
-        body={"values":[row]}
-    ).execute()
+    if booking_queue.enabled():
+        # durable in the local DB now, appended to the sheet by the flusher
+        booking_queue.enqueue(booking_id, row)
+    else:
+        append_appointment_rows([(booking_id, row)])
     return booking_id
 
-def _find_row(booking_id:str) -> Optional[int]:
+# -------------------------
+# Appointments index (Booking ID -> sheet row) + cached header row
+# -------------------------
+_appt_lock = threading.Lock()
+_appt_headers = None
+_appt_rows = {}
+_appt_loaded_at = 0.0
+_appt_misses = {}  # Booking ID -> _appt_loaded_at of the reload that didn't find it
+
+def _col(ix): return chr(ord('A') + ix)
+
+def _reload_appointments():
+    """Read the Appointments tab once and rebuild the Booking ID index."""
+    global _appt_headers, _appt_rows, _appt_loaded_at, _appt_misses
     s = _svc(True)
-    vals = s.spreadsheets().values().get(
-        spreadsheetId=SPREADSHEET_ID, range=f"{APPTS_TAB}!A1:Z"
-    ).execute().get("values", [])
-    if not vals: return None
-    headers, rows = vals[0], vals[1:]
-    if "Booking ID" not in headers: return None
-    col = headers.index("Booking ID")
-    for i, r in enumerate(rows, start=2):
-        if len(r) > col and r[col] == booking_id:
-            return i
-    return None
+    with metrics.span("sheets_appointments"):
+        vals = s.spreadsheets().values().get(
+            spreadsheetId=SPREADSHEET_ID, range=f"{APPTS_TAB}!A1:Z"
+        ).execute().get("values", [])
+    headers, rows = (vals[0], vals[1:]) if vals else ([], [])
+    index = {}
+    if BOOKING_ID_HEADER in headers:
+        col = headers.index(BOOKING_ID_HEADER)
+        for i, r in enumerate(rows, start=2):
+            if len(r) > col and r[col]:
+                index[r[col]] = i
+    with _appt_lock:
+        _appt_headers, _appt_rows, _appt_loaded_at = headers, index, time.monotonic()
+        _appt_misses = {}
+    logging.info("Booking index reloaded: %s bookings", len(index))
+
+def _index_fresh() -> bool:
+    return _appt_headers is not None and time.monotonic() - _appt_loaded_at < BOOKING_INDEX_TTL
+
+def _appointment_headers():
+    if _appt_headers is None:
+        _reload_appointments()
+    return _appt_headers
+
+def _verify_row(booking_id: str, rownum: int) -> bool:
+    headers = _appointment_headers()
+    if BOOKING_ID_HEADER not in headers:
+        return False
+    cell = f"{APPTS_TAB}!{_col(headers.index(BOOKING_ID_HEADER))}{rownum}"
+    with metrics.span("sheets_verify"):
+        vals = _svc(True).spreadsheets().values().get(
+            spreadsheetId=SPREADSHEET_ID, range=cell
+        ).execute().get("values", [[]])
+    return bool(vals and vals[0] and vals[0][0] == booking_id)
+
+def _row_ok(booking_id: str, rownum) -> bool:
+    return bool(rownum) and (not BOOKING_INDEX_VERIFY or _verify_row(booking_id, rownum))
+
+def _find_row(booking_id:str) -> Optional[int]:
+    rownum = _appt_rows.get(booking_id) if _index_fresh() else None
+    if _row_ok(booking_id, rownum):
+        return rownum
+    # miss, stale index or moved row: reconcile with the sheet once. An ID the last
+    # reload already missed isn't re-read for a few seconds, so a stream of unknown
+    # IDs doesn't turn into a full-sheet read each; a booking made by another worker
+    # since then still is.
+    loaded_at = _appt_loaded_at
+    if rownum is None and _appt_misses.get(booking_id) == loaded_at and time.monotonic() - loaded_at < 5:
+        return None
+    _reload_appointments()
+    with _appt_lock:
+        rownum = _appt_rows.get(booking_id)
+        if rownum is None:
+            _appt_misses[booking_id] = _appt_loaded_at
+    return rownum
+
+def _patch_queued(booking_id, values: dict):
+    """
+    Write-behind mode: (patched in the queue, sheet row if the flusher already
+    wrote it). A booking being flushed right now is waited for up to
+    FLUSH_WAIT; RuntimeError("booking_flushing") if it is still in flight.
+    """
+    deadline = time.monotonic() + FLUSH_WAIT
+    while True:
+        if booking_queue.patch_pending(booking_id, values):
+            return True, None
+        status = booking_queue.booking_status(booking_id)
+        if status is None:
+            return False, None  # not a queued booking: look it up in the sheet
+        if status["status"] == "written":
+            return False, status["sheet_row"]
+        if time.monotonic() >= deadline:
+            raise RuntimeError("booking_flushing")
+        time.sleep(0.2)
 
 def update_appointment(booking_id, **patch):
-    rownum = _find_row(booking_id)
+    rownum = None
+    if booking_queue.enabled():
+        values = {APPT_FIELDS.index(k): v for k, v in patch.items() if k in APPT_FIELDS and v is not None}
+        patched, rownum = _patch_queued(booking_id, values)
+        if patched:
+            return True
+    if not _row_ok(booking_id, rownum):
+        rownum = _find_row(booking_id)
     if not rownum: return False
-    s = _svc(True)
-    headers = s.spreadsheets().values().get(
-        spreadsheetId=SPREADSHEET_ID, range=f"{APPTS_TAB}!A1:Z1"
-    ).execute().get("values", [[]])[0]
-    def col(ix): return chr(ord('A') + ix)
+    headers = _appointment_headers()
     mapf = {
         "name":"Name","email":"Email","phone":"Phone","service":"Service",
         "total_sessions":"Total Sessions",
@@ -88,10 +244,21 @@ def update_appointment(booking_id, **patch):
     for k,v in patch.items():
         h = mapf.get(k)
         if v is None or not h or h not in headers: continue
-        data.append({"range": f"{APPTS_TAB}!{col(headers.index(h))}{rownum}", "values":[[str(v)]]})
+        data.append({"range": f"{APPTS_TAB}!{_col(headers.index(h))}{rownum}", "values":[[str(v)]]})
     if not data: return True
     sw = _svc(False)
-    sw.spreadsheets().values().batchUpdate(
-        spreadsheetId=SPREADSHEET_ID, body={"valueInputOption":"RAW","data":data}
-    ).execute()
+    with metrics.span("sheets_update"):
+        sw.spreadsheets().values().batchUpdate(
+            spreadsheetId=SPREADSHEET_ID, body={"valueInputOption":"RAW","data":data}
+        ).execute()
     return True
+
+def booking_status(booking_id: str):
+    """Where a booking is: queued/flushing in write-behind mode, or written to the sheet."""
+    status = booking_queue.booking_status(booking_id) if booking_queue.enabled() else None
+    if status is not None:
+        return status
+    rownum = _find_row(booking_id)
+    if not rownum:
+        return None
+    return {"booking_id": booking_id, "status": "written", "sheet_row": rownum}
@@ -1,107 +1,688 @@
-import os, pickle, json
-from pathlib import Path
+import os, re, threading, time, hashlib, logging, asyncio, contextvars
+from typing import NamedTuple
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import pandas as pd
-from googleapiclient.discovery import build
-from google.oauth2 import service_account
-from sentence_transformers import SentenceTransformer
-import faiss
 from groq import Groq
-from django.conf import settings
+from googleapiclient.errors import HttpError
 
-BASE_DIR = Path("/tmp")  # Use /tmp directory which is writable
-INDEX_PATH = str(BASE_DIR / "sheet_index.faiss")
-META_PATH  = str(BASE_DIR / "sheet_meta.pkl")
+from .index_store import IndexGeneration, current_version, publish_generation, text_digest
+from . import ann, change_detector, context_budget, embedders, keyword_index, metrics
+from .embedders import EMBED_MODEL, EMBED_BACKEND
+from .embedding_cache import get_cache as embedding_cache
+from .answer_cache import AnswerCache
+from .google_sheets import sheets_service
 
-def fetch_sheet() -> pd.DataFrame:
-    # Try to load from environment variable first (for production)
-    google_creds_json = os.getenv("GOOGLE_SHEETS_CREDENTIALS")
-    if google_creds_json:
-        try:
-            creds_info = json.loads(google_creds_json)
-            creds = service_account.Credentials.from_service_account_info(
-                creds_info, scopes=["https://www.googleapis.com/auth/spreadsheets.readonly"]
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+EMBED_CHUNK_ROWS = int(os.getenv("EMBED_CHUNK_ROWS", "4096"))  # rows handed to encode() at a time
+# "hybrid" fuses BM25 keyword hits with the vector hits; "vector" is cosine only
+RAG_RETRIEVAL = os.getenv("RAG_RETRIEVAL", "hybrid").lower()
+RAG_TOP_K = int(os.getenv("RAG_TOP_K", "6"))          # rows sent to the LLM
+RAG_CANDIDATES = int(os.getenv("RAG_CANDIDATES", "30"))  # per retriever, before fusion
+RRF_K = 60
+RAG_BATCH_CONCURRENCY = int(os.getenv("RAG_BATCH_CONCURRENCY", "4"))  # Groq calls in flight per ask_batch
+QA_MODEL = "llama3-70b-8192"
+# re-hash index files against their manifest checksum when an engine first loads them
+VERIFY_SNAPSHOT = os.getenv("RAG_VERIFY_SNAPSHOT", "true").lower() == "true"
+
+# -------------------------
+# Shared embedder (one per process)
+# -------------------------
+_embedder = None
+_embedder_lock = threading.Lock()
+_embedder_stats = {"model": EMBED_MODEL, "backend": EMBED_BACKEND, "loaded": False,
+                   "load_seconds": None, "rss_before_mb": None, "rss_after_mb": None}
+
+def get_embedder():
+    """Return the process-wide encoder for EMBED_BACKEND (see embedders.py), loading it on first use."""
+    global _embedder
+    if _embedder is not None:
+        return _embedder
+    with _embedder_lock:
+        if _embedder is None:
+            rss_before, t0 = metrics.rss_mb(), time.perf_counter()
+            model = embedders.load()
+            _embedder_stats.update(
+                loaded=True,
+                load_seconds=round(time.perf_counter() - t0, 3),
+                rss_before_mb=rss_before,
+                rss_after_mb=metrics.rss_mb(),
             )
-        except (json.JSONDecodeError, KeyError) as e:
-            raise ValueError(f"Invalid GOOGLE_SHEETS_CREDENTIALS JSON: {e}")
-    else:
-        # Fallback to file path (for local development)
-        creds_path = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
-        if not creds_path:
-            raise ValueError("Either GOOGLE_SHEETS_CREDENTIALS or GOOGLE_APPLICATION_CREDENTIALS must be set")
-        creds = service_account.Credentials.from_service_account_file(
-            creds_path, scopes=["https://www.googleapis.com/auth/spreadsheets.readonly"]
-        )
-    
-    service = build("sheets", "v4", credentials=creds)
-    values = service.spreadsheets().values().get(
-        spreadsheetId=os.environ["SPREADSHEET_ID"],
-        range=os.getenv("SHEETS_RANGE", "Business Hours!A1:Z"),
-    ).execute().get("values", [])
+            _embedder = model
+    return _embedder
+
+def warm_embedder():
+    """Load the embedder and run one encode so the first request doesn't pay for it."""
+    get_embedder().encode(["warm-up"], convert_to_numpy=True, normalize_embeddings=True)
+    return embedder_stats()
+
+def embedder_stats() -> dict:
+    return {**_embedder_stats, "rss_mb": metrics.rss_mb(), "pid": os.getpid()}
+
 
+# -------------------------
+# Sources: the sheet ranges that make up the knowledge base, one index shard each.
+# RAG_SOURCES="Business Hours!A1:Z; FAQ!A1:Z; <other spreadsheet id>|Pricing!A1:Z"
+# -------------------------
+class SheetSource(NamedTuple):
+    spreadsheet_id: str
+    range: str
+
+    @property
+    def label(self) -> str:
+        return self.range.rpartition("!")[0].strip("'") or self.range
+
+    @property
+    def shard(self) -> str:
+        slug = re.sub(r"[^a-z0-9]+", "-", self.label.lower()).strip("-") or "sheet"
+        return f"{slug}-{hashlib.sha1(f'{self.spreadsheet_id}|{self.range}'.encode()).hexdigest()[:8]}"
+
+def rag_sources():
+    raw = os.getenv("RAG_SOURCES") or os.getenv("SHEETS_RANGE", "Business Hours!A1:Z")
+    out = []
+    for item in raw.split(";"):
+        item = item.strip()
+        if not item:
+            continue
+        sid, sep, rng = item.partition("|")
+        out.append(SheetSource(sid.strip(), rng.strip()) if sep else SheetSource(os.environ["SPREADSHEET_ID"], item))
+    return out
+
+def _column_letter(ix: int) -> str:
+    out = ""
+    ix += 1
+    while ix:
+        ix, r = divmod(ix - 1, 26)
+        out = chr(ord("A") + r) + out
+    return out
+
+def _unique_headers(headers, width: int) -> list:
+    """
+    One distinct name per column: blank header cells become "Column <letter>",
+    repeats get ".1", ".2", ... (a column has to be a Series for build_documents).
+    """
+    out, seen = [], set()
+    for ix in range(width):
+        name = str(headers[ix]).strip() if ix < len(headers) and headers[ix] is not None else ""
+        name = name or f"Column {_column_letter(ix)}"
+        unique, n = name, 0
+        while unique in seen or unique == "__row_id":
+            n += 1
+            unique = f"{name}.{n}"
+        seen.add(unique)
+        out.append(unique)
+    return out
+
+def _values_to_df(values) -> pd.DataFrame:
+    """Rows under the header row; no columns at all when the range came back empty."""
     if not values:
         return pd.DataFrame()
-
     headers = values[0]
     rows = values[1:]
-    df = pd.DataFrame(rows, columns=headers[:len(rows[0])])
+    if not rows:  # header only: an empty shard, not a failure
+        return pd.DataFrame(columns=_unique_headers(headers, len(headers)) + ["__row_id"])
+    # the API drops trailing empty cells, so rows (and the header) can be ragged
+    width = max(len(headers), *(len(r) for r in rows))
+    rows = [list(r) + [None] * (width - len(r)) for r in rows]
+    df = pd.DataFrame(rows, columns=_unique_headers(headers, width))
     df.reset_index(drop=True, inplace=True)
     df["__row_id"] = df.index + 2  # header is row 1
     return df
 
-def build_index(df: pd.DataFrame):
-    cols = [c for c in df.columns if c != "__row_id"]
-    docs, meta = [], []
-    for _, r in df.iterrows():
-        text = " | ".join(f"{c}: {str(r[c])}" for c in cols)
-        docs.append(text)
-        meta.append({"row": int(r["__row_id"]), "text": text})
+def _fetch_one(service, src: SheetSource) -> list:
+    """One range's values; [] (an inaccessible source) if Sheets can't parse it, e.g. a renamed tab."""
+    try:
+        return service.spreadsheets().values().get(
+            spreadsheetId=src.spreadsheet_id, range=src.range,
+        ).execute().get("values", [])
+    except HttpError as e:
+        if e.resp.status != 400:
+            raise
+        logging.warning("Sheets rejected range %s: %s", src.range, e)
+        return []
+
+def fetch_sources(sources=None) -> dict:
+    """
+    {source: DataFrame}, with one values().batchGet per spreadsheet. Sheets fails
+    a whole batchGet with 400 when one of its ranges names a missing tab; that
+    spreadsheet's ranges are then read one by one, so only the broken one fails.
+    """
+    sources = sources or rag_sources()
+    service = sheets_service(readonly=True)
+    out = {}
+    by_sheet = {}
+    for src in sources:
+        by_sheet.setdefault(src.spreadsheet_id, []).append(src)
+    for sid, srcs in by_sheet.items():
+        try:
+            ranges = service.spreadsheets().values().batchGet(
+                spreadsheetId=sid, ranges=[src.range for src in srcs],
+            ).execute().get("valueRanges", [])
+            values = [vr.get("values", []) for vr in ranges]
+        except HttpError as e:
+            if e.resp.status != 400:
+                raise
+            logging.warning("Batch read of %s failed (%s); reading its ranges one by one", sid, e)
+            values = [_fetch_one(service, src) for src in srcs]
+        for src, vals in zip(srcs, values):
+            out[src] = _values_to_df(vals)
+    return out
+
+def fetch_sheet() -> pd.DataFrame:
+    """The first configured source as a DataFrame."""
+    src = rag_sources()[0]
+    return fetch_sources([src])[src]
+
+def _row_hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+def _env_list(var: str):
+    return [x.strip() for x in os.getenv(var, "").split(",") if x.strip()]
+
+def _column_weights() -> dict:
+    """RAG_COLUMN_WEIGHTS="Class Name:3,Notes:0" -> {"Class Name": 3, "Notes": 0}."""
+    out = {}
+    for item in _env_list("RAG_COLUMN_WEIGHTS"):
+        name, _, w = item.rpartition(":")
+        if name:
+            out[name.strip()] = int(w)
+    return out
+
+def build_documents(df: pd.DataFrame, columns=None, weights=None):
+    """
+    Build each row's text column-wise with vectorised string ops.
+    Returns (display, embed): "col: value | ..." over the selected columns, and
+    the text that gets embedded, where a column with weight n appears n times
+    (0 drops it) to pull the vector towards that column.
+    """
+    cols = [c for c in (columns or df.columns) if c in df.columns and c != "__row_id"]
+    weights = weights or {}
+    segs = {c: c + ": " + df[c].map(str) for c in cols}  # map(str): same text as str(cell) for None/NaN
+
+    def join(parts):
+        if not parts:
+            return pd.Series("", index=df.index)
+        return parts[0].str.cat(parts[1:], sep=" | ") if len(parts) > 1 else parts[0]
+
+    display = join([segs[c] for c in cols])
+    if not weights:
+        return display, display
+    embed = join([segs[c] for c in cols for _ in range(max(0, weights.get(c, 1)))])
+    return display, embed
+
+def _chunks(items, size: int):
+    for start in range(0, len(items), size):
+        yield start, items[start:start + size]
+
+def _encode_into(out: np.ndarray, rows, texts, progress=None):
+    """Encode texts chunk by chunk straight into out[rows] so peak memory stays bounded."""
+    embedder = get_embedder()
+    for start, chunk in _chunks(texts, EMBED_CHUNK_ROWS):
+        out[rows[start:start + len(chunk)]] = embedder.encode(
+            chunk, batch_size=EMBED_BATCH_SIZE, convert_to_numpy=True, normalize_embeddings=True)
+        if progress:
+            progress(embedded_rows=len(chunk))
+
+def build_index(df: pd.DataFrame, incremental: bool = False, source: SheetSource = None,
+                progress=None) -> dict:
+    """
+    Embed the rows of one source and publish them as a new generation of its shard.
+    With incremental=True only new/changed rows are embedded: any row whose text
+    hash is already in the live generation (same row or moved) reuses its vector,
+    and rows no longer in the sheet simply drop out. A shard with no changes at
+    all keeps its current generation. Columns come from RAG_COLUMNS (default:
+    all) weighted by RAG_COLUMN_WEIGHTS, in the vectors and the BM25 postings
+    alike (weight 0 leaves a column only in the display text and the filters).
+    The BM25 postings and column-value filter keys are rebuilt from the text
+    every time; that is cheap next to embedding.
+    Rows not in the live generation are looked up in the embedding disk cache
+    before they are encoded. Shards big enough for RAG_ANN also get an HNSW or IVF-PQ index; incremental
+    builds keep the previous IVF-PQ training (a full sync retrains).
+    """
+    source = source or rag_sources()[0]
+    shard = source.shard
+    columns = _env_list("RAG_COLUMNS")
+    display, embed = build_documents(df, columns, _column_weights())
+    row_ids = df["__row_id"].astype("int64").to_numpy()
+    texts = display.tolist()
+    hashes = pd.Series([_row_hash(t) for t in embed.tolist()])
+
+    embedder = get_embedder()
+    dim = embedder.get_sentence_embedding_dimension()
+    # the serving path already checksums what it loads; don't re-hash the old vectors on every sync
+    prev = (IndexGeneration.latest_valid(shard, model=EMBED_MODEL, backend=EMBED_BACKEND, verify=False)
+            if incremental else None)
+    # an index built by another model or backend can't be patched
+    if prev is not None and (prev.model != EMBED_MODEL or prev.backend != EMBED_BACKEND
+                             or prev.vectors.shape[1] != dim):
+        prev = None
+
+    vectors = np.empty((len(texts), dim), dtype="float32")
+    unchanged = moved = removed = 0
+    reuse = np.zeros(len(texts), dtype=bool)
+    if prev is not None:
+        prev_hashes = pd.Series(np.char.decode(np.asarray(prev.hashes), "ascii"))
+        prev_pos = pd.Series(np.arange(len(prev_hashes)), index=prev_hashes)
+        prev_pos = prev_pos[~prev_pos.index.duplicated()]
+        pos = hashes.map(prev_pos)
+        reuse = pos.notna().to_numpy()
+        vectors[reuse] = prev.vectors[pos[reuse].astype("int64").to_numpy()]
+        prev_by_row = pd.Series(prev_hashes.to_numpy(), index=np.asarray(prev.row_ids))
+        same_row = (pd.Series(row_ids).map(prev_by_row) == hashes).to_numpy()
+        unchanged = int((same_row & reuse).sum())
+        moved = int(reuse.sum()) - unchanged
+        removed = int((~np.isin(np.asarray(prev.row_ids), row_ids)).sum())
 
-    embedder = SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2")
-    embs = embedder.encode(docs, convert_to_numpy=True, normalize_embeddings=True)
+    to_embed = np.flatnonzero(~reuse)
+    stats = {"shard": shard, "rows": len(texts), "embedded": len(to_embed), "cached": 0,
+             "unchanged": unchanged, "reused": moved, "removed": removed,
+             "incremental": prev is not None}
+    # hashes cover the embedded text only, which BM25 is built from too; a column
+    # weighted 0 still shows in the display text and filters, so those must match
+    if (prev is not None and prev.version == current_version(shard) and prev.keywords is not None
+            and unchanged == len(texts) == len(prev)
+            and prev.manifest.get("text_sha1") == text_digest(texts)
+            and prev.ann_meta["kind"] == ann.choose_kind(len(texts))):
+        logging.info("Index unchanged: %s", stats)
+        return {**stats, "version": prev.version, "published": False}
 
-    index = faiss.IndexFlatIP(embs.shape[1])
-    index.add(embs)
+    cache = embedding_cache() if len(to_embed) else None
+    if cache is not None:
+        todo = hashes.iloc[to_embed]
+        with metrics.span("sync_embed_cache"):
+            found = cache.get_many(embedders.encoder_id(), todo.tolist(), dim)
+        hit = todo.isin(found.keys()).to_numpy()
+        if hit.any():
+            vectors[to_embed[hit]] = np.stack([found[h] for h in todo[hit]])
+        to_embed = to_embed[~hit]
+        stats.update(embedded=len(to_embed), cached=int(hit.sum()))
+        if progress:
+            progress(cached_rows=int(hit.sum()))
+    if len(to_embed):
+        if progress:
+            progress(stage=f"embedding {source.label}")
+        with metrics.span("sync_embed"):
+            _encode_into(vectors, to_embed, embed.iloc[to_embed].tolist(), progress)
+        if cache is not None:
+            cache.put_many(embedders.encoder_id(), hashes.iloc[to_embed].tolist(), vectors[to_embed])
 
-    faiss.write_index(index, INDEX_PATH)
-    with open(META_PATH, "wb") as f:
-        pickle.dump({"meta": meta}, f)
+    cols = [c for c in (columns or df.columns) if c in df.columns and c != "__row_id"]
+    with metrics.span("sync_keywords"):
+        fields = zip(*[keyword_index.field_key(c, "") + df[c].map(str).str.strip().str.lower() for c in cols])
+        keywords = keyword_index.build([keyword_index.tokenize(t) for t in embed.tolist()],
+                                       fields if cols else [()] * len(texts))
 
-def sync_sheet() -> int:
-    df = fetch_sheet()
-    if df.empty:
+    with metrics.span("sync_ann"):
+        ann_index, ann_meta = ann.build(vectors, prev_path=prev.path / ann.FILENAME if prev else None,
+                                        prev_meta=prev.ann_meta if prev else None)
+
+    with metrics.span("sync_publish"):
+        version = publish_generation(shard, vectors, row_ids, hashes.tolist(), texts, model=EMBED_MODEL,
+                                     backend=EMBED_BACKEND,
+                                     source={**source._asdict(), "label": source.label}, keywords=keywords,
+                                     ann_index=ann_index, ann_meta=ann_meta)
+    stats.update(version=version, published=True, ann=ann_meta["kind"])
+    logging.info("Index built: %s", stats)
+    return stats
+
+def sync_sheet(incremental: bool = None, force: bool = False, progress=None) -> int:
+    """
+    Fetch the sources that changed since the last sync (see change_detector.py)
+    and rebuild their shards; incremental unless RAG_SYNC_MODE=full. force
+    skips change detection. Returns the number of rows (re)indexed.
+    progress(stage=..., <counter>=n) is called as work gets done (see sync_jobs.py).
+    """
+    progress = progress or (lambda **kw: None)
+    if incremental is None:
+        incremental = os.getenv("RAG_SYNC_MODE", "incremental").lower() != "full"
+    sources = rag_sources()
+    progress(stage="checking for changes")
+    if force:
+        to_fetch, revisions = {src.spreadsheet_id for src in sources}, {}
+    else:
+        with metrics.span("sync_check"):
+            to_fetch, revisions = change_detector.changed_spreadsheets(sources)
+    fetch = [src for src in sources if src.spreadsheet_id in to_fetch]
+    progress(skipped_sources=len(sources) - len(fetch))
+    if not fetch:
+        logging.info("Sheets unchanged since the last sync; nothing to rebuild")
+        return 0
+
+    progress(stage="fetching")
+    total, failed, fingerprints = 0, set(), {}
+    with metrics.span("sync_fetch"):
+        fetched = fetch_sources(fetch)
+    for src, df in fetched.items():
+        progress(fetched_rows=len(df))
+        if not len(df.columns):
+            logging.warning("Source %s is empty or inaccessible; keeping its last index", src.range)
+            failed.add(src)
+            continue
+        fp = change_detector.fingerprint(df)
+        if not force and not change_detector.values_changed(src, fp):
+            logging.info("Source %s unchanged; skipping rebuild", src.range)
+            progress(skipped_sources=1)
+            continue
+        progress(stage=f"indexing {src.label}")
+        build_index(df, incremental=incremental, source=src, progress=progress)
+        fingerprints[src.shard] = fp
+        total += len(df)
+        progress(indexed_rows=len(df))
+    if len(failed) == len(fetch):
         raise RuntimeError("Sheet empty or inaccessible.")
-    build_index(df)
-    return len(df)
+    # a spreadsheet with a failed source is fetched again next time
+    retry = {src.spreadsheet_id for src in failed}
+    change_detector.record({sid: v for sid, v in revisions.items() if sid not in retry}, fingerprints)
+    return total
+
+class _Snapshot(NamedTuple):
+    gens: tuple    # one IndexGeneration per shard
+    version: str   # combined shard versions; answer-cache key
 
 class QAEngine:
-    def __init__(self):
-        if not (os.path.exists(INDEX_PATH) and os.path.exists(META_PATH)):
+    """
+    Retrieval + answer engine over the live generation of every source shard.
+    It starts from the persisted snapshot: per shard, the newest generation
+    that loads, matches EMBED_MODEL and EMBED_BACKEND and passes its checksum. refresh() swaps
+    in newer generations in place: in-flight calls keep the snapshot they
+    started with, and the embedder and Groq client are reused.
+    Answers are cached per index version (see answer_cache.py).
+    """
+    def __init__(self, llm=None, cache=None, sources=None):
+        self.embedder = get_embedder()
+        self.llm = llm or Groq(api_key=os.getenv("GROQ_API_KEY"))
+        self.cache = cache if cache is not None else AnswerCache.from_env()
+        self.sources = sources or rag_sources()
+        self._swap_lock = threading.Lock()
+        self._snap = None  # live _Snapshot -- replaced atomically
+        self._bad = set()  # (shard, version) that failed to load; not retried
+        if not self.refresh(verify=VERIFY_SNAPSHOT):
             raise RuntimeError("Index not built. Call /api/notes/sync first.")
-        self.embedder = SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2")
-        self.index = faiss.read_index(INDEX_PATH)
-        with open(META_PATH, "rb") as f:
-            self.meta = pickle.load(f)["meta"]
-        self.llm = Groq(api_key=os.getenv("GROQ_API_KEY"))
-
-    def retrieve(self, question: str, k: int = 6):
-        qv = self.embedder.encode([question], convert_to_numpy=True, normalize_embeddings=True)
-        D, I = self.index.search(qv, k)
-        out = []
-        for i, score in zip(I[0], D[0]):
-            if i == -1: continue
-            m = self.meta[i]
-            out.append({"row": m["row"], "text": m["text"], "score": float(score)})
-        return out
-
-    def ask(self, question: str):
-        ctxs = self.retrieve(question, k=6)
-        ctx_block = "\n\n".join(f"[Row {c['row']}] {c['text']}" for c in ctxs)
+
+    @property
+    def version(self):
+        return self._snap.version if self._snap else None
+
+    def shards(self) -> dict:
+        return {g.shard: {"source": g.label, "version": g.version, "rows": len(g),
+                          "ann": g.ann_meta["kind"]}
+                for g in self._snap.gens} if self._snap else {}
+
+    def snapshot_age(self) -> float:
+        """Seconds since the oldest served shard was built (inf if a source has no index)."""
+        loaded = self._loaded()
+        if any(src.shard not in loaded for src in self.sources):
+            return float("inf")
+        return time.time() - min(g.created_at for g in loaded.values())
+
+    def _loaded(self) -> dict:
+        return {g.shard: g for g in self._snap.gens} if self._snap else {}
+
+    def is_stale(self) -> bool:
+        loaded = self._loaded()
+        for src in self.sources:
+            v = current_version(src.shard)
+            if (v is not None and (src.shard, v) not in self._bad
+                    and (src.shard not in loaded or loaded[src.shard].version != v)):
+                return True
+        return False
+
+    def refresh(self, verify: bool = False) -> bool:
+        """Load any shard generation newer than ours. Returns True if serving at least one shard."""
+        with self._swap_lock:
+            loaded = self._loaded()
+            gens, changed = [], False
+            for src in self.sources:
+                gen = loaded.get(src.shard)
+                v = current_version(src.shard)
+                new = None
+                if gen is None:
+                    new = IndexGeneration.latest_valid(src.shard, model=EMBED_MODEL, backend=EMBED_BACKEND,
+                                                       verify=verify)
+                    if new is not None and v is not None and new.version != v:
+                        self._bad.add((src.shard, v))  # CURRENT failed validation
+                elif v is not None and v != gen.version and (src.shard, v) not in self._bad:
+                    try:
+                        new = IndexGeneration(src.shard, v)
+                    except (OSError, ValueError):
+                        # e.g. a generation written by an older release; keep what we have
+                        logging.warning("Index generation %s/%s is incomplete, not loading it", src.shard, v)
+                        self._bad.add((src.shard, v))
+                    if new is not None and (new.model, new.backend) != (EMBED_MODEL, EMBED_BACKEND):
+                        # our question vectors can't be compared with another encoder's
+                        logging.warning("Index generation %s/%s was built with %s (%s), not loading it",
+                                        src.shard, v, new.model, new.backend)
+                        self._bad.add((src.shard, v))
+                        new = None
+                if new is not None:
+                    gen, changed = new, True
+                    logging.info("QAEngine loaded %s generation %s (%s rows)", src.shard, gen.version, len(gen))
+                if gen is not None:
+                    gens.append(gen)
+            if changed:
+                version = ",".join(f"{g.shard}:{g.version}" for g in gens)
+                if len(gens) > 1:  # keep answer-cache keys short
+                    version = hashlib.sha1(version.encode()).hexdigest()[:16]
+                self._snap = _Snapshot(tuple(gens), version)
+            return self._snap is not None
+
+    def _embed(self, question: str):
+        return self.embedder.encode([question], convert_to_numpy=True, normalize_embeddings=True)
+
+    def _retrieve(self, snap, qv, k: int, question: str = None, filters: dict = None):
+        """
+        Search every shard and merge the top-k. In hybrid mode the vector and
+        BM25 rankings (each RAG_CANDIDATES deep, across all shards) are fused by
+        reciprocal rank, score = sum(1 / (RRF_K + rank)); otherwise score is the
+        cosine similarity. filters ({column: value}) restrict both to matching rows.
+        """
+        return self._retrieve_many(snap, qv, k, [question], filters)[0]
+
+    def _retrieve_many(self, snap, qvs, k: int, questions, filters: dict = None):
+        """_retrieve for a batch: one vector search per shard for all the query rows in qvs."""
+        hybrid = RAG_RETRIEVAL == "hybrid" and all(questions)
+        depth = max(k, RAG_CANDIDATES) if hybrid else k
+        tokens = [keyword_index.tokenize(q) for q in questions] if hybrid else [[] for _ in questions]
+        vec = [[] for _ in questions]
+        kw = [[] for _ in questions]
+        for gen in snap.gens:
+            allowed = gen.filter_mask(filters)
+            if allowed is not None and not allowed.any():
+                continue
+            with metrics.span("vector_search"):
+                D, I = gen.search(qvs, depth, allowed)
+            for j in range(len(questions)):
+                vec[j] += [(float(score), gen, int(i)) for score, i in zip(D[j], I[j]) if i != -1]
+                if tokens[j]:
+                    with metrics.span("keyword_search"):
+                        S, P = gen.keyword_search(tokens[j], depth, allowed)
+                    kw[j] += [(float(score), gen, int(i)) for score, i in zip(S, P)]
+        return [self._fuse(v, h, k, depth, hybrid) for v, h in zip(vec, kw)]
+
+    @staticmethod
+    def _fuse(vec, kw, k: int, depth: int, hybrid: bool):
+        """Top-k hits; "cosine" is the vector score (None for keyword-only hits) for score cutoffs."""
+        vec.sort(key=lambda h: h[0], reverse=True)
+        cosine = {(gen.shard, i): score for score, gen, i in vec}
+        if hybrid:
+            kw.sort(key=lambda h: h[0], reverse=True)
+            fused = {}
+            for ranking in (vec[:depth], kw[:depth]):
+                for rank, (_, gen, i) in enumerate(ranking):
+                    key = (gen.shard, i)
+                    score, _, _ = fused.get(key, (0.0, gen, i))
+                    fused[key] = (score + 1.0 / (RRF_K + rank + 1), gen, i)
+            hits = sorted(fused.values(), key=lambda h: h[0], reverse=True)[:k]
+        else:
+            hits = vec[:k]
+        return [{"row": int(gen.row_ids[i]), "source": gen.label,
+                 "text": gen.text(i), "score": score, "cosine": cosine.get((gen.shard, i))}
+                for score, gen, i in hits]
+
+    def retrieve(self, question: str, k: int = None, filters: dict = None):
+        return self._retrieve(self._snap, self._embed(question), k or RAG_TOP_K, question, filters)
+
+    def _prepare(self, snap, question: str, filters: dict = None):
+        """
+        Embed, cache lookup, retrieval and context budgeting:
+        (qv, cached (answer, matches) or None, matches, messages, prompt stats).
+        matches are the rows that made it into the prompt.
+        """
+        with metrics.span("embed"):
+            qv = self._embed(question)
+        if self.cache is not None:
+            with metrics.span("answer_cache"):
+                hit = self.cache.get(question, snap.version, qv[0], scope=filters)
+            if hit is not None:
+                metrics.annotate(answer_cached=True)
+                return qv, hit, hit[1], None, {"cached": True}
+        with metrics.span("retrieve"):
+            ctxs = self._retrieve(snap, qv, RAG_TOP_K, question, filters)
+        used, messages, prompt = self._prompt(question, ctxs)
+        metrics.annotate(prompt_tokens=prompt["prompt_tokens"], rows_used=prompt["rows_used"])
+        return qv, None, used, messages, prompt
+
+    def _prompt(self, question: str, ctxs):
+        """(rows used, chat messages, prompt stats) for the retrieved rows."""
+        with metrics.span("context"):
+            block, used, prompt = context_budget.assemble(question, ctxs)
+            messages = self._messages(question, block)
+            prompt["prompt_tokens"] = sum(context_budget.count_tokens(m["content"]) for m in messages)
+        metrics.observe("heysheet_prompt_tokens", prompt["prompt_tokens"], buckets=metrics.TOKENS)
+        return used, messages, prompt
+
+    @staticmethod
+    def _log_prompt(prompt: dict, resp=None):
+        usage = getattr(resp, "usage", None)
+        if usage is not None:
+            prompt["llm_prompt_tokens"] = getattr(usage, "prompt_tokens", None)
+            metrics.groq_usage(resp, QA_MODEL)
+        logging.info("QA prompt: %s", prompt)
+
+    def ask(self, question: str, filters: dict = None):
+        """(answer, matches, prompt stats)."""
+        snap = self._snap
+        qv, hit, ctxs, messages, prompt = self._prepare(snap, question, filters)
+        if hit is not None:
+            return hit[0], ctxs, prompt
+        return self._complete(snap, question, qv[0], ctxs, messages, prompt, filters)
+
+    def _complete(self, snap, question: str, qv, ctxs, messages, prompt, filters=None):
+        with metrics.external_call("groq", QA_MODEL, stage="llm"):
+            resp = self.llm.chat.completions.create(
+                model=QA_MODEL,
+                messages=messages,
+                temperature=0.2,
+            )
+        answer = resp.choices[0].message.content
+        self._log_prompt(prompt, resp)
+        if self.cache is not None:
+            self.cache.set(question, snap.version, answer, ctxs, qv, scope=filters)
+        return answer, ctxs, prompt
+
+    def ask_batch(self, questions, filters: dict = None, concurrency: int = None):
+        """
+        ask() for many questions at once: one encode() call for all of them, one
+        vector search per shard, then the Groq calls on up to RAG_BATCH_CONCURRENCY
+        threads. Returns one (answer, matches, prompt stats) per question, in
+        order, or the exception that question failed with.
+        """
+        snap = self._snap
+        questions = list(questions)
+        results = [None] * len(questions)
+        if not questions:
+            return results
+        with metrics.span("embed"):
+            qvs = self.embedder.encode(questions, batch_size=EMBED_BATCH_SIZE,
+                                       convert_to_numpy=True, normalize_embeddings=True)
+        todo = []
+        for j, q in enumerate(questions):
+            hit = self.cache.get(q, snap.version, qvs[j], scope=filters) if self.cache is not None else None
+            if hit is not None:
+                results[j] = (hit[0], hit[1], {"cached": True})
+            else:
+                todo.append(j)
+        if not todo:
+            return results
+        with metrics.span("retrieve"):
+            ctxs = self._retrieve_many(snap, qvs[todo], RAG_TOP_K, [questions[j] for j in todo], filters)
+        prompts = {j: self._prompt(questions[j], c) for j, c in zip(todo, ctxs)}
+
+        def complete(j):
+            used, messages, prompt = prompts[j]
+            try:
+                return self._complete(snap, questions[j], qvs[j], used, messages, prompt, filters)
+            except Exception as e:
+                logging.warning("Batch question %s failed: %s", j, e)
+                return e
+
+        workers = max(1, min(concurrency or RAG_BATCH_CONCURRENCY, len(todo)))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="qa-batch") as pool:
+            # copied context: the Groq spans land in the calling request's timings
+            futures = {j: pool.submit(contextvars.copy_context().run, complete, j) for j in todo}
+            for j, f in futures.items():
+                results[j] = f.result()
+        return results
+
+    async def aask(self, question: str, allm, executor=None, filters: dict = None):
+        """
+        ask() for async views: embedding, search and cache I/O run on `executor`
+        (a bounded thread pool), the completion on the async Groq client `allm`.
+        """
+        loop = asyncio.get_running_loop()
+        snap = self._snap
+        # run_in_executor doesn't carry context over; copy it so the spans reach this request
+        qv, hit, ctxs, messages, prompt = await loop.run_in_executor(
+            executor, contextvars.copy_context().run, self._prepare, snap, question, filters)
+        if hit is not None:
+            return hit[0], ctxs, prompt
+        with metrics.external_call("groq", QA_MODEL, stage="llm"):
+            resp = await allm.chat.completions.create(
+                model=QA_MODEL,
+                messages=messages,
+                temperature=0.2,
+            )
+        answer = resp.choices[0].message.content
+        self._log_prompt(prompt, resp)
+        if self.cache is not None:
+            await loop.run_in_executor(
+                executor, lambda: self.cache.set(question, snap.version, answer, ctxs, qv[0], scope=filters))
+        return answer, ctxs, prompt
+
+    def ask_stream(self, question: str, filters: dict = None):
+        """
+        Like ask(), but yields ("matches", ctxs) and ("prompt", stats) as soon as
+        retrieval is done and then ("token", text) pieces as Groq generates them.
+        """
+        snap = self._snap
+        qv, hit, ctxs, messages, prompt = self._prepare(snap, question, filters)
+        yield "matches", ctxs
+        yield "prompt", prompt
+        if hit is not None:
+            yield "token", hit[0]
+            return
+        parts = []
+        t0 = time.perf_counter()
+        with metrics.external_call("groq", QA_MODEL, stage="llm_first_byte"):
+            stream = self.llm.chat.completions.create(
+                model=QA_MODEL,
+                messages=messages,
+                temperature=0.2,
+                stream=True,
+            )
+        for chunk in stream:
+            piece = chunk.choices[0].delta.content if chunk.choices else None
+            if piece:
+                parts.append(piece)
+                yield "token", piece
+        metrics.record("llm_stream", time.perf_counter() - t0)
+        self._log_prompt(prompt)
+        if self.cache is not None:
+            self.cache.set(question, snap.version, "".join(parts), ctxs, qv[0], scope=filters)
+
+    @staticmethod
+    def _messages(question: str, ctx_block: str):
         system = ("Answer using ONLY the spreadsheet context. "
                   "If unknown, say you don't know and reference the closest rows.")
         user = f"Context:\n{ctx_block}\n\nQuestion: {question}\nProvide a concise answer with row refs."
-        resp = self.llm.chat.completions.create(
-            model="llama3-70b-8192",
-            messages=[{"role":"system","content":system},{"role":"user","content":user}],
-            temperature=0.2,
-        )
-        return resp.choices[0].message.content, ctxs
+        return [{"role":"system","content":system},{"role":"user","content":user}]
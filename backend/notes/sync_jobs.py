@@ -0,0 +1,174 @@
+"""
+Sync job manager.
+
+Every sync (POST /api/sync, the poller, the first engine build) goes through
+submit(). Requests coalesce: per kind ("sync" or "full") at most one job is
+waiting to start, and requests that arrive meanwhile get that job's ID. A
+running job is never joined -- it may have read the sheet before the edit the
+caller wants picked up -- so the next request queues one follow-up run.
+SYNC_MAX_CONCURRENT caps heavy jobs per process, and an fcntl lock on
+INDEX_DIR/.sync.lock makes gunicorn workers take turns; a job that waited for
+another worker's sync usually finds nothing left to rebuild.
+
+Job status lives in INDEX_DIR/jobs/<id>.json, so GET /api/sync/<id> can be
+answered by any worker. It includes the time spent per stage (see metrics.py).
+"""
+import os, re, json, time, uuid, fcntl, threading, logging
+from contextlib import contextmanager
+
+from . import metrics
+from .index_store import INDEX_DIR
+
+JOBS_DIR = INDEX_DIR / "jobs"
+LOCK_PATH = INDEX_DIR / ".sync.lock"
+MAX_CONCURRENT = int(os.getenv("SYNC_MAX_CONCURRENT", "1"))
+KEEP_JOBS = 100
+SAVE_INTERVAL = 0.5  # seconds between progress writes
+_JOB_ID = re.compile(r"[0-9a-f]{12}")
+
+_slots = threading.BoundedSemaphore(MAX_CONCURRENT)
+_pending_lock = threading.Lock()
+_pending = {}  # kind -> SyncJob not yet started
+
+
+class SyncJob:
+    def __init__(self, kind: str, run):
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.run = run  # run(progress) -> result dict
+        self.status = "queued"
+        self.requests = 1
+        self.stage = None
+        self.progress = {"fetched_rows": 0, "cached_rows": 0, "embedded_rows": 0,
+                         "indexed_rows": 0, "skipped_sources": 0}
+        self.timings = {}  # stage -> seconds, filled in while the job runs
+        self.result = self.error = None
+        self.created_at = time.time()
+        self.started_at = self.finished_at = None
+        self.done = threading.Event()
+        self._saved_at = 0.0
+
+    def as_dict(self) -> dict:
+        end = self.finished_at or time.time()
+        return {
+            "id": self.id, "kind": self.kind, "status": self.status, "stage": self.stage,
+            "requests": self.requests, "progress": self.progress,
+            "stages_s": {k: round(v, 3) for k, v in list(self.timings.items())},
+            "result": self.result, "error": self.error, "pid": os.getpid(),
+            "created_at": self.created_at, "started_at": self.started_at, "finished_at": self.finished_at,
+            "queued_s": round((self.started_at or end) - self.created_at, 3),
+            "run_s": round(end - self.started_at, 3) if self.started_at else None,
+        }
+
+    def report(self, stage: str = None, **counts):
+        """Progress callback handed to sync_sheet: set the stage and/or add to counters."""
+        if stage:
+            self.stage = stage
+        for key, n in counts.items():
+            self.progress[key] = self.progress.get(key, 0) + n
+        self.save(force=stage is not None)
+
+    def save(self, force: bool = True):
+        now = time.monotonic()
+        if not force and now - self._saved_at < SAVE_INTERVAL:
+            return
+        self._saved_at = now
+        try:
+            JOBS_DIR.mkdir(parents=True, exist_ok=True)
+            tmp = JOBS_DIR / f".{self.id}.tmp"
+            tmp.write_text(json.dumps(self.as_dict()))
+            os.replace(tmp, JOBS_DIR / f"{self.id}.json")
+        except OSError:
+            logging.exception("Could not write sync job %s status", self.id)
+
+    def wait(self, timeout: float = None):
+        self.done.wait(timeout)
+        return self
+
+
+def submit(kind: str, run):
+    """(job, coalesced): queue run(progress) as a `kind` job, or join the one already queued."""
+    with _pending_lock:
+        job = _pending.get(kind)
+        if job is not None:
+            job.requests += 1
+            job.save()
+            return job, True
+        job = _pending[kind] = SyncJob(kind, run)
+    job.save()
+    threading.Thread(target=_execute, args=(job,), name=f"sync-{job.id}", daemon=True).start()
+    return job, False
+
+
+def get(job_id: str):
+    if not _JOB_ID.fullmatch(job_id or ""):
+        return None
+    try:
+        return json.loads((JOBS_DIR / f"{job_id}.json").read_text())
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+@contextmanager
+def _worker_lock(job: SyncJob):
+    LOCK_PATH.parent.mkdir(parents=True, exist_ok=True)
+    with open(LOCK_PATH, "a") as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            job.status = "waiting"
+            job.report(stage="waiting for another worker's sync")
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _execute(job: SyncJob):
+    try:
+        with _slots, _worker_lock(job):
+            with _pending_lock:
+                # from here on the sheet gets read; later requests need a new job
+                if _pending.get(job.kind) is job:
+                    del _pending[job.kind]
+            job.status, job.started_at = "running", time.time()
+            job.report(stage="starting")
+            with metrics.collect() as unit:
+                job.timings = unit.timings
+                job.result = job.run(job.report)
+            job.status = "succeeded"
+    except Exception as e:
+        logging.exception("Sync job %s failed: %s", job.id, e)
+        job.status, job.error = "failed", str(e)
+    finally:
+        with _pending_lock:
+            if _pending.get(job.kind) is job:
+                del _pending[job.kind]
+        job.finished_at = time.time()
+        job.stage = None
+        job.save()
+        _record_metrics(job)
+        job.done.set()
+        _prune()
+
+
+def _record_metrics(job: SyncJob):
+    metrics.inc("heysheet_sync_jobs_total", kind=job.kind, status=job.status)
+    if job.started_at:
+        metrics.observe("heysheet_sync_seconds", job.finished_at - job.started_at, kind=job.kind)
+    for key in ("fetched_rows", "embedded_rows", "cached_rows", "indexed_rows"):
+        if job.progress.get(key):
+            metrics.inc("heysheet_sync_rows_total", job.progress[key], kind=key[:-len("_rows")])
+    logging.info("Sync job %s %s: %s", job.id, job.status, json.dumps(
+        {"kind": job.kind, "run_s": job.as_dict()["run_s"], "progress": job.progress,
+         "stages_s": {k: round(v, 3) for k, v in job.timings.items()}}))
+
+
+def _prune():
+    try:
+        files = sorted(JOBS_DIR.glob("*.json"), key=lambda p: p.stat().st_mtime)
+        for p in files[:-KEEP_JOBS]:
+            p.unlink(missing_ok=True)
+    except OSError:
+        pass
@@ -0,0 +1,1130 @@
+import io, os, re, sys, json, time, runpy, contextlib, hashlib, tempfile, threading, unittest, subprocess
+from datetime import timedelta
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import mock
+
+os.environ.setdefault("SPREADSHEET_ID", "test-sheet")
+
+import numpy as np
+from django.conf import settings
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+
+from benchmarks import fakes
+from notes import (ann, booking_queue, change_detector, context_budget, embedders, google_sheets, index_store,
+                   keyword_index, metrics, sheets_booking, sheets_rag, sync_jobs, views)
+from notes.answer_cache import AnswerCache
+from notes.embedding_cache import EmbeddingCache
+from notes.index_store import IndexGeneration
+from notes.models import PendingAppointment
+
+
+class HashEmbedder:
+    """Bag-of-words vectors (normalised token hashes); counts the texts it encodes."""
+    dim = 64
+
+    def __init__(self):
+        self.encoded = 0
+
+    def get_sentence_embedding_dimension(self):
+        return self.dim
+
+    def encode(self, texts, batch_size=32, convert_to_numpy=True, normalize_embeddings=False, **kw):
+        out = np.zeros((len(texts), self.dim), dtype="float32")
+        for row, text in enumerate(texts):
+            for token in re.findall(r"\w+", text.lower()):
+                out[row, int(hashlib.md5(token.encode()).hexdigest(), 16) % self.dim] += 1
+        self.encoded += len(texts)
+        if normalize_embeddings:
+            out /= np.clip(np.linalg.norm(out, axis=1, keepdims=True), 1e-12, None)
+        return out
+
+
+class IndexTestCase(SimpleTestCase):
+    """Syncs against a FakeSheets spreadsheet into a throwaway INDEX_DIR."""
+    sources = "Sched!A1:Z"
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = Path(tmp.name)
+        self.sheets = fakes.FakeSheets({"Sched": fakes.schedule_tab(30)})
+        self.embedder = HashEmbedder()
+        for patcher in (
+            mock.patch.dict(os.environ, {"RAG_SOURCES": self.sources, "RAG_COLUMN_WEIGHTS": "Notes:0",
+                                         "ANSWER_CACHE": "off"}),
+            mock.patch.object(index_store, "INDEX_DIR", self.dir),
+            mock.patch.object(change_detector, "STATE_PATH", self.dir / "sources.json"),
+            mock.patch.object(change_detector, "MODE", "drive"),
+            mock.patch.object(google_sheets, "_service", lambda *a: self.sheets),
+            mock.patch.object(sheets_rag, "get_embedder", lambda: self.embedder),
+            mock.patch.object(sheets_rag, "embedding_cache", lambda: None),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def current(self, label="Sched") -> IndexGeneration:
+        src = next(s for s in sheets_rag.rag_sources() if s.label == label)
+        return IndexGeneration.current(src.shard)
+
+    def sync(self) -> int:
+        self.embedder.encoded = 0
+        return sheets_rag.sync_sheet()
+
+    def engine(self, cache=None) -> sheets_rag.QAEngine:
+        self.llm = fakes.FakeGroq()
+        return sheets_rag.QAEngine(llm=self.llm, cache=cache)
+
+
+# -------------------------
+# Incremental sync
+# -------------------------
+class IncrementalSyncTests(IndexTestCase):
+    def test_unchanged_sheet_is_not_refetched(self):
+        self.assertEqual(self.sync(), 30)
+        self.assertEqual(self.embedder.encoded, 30)
+        version = self.current().version
+        self.assertEqual(self.sync(), 0)
+        self.assertEqual(self.embedder.encoded, 0)
+        self.assertEqual(self.current().version, version)
+
+    def test_edited_row_is_the_only_one_embedded(self):
+        self.sync()
+        self.sheets.edit("Sched", 5, 0, "Glassblowing Taster")
+        self.assertEqual(self.sync(), 30)
+        self.assertEqual(self.embedder.encoded, 1)
+        gen = self.current()
+        self.assertIn("Glassblowing Taster", gen.text(list(gen.row_ids).index(5)))
+
+    def test_deleted_row_drops_out_and_the_rest_are_reused(self):
+        self.sync()
+        removed = self.sheets.tabs["Sched"].pop(3)
+        self.sheets.versions["Sched"] = 1
+        self.sync()
+        self.assertEqual(self.embedder.encoded, 0)
+        gen = self.current()
+        self.assertEqual(len(gen), 29)
+        self.assertFalse(any(removed[0] in gen.text(i) for i in range(len(gen))))
+
+    def test_unweighted_column_edit_is_published_without_embedding(self):
+        self.sync()
+        version = self.current().version
+        self.sheets.edit("Sched", 2, 7, "Bring your own clay")
+        self.sync()
+        self.assertEqual(self.embedder.encoded, 0)
+        gen = self.current()
+        self.assertNotEqual(gen.version, version)
+        self.assertIn("Bring your own clay", gen.text(0))
+
+    def test_blank_and_repeated_headers_sync(self):
+        self.sheets.tabs["Sched"] = [["Day", "", "", "Day", "Notes"], ["Mon", "a", "b", "Tue", "x"],
+                                     ["Wed", "c", "d", "Thu", "y", "z"]]
+        self.assertEqual(self.sync(), 2)
+        gen = self.current()
+        self.assertTrue(gen.text(0).startswith("Day: Mon | Column B: a | Column C: b | Day.1: Tue | Notes: x"))
+        self.assertIn("Column F: z", gen.text(1))
+        self.assertEqual(int(gen.filter_mask({"Day.1": "tue"}).sum()), 1)
+
+    def test_full_sync_reembeds_everything(self):
+        self.sync()
+        self.sheets.edit("Sched", 5, 0, "Glassblowing Taster")
+        with mock.patch.dict(os.environ, {"RAG_SYNC_MODE": "full"}):
+            self.sync()
+        self.assertEqual(self.embedder.encoded, 30)
+
+
+# -------------------------
+# Engine hot-swap
+# -------------------------
+class HotSwapTests(IndexTestCase):
+    def test_engine_needs_an_index(self):
+        with self.assertRaisesMessage(RuntimeError, "Index not built"):
+            self.engine()
+
+    def test_refresh_swaps_in_the_new_generation(self):
+        self.sync()
+        engine = self.engine()
+        version = engine.version
+        self.assertFalse(engine.is_stale())
+        self.sheets.edit("Sched", 2, 0, "Glassblowing Taster")
+        self.sync()
+        self.assertTrue(engine.is_stale())
+        self.assertTrue(engine.refresh())
+        self.assertNotEqual(engine.version, version)
+        self.assertFalse(engine.is_stale())
+        self.assertEqual(engine.retrieve("Glassblowing Taster", k=1)[0]["row"], 2)
+
+
+# -------------------------
+# Answer cache
+# -------------------------
+class AnswerCacheTests(IndexTestCase):
+    def test_repeated_question_skips_groq_until_the_index_changes(self):
+        self.sync()
+        engine = self.engine(cache=AnswerCache())
+        first, _, _ = engine.ask("Who teaches Intro Pottery 1?")
+        cached, _, prompt = engine.ask("who teaches intro pottery 1")
+        self.assertEqual(cached, first)
+        self.assertTrue(prompt["cached"])
+        self.assertEqual(self.llm.faults.calls, 1)
+
+        self.sheets.edit("Sched", 2, 3, "Jo Chen")
+        self.sync()
+        engine.refresh()
+        engine.ask("Who teaches Intro Pottery 1?")
+        self.assertEqual(self.llm.faults.calls, 2)
+
+    def test_similar_question_hits_and_scoped_one_only_exactly(self):
+        cache = AnswerCache(similarity=0.9)
+        qv = np.array([1.0, 0.0], dtype="float32")
+        cache.set("When is pottery?", "v1", "Mondays", [], qv)
+        self.assertEqual(cache.get("Pottery when?", "v1", np.array([0.99, 0.14], dtype="float32"))[0], "Mondays")
+        self.assertIsNone(cache.get("Pottery when?", "v1", np.array([0.0, 1.0], dtype="float32")))
+        self.assertIsNone(cache.get("Pottery when?", "v2", qv))
+        cache.set("When is pottery?", "v1", "Tuesdays", [], qv, scope={"day": "tue"})
+        self.assertIsNone(cache.get("Pottery when?", "v1", qv, scope={"day": "tue"}))
+        self.assertEqual(cache.get("when is POTTERY", "v1", qv, scope={"day": "tue"})[0], "Tuesdays")
+
+
+# -------------------------
+# /api/ask/stream
+# -------------------------
+class EngineViewTestCase(IndexTestCase):
+    """A synced index with the QA engine already serving it in this worker."""
+
+    def setUp(self):
+        super().setUp()
+        self.sync()
+        for patcher in (mock.patch.object(views, "_engine", self.engine()),
+                        mock.patch.object(views, "_engine_building", False)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    @staticmethod
+    def events(resp) -> list:
+        body = b"".join(resp.streaming_content).decode()
+        out = []
+        for block in body.strip().split("\n\n"):
+            event, data = block.split("\n")
+            out.append((event[len("event: "):], json.loads(data[len("data: "):])))
+        return out
+
+
+class AskStreamTests(EngineViewTestCase):
+    def test_qa_streams_matches_then_tokens(self):
+        resp = self.client.post("/api/ask/stream", {"question": "Who teaches Intro Pottery 1?"},
+                                content_type="application/json")
+        self.assertEqual(resp["Content-Type"], "text/event-stream")
+        events = self.events(resp)
+        kinds = [e for e, _ in events]
+        self.assertEqual(kinds[:2], ["matches", "prompt"])
+        self.assertEqual(kinds[-1], "done")
+        self.assertEqual(set(kinds[2:-1]), {"token"})
+        answer = "".join(d["text"] for e, d in events if e == "token")
+        self.assertTrue(answer.startswith("According to Sched row"), answer)
+
+    def test_engine_still_loading_sends_one_answer_event(self):
+        with mock.patch.object(views, "_engine", None), mock.patch.object(views, "_engine_building", True):
+            resp = self.client.post("/api/ask/stream", {"question": "Who teaches pottery?"},
+                                    content_type="application/json")
+            events = self.events(resp)
+        self.assertEqual([e for e, _ in events], ["answer", "done"])
+        self.assertEqual(events[0][1]["intent"], "qa_initializing")
+
+    def test_bad_body(self):
+        resp = self.client.post("/api/ask/stream", "{", content_type="application/json")
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(self.client.get("/api/ask/stream").status_code, 405)
+
+
+# -------------------------
+# Google Sheets client
+# -------------------------
+class SheetsClientTests(SimpleTestCase):
+    def setUp(self):
+        self.loaded, self.built = [], []
+
+        def load(scope):
+            self.loaded.append(scope)
+            return mock.Mock(token=None, expiry=None)
+
+        def build(api, version, **kw):
+            self.built.append((api, threading.get_ident()))
+            return mock.Mock()
+
+        for patcher in (mock.patch.object(google_sheets, "_creds", {}),
+                        mock.patch.object(google_sheets, "_local", threading.local()),
+                        mock.patch.object(google_sheets, "_load_credentials", load),
+                        mock.patch.object(google_sheets, "_start_refresher", lambda: None),
+                        mock.patch.object(google_sheets, "build", build)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_service_is_built_once_per_thread_and_scope(self):
+        svc = google_sheets.sheets_service()
+        self.assertIs(google_sheets.sheets_service(), svc)
+        self.assertIsNot(google_sheets.sheets_service(readonly=False), svc)
+        other = []
+        thread = threading.Thread(target=lambda: other.append(google_sheets.sheets_service()))
+        thread.start()
+        thread.join()
+        self.assertIsNot(other[0], svc)
+        self.assertEqual(len(self.built), 3)
+        # credentials are shared by every thread
+        self.assertEqual(self.loaded, [google_sheets.SCOPE_READONLY, google_sheets.SCOPE_READWRITE])
+
+    def test_refresh_only_renews_tokens_close_to_expiry(self):
+        google_sheets.get_credentials()
+        fresh = google_sheets.get_credentials(google_sheets.SCOPE_READWRITE)
+        fresh.token = "t"
+        fresh.expiry = google_sheets.dt.datetime.utcnow() + google_sheets.dt.timedelta(hours=1)
+        google_sheets.refresh_credentials()
+        google_sheets.get_credentials().refresh.assert_called_once()
+        fresh.refresh.assert_not_called()
+
+
+# -------------------------
+# Booking ID index
+# -------------------------
+class BookingIndexTestCase(SimpleTestCase):
+    """Bookings against a FakeSheets Appointments tab, with this worker's index empty."""
+
+    def setUp(self):
+        self.sheets = fakes.FakeSheets({"Appointments": fakes.appointments_tab(5),
+                                        "Services": fakes.services_tab()})
+        for patcher in (mock.patch.object(sheets_booking, "_svc", lambda readonly: self.sheets),
+                        mock.patch.object(sheets_booking, "_appt_headers", None),
+                        mock.patch.object(sheets_booking, "_appt_rows", {}),
+                        mock.patch.object(sheets_booking, "_appt_loaded_at", 0.0),
+                        mock.patch.object(sheets_booking, "_appt_misses", {}),
+                        mock.patch.object(sheets_booking, "_catalog", None),
+                        mock.patch.object(sheets_booking, "_catalog_refreshing", False)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def booking_id(self, rownum: int) -> str:
+        return self.sheets.tabs["Appointments"][rownum - 1][6]
+
+
+class BookingIndexTests(BookingIndexTestCase):
+    def test_lookup_reads_the_sheet_once_then_verifies_the_cell(self):
+        self.assertEqual(sheets_booking._find_row(self.booking_id(3)), 3)
+        calls = self.sheets.faults.calls
+        self.assertEqual(sheets_booking._find_row(self.booking_id(4)), 4)
+        self.assertEqual(self.sheets.faults.calls, calls + 1)
+
+    def test_booking_from_another_worker_is_found_right_away(self):
+        sheets_booking._find_row(self.booking_id(2))
+        self.sheets.tabs["Appointments"].append(["Sam", "sam@example.com", "5550100", "Intro Pottery", "5",
+                                                 "", "ABCD1234", "2025-08-01 10:00:00Z"])
+        self.assertEqual(sheets_booking._find_row("ABCD1234"), 7)
+
+    def test_unknown_id_is_not_reread_straight_away(self):
+        self.assertIsNone(sheets_booking._find_row("NOPE0000"))
+        calls = self.sheets.faults.calls
+        self.assertIsNone(sheets_booking._find_row("NOPE0000"))
+        self.assertEqual(self.sheets.faults.calls, calls)
+
+    def test_update_after_rows_moved_by_hand_writes_the_right_row(self):
+        moved, other = self.booking_id(4), self.booking_id(3)
+        sheets_booking._find_row(moved)
+        del self.sheets.tabs["Appointments"][1]  # someone deletes row 2 in the sheet
+        self.assertTrue(sheets_booking.update_appointment(moved, phone="5550199"))
+        rows = self.sheets.tabs["Appointments"]
+        self.assertEqual((rows[2][6], rows[2][2]), (moved, "5550199"))
+        self.assertEqual(rows[1][6], other)
+        self.assertNotEqual(rows[1][2], "5550199")
+
+
+# -------------------------
+# Services catalog
+# -------------------------
+class ServicesCatalogTests(BookingIndexTestCase):
+    def test_catalog_is_read_once_within_the_ttl(self):
+        names = [row[0] for row in fakes.services_tab()[1:]]
+        self.assertEqual(sheets_booking.services_catalog().names, names)
+        self.assertEqual(len(sheets_booking.list_services()), len(names))
+        self.assertEqual(self.sheets.faults.calls, 1)
+
+    def test_stale_catalog_is_served_while_it_reloads(self):
+        stale = sheets_booking.services_catalog()
+        self.sheets.tabs["Services"].append(["Kiln Basics", "60", "40", "Studio A"])
+        with mock.patch.object(sheets_booking, "SERVICES_CACHE_TTL", 0):
+            self.assertIs(sheets_booking.services_catalog(), stale)
+            while sheets_booking._catalog_refreshing:
+                time.sleep(0.01)
+        self.assertIn("Kiln Basics", sheets_booking.services_catalog().names)
+
+    def test_expired_catalog_is_reloaded_in_the_request(self):
+        sheets_booking.services_catalog()
+        self.sheets.tabs["Services"].append(["Kiln Basics", "60", "40", "Studio A"])
+        with mock.patch.object(sheets_booking, "SERVICES_CACHE_TTL", 0), \
+                mock.patch.object(sheets_booking, "SERVICES_STALE_TTL", 0):
+            self.assertIn("Kiln Basics", sheets_booking.services_catalog().names)
+
+    def test_invalidate_drops_the_catalog(self):
+        sheets_booking.services_catalog()
+        self.sheets.tabs["Services"].append(["Kiln Basics", "60", "40", "Studio A"])
+        sheets_booking.invalidate_services()
+        self.assertIn("Kiln Basics", sheets_booking.services_catalog().names)
+
+
+# -------------------------
+# Write-behind bookings
+# -------------------------
+class BookingQueueTests(TestCase):
+    def setUp(self):
+        self.sheets = fakes.FakeSheets({"Appointments": [list(fakes.APPOINTMENTS_HEADERS)]})
+        for patcher in (
+            mock.patch.dict(os.environ, {"BOOKING_WRITE_BEHIND": "true"}),
+            mock.patch.object(booking_queue, "start_flusher", lambda: None),
+            mock.patch.object(sheets_booking, "_svc", lambda readonly: self.sheets),
+            mock.patch.object(sheets_booking, "_appt_headers", None),
+            mock.patch.object(sheets_booking, "_appt_rows", {}),
+            mock.patch.object(sheets_booking, "_appt_misses", {}),
+            mock.patch.object(sheets_booking, "FLUSH_WAIT", 0),
+            mock.patch.object(views, "_groq", fakes.FakeGroq()),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def book(self, name="Jamie Rivera"):
+        return sheets_booking.create_appointment(name, "jamie@example.com", "5550100", "Intro Pottery", 5)
+
+    def status(self, booking_id):
+        return PendingAppointment.objects.get(booking_id=booking_id).status
+
+    def test_flush_appends_pending_bookings_in_one_call(self):
+        first, second = self.book(), self.book("Alex Kim")
+        self.assertEqual(self.sheets.tabs["Appointments"][1:], [])
+        self.assertEqual(booking_queue.flush_once(), 2)
+        self.assertEqual(self.sheets.faults.calls, 1)
+        self.assertEqual(booking_queue.booking_status(first)["sheet_row"], 2)
+        self.assertEqual(booking_queue.booking_status(second)["sheet_row"], 3)
+        self.assertEqual(self.sheets.tabs["Appointments"][2][6], second)
+        self.assertEqual(booking_queue.flush_once(), 0)
+
+    def test_failed_flush_backs_off_then_retries(self):
+        booking_id = self.book()
+        self.sheets.faults.error_rate = 1.0
+        self.assertEqual(booking_queue.flush_once(), 0)
+        pa = PendingAppointment.objects.get(booking_id=booking_id)
+        self.assertEqual((pa.status, pa.attempts), (PendingAppointment.PENDING, 1))
+        self.assertIn("503", pa.last_error)
+        self.assertGreater(pa.next_attempt_at, timezone.now())
+
+        self.sheets.faults.error_rate = 0.0
+        self.assertEqual(booking_queue.flush_once(), 0)  # still backing off
+        PendingAppointment.objects.filter(pk=pa.pk).update(next_attempt_at=timezone.now())
+        self.assertEqual(booking_queue.flush_once(), 1)
+        self.assertEqual(self.status(booking_id), PendingAppointment.WRITTEN)
+
+    def test_stale_claim_is_taken_over(self):
+        booking_id = self.book()
+        PendingAppointment.objects.filter(booking_id=booking_id).update(
+            status=PendingAppointment.FLUSHING, claimed_at=timezone.now() - timedelta(minutes=10))
+        self.assertEqual(booking_queue.flush_once(), 1)
+        self.assertEqual(self.status(booking_id), PendingAppointment.WRITTEN)
+
+    def test_update_before_flush_patches_the_queued_row(self):
+        booking_id = self.book()
+        self.assertTrue(sheets_booking.update_appointment(booking_id, phone="5550199"))
+        booking_queue.flush_once()
+        self.assertEqual(self.sheets.tabs["Appointments"][1][2], "5550199")
+
+    def test_update_during_flush_asks_to_retry(self):
+        booking_id = self.book()
+        PendingAppointment.objects.filter(booking_id=booking_id).update(
+            status=PendingAppointment.FLUSHING, claimed_at=timezone.now())
+        with self.assertRaisesMessage(RuntimeError, "booking_flushing"):
+            sheets_booking.update_appointment(booking_id, phone="5550199")
+        self.assertEqual(self.sheets.faults.calls, 0)
+        out = views._handle_action(f"Please change booking {booking_id} phone to 5550199", "appointments.update")
+        self.assertTrue(out["retry"])
+        self.assertNotIn("not_found", out)
+
+    def test_update_after_flush_writes_the_sheet_row(self):
+        booking_id = self.book()
+        booking_queue.flush_once()
+        self.assertTrue(sheets_booking.update_appointment(booking_id, phone="5550199"))
+        self.assertEqual(self.sheets.tabs["Appointments"][1][2], "5550199")
+
+
+# -------------------------
+# Worker class and app
+# -------------------------
+def _run_python(code: str, **env) -> str:
+    """Output of `code` in a fresh interpreter in the backend directory, with env added."""
+    env = {k: v for k, v in os.environ.items() if k not in ("GUNICORN_WORKER_CLASS", "HEYSHEET_ASGI")} | env
+    proc = subprocess.run([sys.executable, "-W", "ignore", "-c", code], cwd=settings.BASE_DIR, env=env,
+                          capture_output=True, text=True, timeout=120)
+    if proc.returncode:
+        raise AssertionError(proc.stderr)
+    return proc.stdout.strip().splitlines()[-1]
+
+
+class WorkerClassTests(SimpleTestCase):
+    _APP = ("import json, {module}; from django.conf import settings; "
+            "print(json.dumps([type({module}.application).__name__, "
+            "'whitenoise.middleware.WhiteNoiseMiddleware' in settings.MIDDLEWARE]))")
+
+    def conf(self, **env):
+        with mock.patch.dict(os.environ):
+            os.environ.pop("GUNICORN_WORKER_CLASS", None)
+            os.environ.update(env)
+            return runpy.run_path(str(settings.BASE_DIR / "gunicorn.conf.py"))
+
+    def test_gunicorn_conf_loads_the_app_for_the_worker_class(self):
+        conf = self.conf()
+        self.assertEqual((conf["worker_class"], conf["wsgi_app"]), ("sync", "core.wsgi:application"))
+        conf = self.conf(GUNICORN_WORKER_CLASS="uvicorn.workers.UvicornWorker")
+        self.assertEqual(conf["wsgi_app"], "core.asgi:application")
+
+    def test_static_files_follow_the_loaded_app(self):
+        out = _run_python(self._APP.format(module="core.asgi"))
+        self.assertEqual(json.loads(out), ["ASGIStaticFilesHandler", False])
+        # the env var alone doesn't take WhiteNoise away from a WSGI app
+        out = _run_python(self._APP.format(module="core.wsgi"), GUNICORN_WORKER_CLASS="uvicorn.workers.UvicornWorker")
+        self.assertEqual(json.loads(out), ["WSGIHandler", True])
+
+
+# -------------------------
+# Row documents
+# -------------------------
+class BuildDocumentsTests(SimpleTestCase):
+    def test_weights_repeat_or_drop_columns_in_the_embedded_text(self):
+        df = sheets_rag._values_to_df([["Class Name", "Day", "Notes"], ["Pottery", "Mon", "apron"],
+                                       ["Weaving", "Tue", ""]])
+        display, embed = sheets_rag.build_documents(df, weights={"Class Name": 2, "Notes": 0})
+        self.assertEqual(display.tolist(), ["Class Name: Pottery | Day: Mon | Notes: apron",
+                                            "Class Name: Weaving | Day: Tue | Notes: "])
+        self.assertEqual(embed[0], "Class Name: Pottery | Class Name: Pottery | Day: Mon")
+        self.assertEqual(df["__row_id"].tolist(), [2, 3])
+
+    def test_blank_and_repeated_headers_get_unique_names(self):
+        df = sheets_rag._values_to_df([["Day", "", "", "Notes", "Day"], ["Mon", "a", "b", "c", "Tue", "x"]])
+        self.assertEqual(list(df.columns), ["Day", "Column B", "Column C", "Notes", "Day.1", "Column F", "__row_id"])
+        display, _ = sheets_rag.build_documents(df, columns=["Day", "Column F"])
+        self.assertEqual(display[0], "Day: Mon | Column F: x")
+        self.assertEqual(list(sheets_rag._values_to_df([["", "Day", "Day"]]).columns),
+                         ["Column A", "Day", "Day.1", "__row_id"])
+
+
+# -------------------------
+# Several sources
+# -------------------------
+class MultiSourceTests(IndexTestCase):
+    sources = "Sched!A1:Z; other-sheet|Prices!A1:Z"
+
+    def setUp(self):
+        super().setUp()
+        self.sheets.tabs["Prices"] = fakes.services_tab()
+
+    def test_each_source_gets_its_own_shard(self):
+        self.assertEqual(self.sync(), 30 + len(fakes.services_tab()) - 1)
+        shards = {src.shard for src in sheets_rag.rag_sources()}
+        self.assertEqual(len(shards), 2)
+        self.assertEqual(len(self.current("Prices")), len(fakes.services_tab()) - 1)
+        engine = self.engine()
+        self.assertEqual(set(engine.shards()), shards)
+        self.assertEqual(engine.retrieve("Cohort 7", k=1)[0]["source"], "Sched")
+        self.sheets.edit("Prices", 2, 0, "Kiln Basics")
+        self.sync()
+        engine.refresh()
+        self.assertEqual(engine.retrieve("Kiln Basics", k=1)[0]["source"], "Prices")
+
+    def test_editing_one_tab_rebuilds_only_its_shard(self):
+        self.sync()
+        sched = self.current().version
+        self.sheets.edit("Prices", 2, 2, "999")
+        self.sync()
+        self.assertEqual(self.embedder.encoded, 1)
+        self.assertEqual(self.current().version, sched)
+
+
+class HeaderOnlySourceTests(IndexTestCase):
+    sources = "Sched!A1:Z; Empty!A1:Z"
+
+    def test_header_only_tab_is_an_empty_shard(self):
+        self.sheets.tabs["Empty"] = [list(fakes.SCHEDULE_HEADERS)]
+        self.assertEqual(self.sync(), 30)
+        self.assertEqual(len(self.current("Empty")), 0)
+        self.assertEqual(self.sync(), 0)
+
+    def test_missing_tab_does_not_fail_the_others(self):
+        # Sheets rejects the whole batchGet; the ranges are read one by one
+        self.assertEqual(self.sync(), 30)
+        self.assertIsNone(self.current("Empty"))
+        # the spreadsheet is fetched again until every source could be read
+        self.assertEqual(self.sync(), 0)
+        self.assertEqual(self.embedder.encoded, 0)
+        self.sheets.tabs["Empty"] = fakes.schedule_tab(3)
+        self.assertEqual(self.sync(), 3)
+
+    def test_every_source_failing_fails_the_sync(self):
+        del self.sheets.tabs["Sched"]
+        with self.assertRaisesMessage(RuntimeError, "Sheet empty or inaccessible."):
+            self.sync()
+
+
+# -------------------------
+# Keyword search
+# -------------------------
+class KeywordIndexTests(IndexTestCase):
+    def test_bm25_prefers_repeated_terms_in_short_rows(self):
+        docs = ["pottery wheel pottery", "pottery", "pottery and a very long description of the studio", "weaving"]
+        keyword_index.save(self.dir, keyword_index.build([keyword_index.tokenize(d) for d in docs],
+                                                         [()] * len(docs)))
+        scores, hits = keyword_index.KeywordIndex(self.dir).search(["pottery"], 10)
+        self.assertEqual(list(hits), [0, 1, 2])
+        self.assertTrue(all(scores[:-1] >= scores[1:]))
+
+    def test_column_filter_restricts_keyword_hits(self):
+        self.sync()
+        gen = self.current()
+        rows = self.sheets.tabs["Sched"][1:]
+        day = rows[0][1]
+        allowed = gen.filter_mask({"day": day.upper()})
+        self.assertEqual(int(allowed.sum()), sum(r[1] == day for r in rows))
+        craft = rows[0][0].split()[-2]
+        _, hits = gen.keyword_search(keyword_index.tokenize(craft), 10, allowed)
+        self.assertTrue(len(hits))
+        for i in hits:
+            self.assertTrue(allowed[i])
+            self.assertIn(craft, gen.text(i))
+        self.assertFalse(gen.filter_mask({"day": "Someday"}).any())
+
+    def test_weight_zero_column_is_filterable_but_not_keyword_searchable(self):
+        self.sheets.edit("Sched", 2, 7, "Bring an apron")
+        self.sync()
+        gen = self.current()
+        self.assertEqual(len(gen.keyword_search(["apron"], 10)[1]), 0)
+        self.assertEqual(list(np.flatnonzero(gen.filter_mask({"Notes": "bring an apron"}))), [0])
+        with mock.patch.dict(os.environ, {"RAG_COLUMN_WEIGHTS": ""}):
+            sheets_rag.sync_sheet(force=True)
+        self.assertIn(0, self.current().keyword_search(["apron"], 100)[1])
+
+    def test_fusion_ranks_rows_both_retrievers_found_first(self):
+        gen = mock.Mock(shard="s", label="Sched", row_ids=np.arange(2, 12), text=lambda i: f"row {i}")
+        vec = [(0.9, gen, 0), (0.8, gen, 1), (0.7, gen, 2)]
+        kw = [(12.0, gen, 3), (9.0, gen, 2)]
+        hits = sheets_rag.QAEngine._fuse(vec, kw, k=3, depth=30, hybrid=True)
+        self.assertEqual([h["row"] for h in hits], [4, 2, 5])
+        self.assertEqual([h["cosine"] for h in hits], [0.7, 0.9, None])
+        plain = sheets_rag.QAEngine._fuse(vec, [], k=2, depth=2, hybrid=False)
+        self.assertEqual([(h["row"], h["score"]) for h in plain], [(2, 0.9), (3, 0.8)])
+
+
+# -------------------------
+# ANN indexes
+# -------------------------
+try:
+    import faiss  # noqa: F401
+except ImportError:
+    faiss = None
+
+
+class AnnTests(IndexTestCase):
+    def query(self, gen, i):
+        return self.embedder.encode([gen.text(i)], normalize_embeddings=True)
+
+    def test_kind_follows_the_row_count(self):
+        with mock.patch.object(ann, "RAG_ANN", "auto"):
+            self.assertEqual(ann.choose_kind(ann.HNSW_MIN_ROWS - 1), "flat")
+            self.assertEqual(ann.choose_kind(ann.HNSW_MIN_ROWS), "hnsw")
+            self.assertEqual(ann.choose_kind(ann.IVFPQ_MIN_ROWS), "ivfpq")
+            self.assertEqual(ann.choose_kind(10 ** 9, "flat"), "flat")
+        self.sync()
+        self.assertEqual(self.current().ann_meta, {"kind": "flat"})
+
+    @unittest.skipIf(faiss is None, "faiss is not installed")
+    def test_hnsw_shard_finds_the_same_rows(self):
+        with mock.patch.object(ann, "RAG_ANN", "auto"), mock.patch.object(ann, "HNSW_MIN_ROWS", 10):
+            self.sync()
+        gen = self.current()
+        self.assertEqual(gen.ann_meta["kind"], "hnsw")
+        self.assertEqual(gen.search(self.query(gen, 5), 1)[1][0][0], 5)
+        allowed = np.zeros(len(gen), dtype=bool)
+        allowed[[3, 4]] = True
+        self.assertEqual(set(gen.search(self.query(gen, 5), 5, allowed)[1][0]) - {-1}, {3, 4})
+
+    @unittest.skipIf(faiss is None, "faiss is not installed")
+    def test_incremental_ivfpq_build_keeps_the_training(self):
+        self.sheets.tabs["Sched"] = fakes.schedule_tab(300)
+        with mock.patch.object(ann, "RAG_ANN", "auto"), mock.patch.object(ann, "IVFPQ_MIN_ROWS", 100), \
+                mock.patch.object(ann, "_train_sample", wraps=ann._train_sample) as train:
+            self.sync()
+            self.sheets.edit("Sched", 5, 0, "Glassblowing Taster")
+            self.sync()
+        gen = self.current()
+        self.assertEqual(gen.ann_meta["kind"], "ivfpq")
+        self.assertEqual(train.call_count, 1)
+        self.assertIn(3, gen.search(self.query(gen, 3), 5)[1][0])
+
+
+# -------------------------
+# Context budget
+# -------------------------
+class ContextBudgetTests(SimpleTestCase):
+    def test_score_cutoff_uses_cosine_not_fused_score(self):
+        ctxs = [
+            {"row": 2, "source": "Sched", "text": "Class Name: Pottery", "score": 0.0328, "cosine": 0.8},
+            {"row": 3, "source": "Sched", "text": "Class Name: Weaving", "score": 0.0325, "cosine": 0.2},
+            {"row": 4, "source": "Sched", "text": "Class Name: Mosaic", "score": 0.0161, "cosine": None},
+        ]
+        _, used, stats = context_budget.assemble("pottery", ctxs, min_ratio=0.5)
+        self.assertEqual([c["row"] for c in used], [2, 4])
+        self.assertEqual(stats["rows_below_score"], 1)
+
+    def test_empty_and_shared_cells(self):
+        ctxs = [{"row": 2, "source": "Sched", "score": 0.9,
+                 "text": "Class Name: Pottery | Location: Studio A | Notes: "},
+                {"row": 3, "source": "Sched", "score": 0.9,
+                 "text": "Class Name: Weaving | Location: Studio A | Notes: n/a"}]
+        block, used, stats = context_budget.assemble("pottery", ctxs)
+        self.assertEqual([l for l in block.splitlines() if l], ["[all rows] Location: Studio A",
+                                              "[Sched row 2] Class Name: Pottery",
+                                              "[Sched row 3] Class Name: Weaving"])
+        self.assertEqual((stats["cells_empty"], stats["cells_shared"]), (2, 2))
+
+    def test_wide_rows_keep_the_cells_the_question_mentions(self):
+        filler = " | ".join(f"Extra {i}: lorem ipsum dolor sit amet" for i in range(40))
+        ctxs = [{"row": 2, "source": "Sched", "score": 0.9, "text": f"{filler} | Instructor: Priya Nair"},
+                {"row": 3, "source": "Sched", "score": 0.9, "text": filler}]
+        block, used, stats = context_budget.assemble("Who is the instructor?", ctxs, budget=120)
+        self.assertNotIn("[all rows]", block)
+        self.assertIn("Instructor: Priya Nair", block.splitlines()[0])
+        self.assertLessEqual(context_budget.count_tokens(block), 120)
+        self.assertEqual([c["row"] for c in used], [2])
+        self.assertEqual(stats["rows_over_budget"], 1)
+        self.assertGreater(stats["cells_trimmed"], 0)
+
+
+# -------------------------
+# Embedding disk cache
+# -------------------------
+class EmbeddingCacheTests(IndexTestCase):
+    def setUp(self):
+        super().setUp()
+        self.cache = EmbeddingCache(self.dir / "embeddings.sqlite3", max_rows=3)
+
+    def test_vectors_are_kept_per_model_and_dim(self):
+        h = [hashlib.sha1(t.encode()).hexdigest() for t in "abcd"]
+        vecs = np.arange(8, dtype="float32").reshape(4, 2)
+        with mock.patch("notes.embedding_cache.time.time", side_effect=[1, 2]):
+            self.cache.put_many("m", h[:2], vecs[:2])
+            self.cache.put_many("m", h[2:], vecs[2:])
+        found = self.cache.get_many("m", h, 2)
+        self.assertEqual(sorted(found), sorted(h[1:]))  # the oldest row was evicted
+        np.testing.assert_array_equal(found[h[3]], vecs[3])
+        self.assertEqual(self.cache.get_many("other", h, 2), {})
+        self.assertEqual(self.cache.get_many("m", h, 3), {})
+        self.assertEqual(self.cache.stats()["rows"], 3)
+
+    def test_full_rebuild_reuses_cached_vectors(self):
+        self.cache.max_rows = 1000
+        with mock.patch.object(sheets_rag, "embedding_cache", lambda: self.cache):
+            self.sync()
+            self.assertEqual(self.embedder.encoded, 30)
+            with mock.patch.dict(os.environ, {"RAG_SYNC_MODE": "full"}):
+                self.embedder.encoded = 0
+                sheets_rag.sync_sheet(force=True)
+            self.assertEqual(self.embedder.encoded, 0)
+            # another backend's vectors are never served from the cache
+            with mock.patch.object(sheets_rag, "EMBED_BACKEND", "onnx"), \
+                    mock.patch.object(sheets_rag.embedders, "EMBED_BACKEND", "onnx"):
+                self.embedder.encoded = 0
+                sheets_rag.sync_sheet(force=True)
+            self.assertEqual(self.embedder.encoded, 30)
+
+
+# -------------------------
+# Persisted snapshot at boot
+# -------------------------
+class SnapshotTests(IndexTestCase):
+    def test_corrupt_current_falls_back_to_the_previous_generation(self):
+        self.sync()
+        old = self.current().version
+        self.sheets.edit("Sched", 2, 0, "Glassblowing Taster")
+        self.sync()
+        gen = self.current()
+        with open(gen.path / "vectors.npy", "r+b") as f:
+            f.seek(-4, os.SEEK_END)
+            f.write(b"\xff\xff\xff\xff")
+        self.assertEqual(IndexGeneration.latest_valid(gen.shard).version, old)
+        self.assertEqual(IndexGeneration.latest_valid(gen.shard, verify=False).version, gen.version)
+        self.assertEqual(self.engine().shards()[gen.shard]["version"], old)
+        self.assertIsNone(IndexGeneration.latest_valid(gen.shard, model="another-model"))
+
+    def test_engine_boots_from_the_snapshot_without_syncing(self):
+        self.sync()
+        for patcher in (mock.patch.object(views, "_engine", None),
+                        mock.patch.object(views, "_engine_building", True),
+                        mock.patch.object(views, "_groq", fakes.FakeGroq()),
+                        mock.patch.object(views, "_submit_sync")):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        views._build_engine_async()
+        self.assertEqual(views._engine.shards()[self.current().shard]["version"], self.current().version)
+        self.assertFalse(views._engine_building)
+        views._submit_sync.assert_not_called()
+
+        # an old snapshot is served too, with a sync queued behind it
+        with mock.patch.object(views, "SNAPSHOT_MAX_AGE", -1):
+            views._build_engine_async()
+        views._submit_sync.assert_called_once_with()
+
+
+# -------------------------
+# Change detection
+# -------------------------
+class ChangeDetectionTests(IndexTestCase):
+    def test_fingerprint_is_the_default(self):
+        code = ("import os; os.environ.pop('RAG_CHANGE_DETECTION', None); "
+                "from notes import change_detector; print(change_detector.MODE)")
+        self.assertEqual(_run_python(code), "fingerprint")
+
+    def test_fingerprint_mode_reads_values_but_skips_the_rebuild(self):
+        with mock.patch.object(change_detector, "MODE", "fingerprint"), \
+                mock.patch.object(change_detector, "drive_versions") as drive:
+            self.sync()
+            version = self.current().version
+            calls = self.sheets.faults.calls
+            self.assertEqual(self.sync(), 0)
+            self.assertEqual(self.sheets.faults.calls, calls + 1)
+            self.assertEqual(self.embedder.encoded, 0)
+            self.assertEqual(self.current().version, version)
+        drive.assert_not_called()
+
+    def test_drive_mode_skips_the_read_while_the_version_holds(self):
+        self.sync()
+        with mock.patch.object(sheets_rag, "fetch_sources") as fetch:
+            self.assertEqual(self.sync(), 0)
+        fetch.assert_not_called()
+        with mock.patch.object(change_detector, "drive_versions", return_value={}):
+            self.assertEqual(self.sync(), 0)  # Drive unreachable: values compared instead
+        self.assertEqual(self.embedder.encoded, 0)
+
+
+# -------------------------
+# Background sync jobs
+# -------------------------
+class SyncJobTests(SimpleTestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        for patcher in (mock.patch.object(sync_jobs, "JOBS_DIR", Path(tmp.name) / "jobs"),
+                        mock.patch.object(sync_jobs, "LOCK_PATH", Path(tmp.name) / ".sync.lock")):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_requests_coalesce_behind_a_running_job(self):
+        started, release, runs = threading.Event(), threading.Event(), []
+
+        def run(progress):
+            runs.append(1)
+            started.set()
+            release.wait(5)
+            return {"rows": len(runs)}
+
+        first, coalesced = sync_jobs.submit("sync", run)
+        self.assertFalse(coalesced)
+        self.assertTrue(started.wait(5))
+        # the running job may have read the sheet already: the next request queues a follow-up
+        second, coalesced = sync_jobs.submit("sync", run)
+        self.assertFalse(coalesced)
+        self.assertIsNot(second, first)
+        third, coalesced = sync_jobs.submit("sync", run)
+        self.assertTrue(coalesced)
+        self.assertIs(third, second)
+        release.set()
+        second.wait(5)
+        self.assertEqual(len(runs), 2)
+        status = sync_jobs.get(second.id)
+        self.assertEqual(status["status"], "succeeded")
+        self.assertEqual(status["requests"], 2)
+        self.assertEqual(status["result"], {"rows": 2})
+
+    def test_failed_job_reports_its_error(self):
+        def run(progress):
+            raise RuntimeError("Sheet empty or inaccessible.")
+
+        job, _ = sync_jobs.submit("full", run)
+        job.wait(5)
+        self.assertEqual(sync_jobs.get(job.id)["error"], "Sheet empty or inaccessible.")
+        self.assertIsNone(sync_jobs.get("../etc/passwd"))
+        self.assertEqual(self.client.get(f"/api/sync/{job.id}").json()["status"], "failed")
+        self.assertEqual(self.client.get("/api/sync/nope").status_code, 404)
+
+
+# -------------------------
+# Offline benchmark
+# -------------------------
+class BenchmarkTests(IndexTestCase):
+    def test_small_run_measures_every_phase_and_compares(self):
+        from benchmarks import run as bench
+        self.assertEqual(bench.parse_rows("1k, 2.5k,1m,40"), [1_000, 2_500, 1_000_000, 40])
+        self.sheets.tabs.update({"Services": fakes.services_tab(), "Appointments": fakes.appointments_tab(5)})
+        args = SimpleNamespace(seed=0, requests=6, warmup=1, concurrency=2, intents="qa,services.list",
+                               batch_size=3, sheets_error_rate=0.0)
+        groq = fakes.FakeGroq()
+        with mock.patch.object(views, "_engine", None), mock.patch.object(views, "_groq", groq), \
+                mock.patch.object(sheets_booking, "_svc", lambda readonly: self.sheets), \
+                mock.patch.object(sheets_booking, "_catalog", None), \
+                contextlib.redirect_stderr(io.StringIO()):
+            size = bench.bench_size(40, args, self.sheets, groq)
+        self.assertEqual([size["sync"][p]["rows_rebuilt"] for p in ("cold", "unchanged", "edit_1pct")], [40, 0, 40])
+        self.assertEqual(size["index"]["rows"], 40)
+        self.assertEqual(size["retrieve"]["n"], 7)
+        for stats in (*size["ask"].values(), size["ask_batch"]):
+            self.assertEqual(stats["errors"], 0)
+        self.assertEqual(size["ask"]["qa"]["n"], 6)
+        self.assertNotIn("Schedule40", self.sheets.tabs)
+
+        result = {"sizes": [size]}
+        slower = json.loads(json.dumps(result))
+        slower["sizes"][0]["retrieve"]["p95_ms"] = size["retrieve"]["p95_ms"] * 3 + 5
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertEqual(bench.compare(result, result, 0.1), [])
+            self.assertEqual(bench.compare(result, slower, 0.1), ["40/retrieve/p95_ms"])
+
+    def test_fakes_fail_on_cue_and_answer_extraction_prompts_in_json(self):
+        groq = fakes.FakeGroq(error_rate=1.0)
+        with self.assertRaises(Exception):
+            groq.create(messages=[{"role": "user", "content": "hi"}])
+        self.assertEqual((groq.faults.calls, groq.faults.errors), (1, 1))
+        reply = fakes.FakeGroq().create(messages=[
+            {"role": "system", "content": "Return JSON only."},
+            {"role": "user", "content": "Change booking AB12CD34 phone to 5551234567"}])
+        self.assertEqual(json.loads(reply.choices[0].message.content),
+                         {"booking_id": "AB12CD34", "phone": "5551234567"})
+
+
+# -------------------------
+# Stage timings and /api/metrics
+# -------------------------
+class MetricsTests(EngineViewTestCase):
+    def test_spans_add_up_per_unit_and_in_the_histogram(self):
+        with metrics.collect() as unit:
+            with mock.patch("notes.metrics.time.perf_counter", side_effect=[0.0, 0.25, 1.0, 1.5]):
+                with metrics.span("test_stage"):
+                    pass
+                with metrics.span("test_stage"):
+                    pass
+        self.assertEqual(unit.timings, {"test_stage": 0.75})
+        self.assertIn('heysheet_stage_seconds_bucket{stage="test_stage",le="0.5"} 2', metrics.render())
+
+    def test_ask_reports_server_timing_and_prometheus_metrics(self):
+        resp = self.client.post("/api/ask", {"question": "Who teaches Intro Pottery 1?"},
+                                content_type="application/json")
+        self.assertEqual(resp.status_code, 200)
+        stages = {part.split(";")[0] for part in resp["Server-Timing"].split(", ")}
+        self.assertTrue({"intent", "embed", "retrieve", "llm", "total"} <= stages, stages)
+
+        resp = self.client.get("/api/metrics")
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp["Content-Type"].startswith("text/plain; version=0.0.4"))
+        body = resp.content.decode()
+        self.assertIn("# TYPE heysheet_http_requests_total counter", body)
+        self.assertRegex(body, r'heysheet_http_requests_total\{intent="qa",status="200",view="ask-question"\} \d+')
+        self.assertIn('heysheet_external_calls_total{method="%s",outcome="ok",system="groq"}' % sheets_rag.QA_MODEL, body)
+        self.assertIn("heysheet_engine_ready 1", body)
+
+    def test_token_is_required_when_set(self):
+        with mock.patch.dict(os.environ, {"METRICS_TOKEN": "s3cret"}):
+            self.assertEqual(self.client.get("/api/metrics").status_code, 401)
+            self.assertEqual(self.client.get("/api/metrics", HTTP_AUTHORIZATION="Bearer nope").status_code, 401)
+            self.assertEqual(self.client.get("/api/metrics", HTTP_AUTHORIZATION="Bearer s3cret").status_code, 200)
+
+
+# -------------------------
+# /api/ask_batch
+# -------------------------
+class AskBatchTests(EngineViewTestCase):
+    def post(self, body):
+        return self.client.post("/api/ask_batch", body, content_type="application/json")
+
+    def test_one_result_per_question_from_one_encode_call(self):
+        create = self.llm.chat.completions.create
+
+        def flaky(messages=(), **kw):
+            if "Raku" in messages[-1]["content"].split("Question:")[-1]:
+                raise RuntimeError("Groq unavailable")
+            return create(messages=messages, **kw)
+
+        questions = ["Who teaches Intro Pottery 1?", "", "When is Raku Firing?", "Who teaches Intro Pottery 2?"]
+        with mock.patch.object(self.embedder, "encode", wraps=self.embedder.encode) as encode, \
+                mock.patch.object(self.llm.chat.completions, "create", side_effect=flaky):
+            resp = self.post({"questions": questions})
+        self.assertEqual(resp.status_code, 200)
+        results = resp.json()["results"]
+        self.assertEqual([r["intent"] for r in results], ["qa", "unknown", "qa", "qa"])
+        self.assertTrue(results[0]["answer"].startswith("According to Sched row"))
+        self.assertEqual(results[2]["error"], "Groq unavailable")
+        self.assertEqual(encode.call_count, 1)
+        self.assertEqual(encode.call_args.args[0], [questions[0], questions[2], questions[3]])
+
+    def test_bad_input(self):
+        for body in ({}, {"questions": "Who teaches?"}, {"questions": ["ok", 3]},
+                     {"questions": ["Who teaches?"], "filters": "Day=Mon"}):
+            self.assertEqual(self.post(body).status_code, 400, body)
+        with mock.patch.object(views, "ASK_BATCH_MAX", 2):
+            self.assertEqual(self.post({"questions": ["a", "b", "c"]}).status_code, 400)
+
+    def test_engine_still_loading(self):
+        with mock.patch.object(views, "_engine", None), mock.patch.object(views, "_engine_building", True):
+            resp = self.post({"questions": ["Who teaches Intro Pottery 1?", ""]})
+        self.assertEqual(resp.status_code, 202)
+        self.assertEqual([r["intent"] for r in resp.json()["results"]], ["qa_initializing", "unknown"])
+
+
+# -------------------------
+# Embedding backends
+# -------------------------
+class EmbedderBackendTests(IndexTestCase):
+    def test_encoder_id_and_unknown_backend(self):
+        self.assertEqual(embedders.encoder_id("torch"), embedders.EMBED_MODEL)
+        self.assertEqual(embedders.encoder_id("onnx-int8"), f"{embedders.EMBED_MODEL}@onnx-int8")
+        with self.assertRaisesMessage(ValueError, "Unknown EMBED_BACKEND 'bogus'"):
+            embedders.load("bogus")
+
+    def test_switching_backend_rebuilds(self):
+        self.sync()
+        with mock.patch.object(change_detector, "EMBED_BACKEND", "onnx"), \
+                mock.patch.object(sheets_rag, "EMBED_BACKEND", "onnx"):
+            self.assertFalse(change_detector.indexed(sheets_rag.rag_sources()[0].shard))
+            self.assertEqual(self.sync(), 30)
+            self.assertEqual(self.embedder.encoded, 30)
+            self.assertEqual(self.current().backend, "onnx")
+            self.assertEqual(self.sync(), 0)
+
+    def test_onnx_encoder_mean_pools_unpadded_tokens(self):
+        def tokenizer(texts, **kw):
+            n = max(len(t.split()) for t in texts)
+            mask = np.array([[1] * len(t.split()) + [0] * (n - len(t.split())) for t in texts])
+            return {"input_ids": mask * 7, "attention_mask": mask}
+
+        def run(_, feed):  # token j of every sentence -> [j + 1, 1]; padding must not count
+            ids = feed["input_ids"]
+            pos = np.broadcast_to(np.arange(1, ids.shape[1] + 1, dtype="float32"), ids.shape)
+            return [np.stack([pos, np.ones_like(pos)], axis=-1)]
+
+        enc = embedders.OnnxEncoder.__new__(embedders.OnnxEncoder)
+        enc.session, enc.inputs = SimpleNamespace(run=run), {"input_ids", "attention_mask"}
+        enc.tokenizer, enc.dim, enc.max_seq_length = tokenizer, 2, 16
+        out = enc.encode(["a", "a b c", "a b"], batch_size=2)
+        np.testing.assert_allclose(out, [[1, 1], [2, 1], [1.5, 1]])
+        np.testing.assert_allclose(enc.encode("a b c", normalize_embeddings=True), np.array([2, 1]) / np.sqrt(5))
+
+
+# -------------------------
+# Worker roles
+# -------------------------
+class WorkerRoleTests(SimpleTestCase):
+    _BOOT = ("import sys, json, django, importlib; django.setup(); from django.conf import settings; "
+             "importlib.import_module(settings.ROOT_URLCONF); from notes import views; "
+             "print(json.dumps([views.QA_ENABLED, [m for m in ('notes.sheets_rag', 'pandas', 'torch', "
+             "'sentence_transformers', 'faiss') if m in sys.modules]]))")
+
+    def boot(self, role):
+        return json.loads(_run_python(self._BOOT, HEYSHEET_WORKER_ROLE=role, DJANGO_SETTINGS_MODULE="core.settings"))
+
+    def test_web_role_boots_without_the_qa_stack(self):
+        self.assertEqual(self.boot("web"), [False, []])
+        self.assertEqual(self.boot("QA"), [True, []])  # still lazy until the first question
+        with self.assertRaisesMessage(AssertionError, "HEYSHEET_WORKER_ROLE must be all, web or qa, not 'worker'"):
+            self.boot("worker")
+
+    def test_web_role_answers_qa_with_503(self):
+        with mock.patch.object(views, "QA_ENABLED", False), mock.patch.object(views, "_submit_sync") as submit:
+            resp = self.client.post("/api/ask", {"question": "Who teaches pottery?"}, content_type="application/json")
+            self.assertEqual((resp.status_code, resp.json()["intent"]), (503, "qa_unavailable"))
+            resp = self.client.post("/api/ask_batch", {"questions": ["Who teaches pottery?", ""]},
+                                    content_type="application/json")
+            self.assertEqual(resp.status_code, 503)
+            self.assertEqual([r["intent"] for r in resp.json()["results"]], ["qa_unavailable", "unknown"])
+            self.assertEqual(self.client.post("/api/sync").status_code, 503)
+        submit.assert_not_called()
+
+    def test_gunicorn_preloads_only_for_qa_workers(self):
+        def preload(role, **env):
+            with mock.patch.dict(os.environ):
+                os.environ.pop("EMBEDDER_PRELOAD", None)
+                os.environ.update(env, HEYSHEET_WORKER_ROLE=role)
+                conf = runpy.run_path(str(settings.BASE_DIR / "gunicorn.conf.py"))
+                return conf["_preload"]("EMBEDDER_PRELOAD")
+
+        self.assertEqual([preload(r) for r in ("web", "all", "qa")], [False, False, True])
+        self.assertFalse(preload("qa", EMBEDDER_PRELOAD="false"))
+        self.assertFalse(preload("web", EMBEDDER_PRELOAD="true"))
+
+
+# -------------------------
+# Shared embedder
+# -------------------------
+class SharedEmbedderTests(SimpleTestCase):
+    def test_embedder_loads_once_per_process(self):
+        embedder = HashEmbedder()
+
+        def load():
+            time.sleep(0.05)
+            return embedder
+
+        with mock.patch.object(sheets_rag, "_embedder", None), \
+                mock.patch.dict(sheets_rag._embedder_stats, loaded=False, load_seconds=None), \
+                mock.patch.object(sheets_rag.embedders, "load", side_effect=load) as loader:
+            threads = [threading.Thread(target=sheets_rag.get_embedder) for _ in range(4)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            self.assertEqual(loader.call_count, 1)
+            stats = sheets_rag.warm_embedder()
+            self.assertIs(sheets_rag.get_embedder(), embedder)
+        self.assertEqual(loader.call_count, 1)
+        self.assertEqual(embedder.encoded, 1)
+        self.assertTrue(stats["loaded"])
+        self.assertGreaterEqual(stats["load_seconds"], 0.05)
+        self.assertEqual(stats["pid"], os.getpid())
+
+
+
+# -------------------------
+# mmap'd index generations
+# -------------------------
+class IndexGenerationTests(SimpleTestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        patcher = mock.patch.object(index_store, "INDEX_DIR", Path(tmp.name))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def publish(self, texts):
+        vecs = np.eye(len(texts), 4, dtype="float32")
+        hashes = [hashlib.sha1(t.encode()).hexdigest() for t in texts]
+        return index_store.publish_generation("s", vecs, range(2, len(texts) + 2), hashes, texts, model="m")
+
+    def test_generation_round_trips_through_mmap(self):
+        texts = ["Pottery | Mon", "", "Café crème | Tue"]
+        gen = IndexGeneration("s", self.publish(texts))
+        self.assertIsInstance(gen.vectors, np.memmap)
+        self.assertFalse(gen.vectors.flags.writeable)
+        self.assertEqual([gen.text(i) for i in range(len(gen))], texts)
+        self.assertEqual(gen.row_ids.tolist(), [2, 3, 4])
+        self.assertEqual(gen.hashes[2].decode(), hashlib.sha1(texts[2].encode()).hexdigest())
+        self.assertTrue(gen.verify())
+        self.assertEqual(gen.manifest["text_sha1"], index_store.text_digest(texts))
+
+        D, I = gen.exact_search(np.array([0, 0, 1, 0]), k=5)
+        self.assertEqual(I[0].tolist(), [2, 0, 1, -1, -1])
+        D, I = gen.exact_search(np.array([0, 0, 1, 0]), k=2, allowed=np.array([True, True, False]))
+        self.assertNotIn(2, I[0].tolist())
+        self.assertEqual(len(IndexGeneration("s", self.publish([]))), 0)
+
+    def test_only_the_newest_generations_are_kept(self):
+        versions = [self.publish(["a", "b"]) for _ in range(index_store.KEEP_GENERATIONS + 2)]
+        self.assertEqual(index_store.current_version("s"), versions[-1])
+        kept = sorted(p.name for p in index_store.shard_dir("s").iterdir() if p.is_dir())
+        self.assertEqual(kept, versions[-index_store.KEEP_GENERATIONS:])
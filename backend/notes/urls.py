@@ -1,5 +1,6 @@
 from rest_framework.routers import DefaultRouter
-from .views import NoteViewSet, sync, ask, ping_plain, sync_plain
+from .views import NoteViewSet, sync, sync_status, ask, ask_batch, ask_stream, ping_plain, sync_plain, engine_stats, booking_detail, metrics_view
+from .async_views import ask_async
 from django.urls import path, include
 
 router = DefaultRouter()
@@ -8,7 +9,14 @@ router.register(r'notes', NoteViewSet)
 urlpatterns = [
     path('', include(router.urls)),
     path('sync', sync, name='sync-sheet'),  # POST /api/notes/sync
+    path('sync/<str:job_id>', sync_status, name='sync-status'),  # GET /api/notes/sync/<id>
     path('ask', ask, name='ask-question'),  # POST /api/notes/ask
+    path('ask_batch', ask_batch, name='ask-batch'),  # POST /api/notes/ask_batch
+    path('ask/async', ask_async, name='ask-async'),  # POST /api/notes/ask/async (ASGI)
+    path('ask/stream', ask_stream, name='ask-stream'),  # POST /api/notes/ask/stream (SSE)
+    path('bookings/<str:booking_id>', booking_detail, name='booking-detail'),  # GET /api/notes/bookings/<id>
+    path('engine', engine_stats, name='engine-stats'),  # GET /api/notes/engine
+    path('metrics', metrics_view, name='metrics'),  # GET /api/notes/metrics (Prometheus)
     path('ping_plain', ping_plain),     
     path('sync_plain', sync_plain), 
 ]
@@ -3,17 +3,50 @@ from rest_framework.decorators import api_view
 from rest_framework.response import Response
 
 from django.views.decorators.csrf import csrf_exempt
-from threading import Thread
+from threading import Thread, Lock
 import logging
 
 from .models import Note
 from .serializers import NoteSerializer
-from .sheets_rag import sync_sheet, QAEngine
-from .sheets_booking import list_services, create_appointment, update_appointment
+from .embedding_cache import get_cache as embedding_cache
+from . import metrics, sync_jobs
+from .sheets_booking import (
+    list_services, services_catalog, invalidate_services, name_tokens,
+    create_appointment, update_appointment, booking_status,
+)
 
 from groq import Groq
-import os, json, re
-from django.http import JsonResponse
+import os, sys, json, re
+from django.core.exceptions import ImproperlyConfigured
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.core.handlers.asgi import ASGIRequest
+from asgiref.sync import sync_to_async
+
+
+# -------------------------
+# Worker role + lazily imported QA stack
+# -------------------------
+# "web" workers serve notes, bookings, services, health and sync status and
+# never import the QA stack; "qa" workers also load it at boot (see
+# gunicorn.conf.py); "all" (default) imports it on the first QA question.
+WORKER_ROLE = os.getenv("HEYSHEET_WORKER_ROLE", "all").lower()
+if WORKER_ROLE not in ("all", "web", "qa"):
+    raise ImproperlyConfigured(f"HEYSHEET_WORKER_ROLE must be all, web or qa, not {WORKER_ROLE!r}")
+QA_ENABLED = WORKER_ROLE != "web"
+
+
+def _rag():
+    """sheets_rag, imported on first use: it pulls in pandas, sentence-transformers/torch and faiss."""
+    from . import sheets_rag
+    return sheets_rag
+
+
+def _embedder_stats() -> dict:
+    """sheets_rag.embedder_stats(), without importing the QA stack just to say it isn't loaded."""
+    rag = sys.modules.get(f"{__package__}.sheets_rag")
+    if rag is not None:
+        return rag.embedder_stats()
+    return {"loaded": False, "load_seconds": None, "rss_mb": metrics.rss_mb(), "pid": os.getpid()}
 
 
 @csrf_exempt
@@ -43,25 +76,105 @@ def ping(request):
     return Response({"ok": True})
 
 
+@api_view(["GET"])
+def engine_stats(request):
+    """Embedder load time and worker memory (does not trigger a model load)."""
+    engine = _engine
+    return Response({
+        "worker_role": WORKER_ROLE,
+        "embedder": _embedder_stats(),
+        "engine_ready": engine is not None,
+        "index_version": engine.version if engine else None,
+        "shards": engine.shards() if engine else None,
+        "answer_cache": engine.cache.stats() if engine and engine.cache else None,
+        "embedding_cache": embedding_cache().stats() if embedding_cache() else None,
+    })
+
+
+@csrf_exempt
+def metrics_view(request):
+    """Prometheus text format for this worker; METRICS_TOKEN, when set, is required as a Bearer token."""
+    token = os.getenv("METRICS_TOKEN")
+    if token and request.headers.get("Authorization") != f"Bearer {token}":
+        return HttpResponse(status=401)
+    return HttpResponse(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@metrics.register_collector
+def _engine_metrics():
+    engine = _engine
+    emb = _embedder_stats()
+    out = [
+        ("heysheet_process_resident_bytes", "gauge", "Resident memory of this worker.", {}, emb["rss_mb"] * 1e6),
+        ("heysheet_embedder_load_seconds", "gauge", "Time the embedding model took to load.", {}, emb["load_seconds"]),
+        ("heysheet_engine_ready", "gauge", "1 once this worker's QA engine is serving.", {}, int(engine is not None)),
+    ]
+    if engine is None:
+        return out
+    for shard, info in engine.shards().items():
+        out.append(("heysheet_index_rows", "gauge", "Rows in the served index generation.",
+                    {"shard": shard, "ann": info["ann"]}, info["rows"]))
+    if engine.cache is not None:
+        for kind in ("hits", "misses"):
+            out.append((f"heysheet_answer_cache_{kind}_total", "counter", f"QA answer cache {kind}.",
+                        {}, getattr(engine.cache, kind)))
+    return out
+
+
+@api_view(["GET"])
+def booking_detail(request, booking_id):
+    """Write status of a booking (pending/flushing/written) and its sheet row."""
+    status = booking_status(booking_id.strip().upper())
+    if status is None:
+        return Response({"error": "Booking not found", "booking_id": booking_id}, status=404)
+    return Response(status)
+
+
 # ---------------------------------------------------
 # /api/sync: REAL SYNC without 504s (return fast)
 # ---------------------------------------------------
-def _run_sync_job():
-    """Background job that performs the actual Google Sheets sync."""
-    try:
-        n = sync_sheet()
+def _sync_run(incremental=None, force=False):
+    """Body of a sync job: rebuild what changed, then move the engine and services onto it."""
+    def run(progress):
+        n = _rag().sync_sheet(incremental=incremental, force=force, progress=progress)
         logging.info("Sheets sync finished. synced_rows=%s", n)
-    except Exception as e:
-        logging.exception("Sheets sync failed: %s", e)
+        if n:
+            _refresh_engine()
+        # the Services tab may have changed too
+        if n or force:
+            try:
+                invalidate_services(refresh=True)
+            except Exception as e:
+                logging.exception("Services refresh after sync failed: %s", e)
+        return {"synced_rows": n}
+    return run
+
+
+def _submit_sync(full: bool = False):
+    """Queue (or join) a sync job; {"full": true} rebuilds everything."""
+    if full:
+        return sync_jobs.submit("full", _sync_run(incremental=False, force=True))
+    return sync_jobs.submit("sync", _sync_run())
+
+
+def _poll_sync():
+    """SYNC_POLL_INTERVAL job: cheap no-op unless a sheet changed."""
+    _submit_sync()
 
 
 @csrf_exempt
 @api_view(["POST"])
 def sync(request):
     """
-    Start the Google Sheets sync in a background thread and return 202 immediately.
-    This prevents timeouts (504) and the misleading CORS message.
+    Start the Google Sheets sync as a background job and return 202 immediately
+    with its job_id (poll GET /api/sync/<job_id>). Requests made while a sync is
+    queued join it instead of starting another. This prevents timeouts (504)
+    and the misleading CORS message.
+    Sheets that haven't changed since the last sync are skipped and only changed
+    rows are re-embedded; send {"full": true} to rebuild from scratch.
     """
+    if not QA_ENABLED:
+        return Response({"error": "Syncs run on QA workers (HEYSHEET_WORKER_ROLE=web here)"}, status=503)
     try:
         # Quick env checks so we fail fast with JSON (not a 504)
         google_creds = os.getenv("GOOGLE_SHEETS_CREDENTIALS")
@@ -82,8 +195,11 @@ def sync(request):
             )
 
         # Fire-and-forget so HTTP response returns immediately (no 504)
-        Thread(target=_run_sync_job, daemon=True).start()
-        return Response({"started": True}, status=202)
+        full = str(request.data.get("full", "")).lower() in ("1", "true", "yes")
+        job, coalesced = _submit_sync(full)
+        invalidate_services()  # reload lazily even if no RAG tab changed
+        return Response({"started": True, "full": full, "job_id": job.id, "coalesced": coalesced,
+                         "status_url": f"/api/sync/{job.id}"}, status=202)
 
     except Exception as e:
         import traceback
@@ -92,35 +208,86 @@ def sync(request):
         return Response({"error": str(e)}, status=500)
 
 
+@api_view(["GET"])
+def sync_status(request, job_id):
+    """Status, progress counters and timing of a sync job."""
+    job = sync_jobs.get(job_id)
+    if job is None:
+        return Response({"error": "Sync job not found", "job_id": job_id}, status=404)
+    return Response(job)
+
+
 # ---------------------------------------------------
 # QA engine: build lazily but NEVER block a request
 # ---------------------------------------------------
 _engine = None
 _engine_building = False  # avoids spawning multiple builders
+_engine_refreshing = False
+_engine_lock = Lock()
+
+
+# a snapshot younger than this is served without re-checking the sheet at startup
+SNAPSHOT_MAX_AGE = int(os.getenv("RAG_SNAPSHOT_MAX_AGE", "300"))
 
 
 def _build_engine_async():
-    """Build the index then instantiate QAEngine without blocking requests."""
+    """
+    Serve the persisted index snapshot as soon as it loads, then check the
+    sheet for changes in the background. Only without a usable snapshot does
+    the first answer wait for a full fetch + embed.
+    """
     global _engine, _engine_building
     try:
-        # build/update the index (heavy)
-        sync_sheet()
-        _engine = QAEngine()
-        logging.info("QAEngine built and ready.")
+        try:
+            engine = _rag().QAEngine(llm=_groq)
+            synced = False
+        except RuntimeError:
+            # no valid snapshot on disk: build the index (heavy)
+            job = _submit_sync()[0].wait()
+            if job.error:
+                raise RuntimeError(f"Initial sync failed: {job.error}")
+            engine = _rag().QAEngine(llm=_groq)
+            synced = True
+        with _engine_lock:
+            _engine = engine
+        logging.info("QAEngine ready: index %s, snapshot age %.0fs", engine.version, engine.snapshot_age())
+        if not synced and engine.snapshot_age() > SNAPSHOT_MAX_AGE:
+            _submit_sync()
     except Exception as e:
         logging.exception("QAEngine build failed: %s", e)
     finally:
         _engine_building = False
 
 
+def _refresh_engine():
+    """Swap the live engine onto the newest published index generation."""
+    global _engine_refreshing
+    try:
+        with _engine_lock:
+            engine = _engine
+        if engine is not None:
+            engine.refresh()
+    except Exception as e:
+        logging.exception("QAEngine refresh failed: %s", e)
+    finally:
+        _engine_refreshing = False
+
+
 def _get_engine_nonblocking():
     """
     Return QAEngine if ready. If not, start a background build (once) and signal
-    the caller to retry soon.
+    the caller to retry soon. Raises RuntimeError("qa_disabled") on web-role workers.
     """
-    global _engine, _engine_building
-    if _engine is not None:
-        return _engine
+    global _engine, _engine_building, _engine_refreshing
+    if not QA_ENABLED:
+        raise RuntimeError("qa_disabled")
+    engine = _engine
+    if engine is not None:
+        # another worker (or a sync) published a newer index: swap it in off-request
+        if not _engine_refreshing and engine.is_stale():
+            _engine_refreshing = True
+            Thread(target=_refresh_engine, daemon=True).start()
+        return engine
     if not _engine_building:
         _engine_building = True
         Thread(target=_build_engine_async, daemon=True).start()
@@ -128,6 +295,7 @@ def _get_engine_nonblocking():
 
 
 _groq = Groq(api_key=os.getenv("GROQ_API_KEY"))
+EXTRACT_MODEL = "llama3-8b-8192"
 
 # STRONG rules (no LLM fallback) to avoid misclassifying simple Q&A
 def _intent(text: str) -> str:
@@ -154,15 +322,18 @@ def _intent(text: str) -> str:
 
 
 # ---------- helpers for field extraction ----------
-def _best_service_match(text: str, services):
+def _llm_json(messages) -> dict:
+    """One extraction call on the small model, parsed as JSON."""
+    with metrics.external_call("groq", EXTRACT_MODEL, stage="llm_extract"):
+        resp = _groq.chat.completions.create(model=EXTRACT_MODEL, temperature=0, messages=messages)
+    metrics.groq_usage(resp, EXTRACT_MODEL)
+    return json.loads(resp.choices[0].message.content)
+
+
+def _best_service_match(text: str, catalog):
     """Pick a service by token overlap with the catalog (simple & fast)."""
     text_l = text.lower()
-    names = []
-    for s in services:
-        n = s.get("Class Name") or s.get("Service") or s.get("Name")
-        if n:
-            names.append(n)
-
+    names = catalog.names
     if not names:
         return None
 
@@ -171,12 +342,10 @@ def _best_service_match(text: str, services):
         if n.lower() in text_l:
             return n
 
-    # token overlap score
-    def toks(s): return {w for w in re.findall(r"[a-z0-9]+", s.lower()) if len(w) >= 3}
-    tset = toks(text)
+    # token overlap score (catalog names are tokenized once, when it is loaded)
+    tset = name_tokens(text)
     best, best_score = None, 0.0
-    for n in names:
-        nset = toks(n)
+    for n, nset in zip(names, catalog.name_tokens):
         if not nset:
             continue
         score = len(tset & nset) / len(nset)
@@ -186,7 +355,7 @@ def _best_service_match(text: str, services):
     return best if best_score >= 0.3 else None
 
 
-def _extract_create(text: str, services_data):
+def _extract_create(text: str, catalog):
     """
     Parse name/email/phone/service/total_sessions/sessions_text.
     Rule-based first; if some are missing, ask LLM to fill ONLY gaps.
@@ -232,7 +401,7 @@ def _extract_create(text: str, services_data):
             out["sessions_text"] = " | ".join(p.strip() for p in sess_parts)
 
     # service from catalog
-    svc = _best_service_match(text, services_data)
+    svc = _best_service_match(text, catalog)
     if svc:
         out["service"] = svc
 
@@ -240,20 +409,15 @@ def _extract_create(text: str, services_data):
     missing = [k for k in ["name","email","phone","service","total_sessions","sessions_text"] if not out.get(k)]
     if missing:
         try:
-            raw = _groq.chat.completions.create(
-                model="llama3-8b-8192",
-                temperature=0,
-                messages=[
-                    {"role": "system", "content": "Extract fields from text. Return strict JSON only."},
-                    {"role": "user", "content":
-                        f"Catalog (truncated): {json.dumps(services_data[:8])}\n"
-                        f"User: {text}\n"
-                        f"Fill ONLY these missing fields {missing}. "
-                        'Return JSON with keys: name,email,phone,service,total_sessions,sessions_text; '
-                        'do not invent values — leave empty string or 0 if unknown.'}
-                ],
-            ).choices[0].message.content
-            d = json.loads(raw)
+            d = _llm_json([
+                {"role": "system", "content": "Extract fields from text. Return strict JSON only."},
+                {"role": "user", "content":
+                    f"Catalog (truncated): {json.dumps(catalog.services[:8])}\n"
+                    f"User: {text}\n"
+                    f"Fill ONLY these missing fields {missing}. "
+                    'Return JSON with keys: name,email,phone,service,total_sessions,sessions_text; '
+                    'do not invent values — leave empty string or 0 if unknown.'}
+            ])
             for k in missing:
                 if k == "total_sessions":
                     try:
@@ -272,17 +436,12 @@ def _extract_create(text: str, services_data):
 def _extract_update(text: str):
     """extract booking_id and patch fields from free text."""
     try:
-        raw = _groq.chat.completions.create(
-            model="llama3-8b-8192",
-            temperature=0,
-            messages=[
-                {"role": "system", "content": "Extract update for an appointment. Return STRICT JSON only."},
-                {"role": "user", "content":
-                    f"User: {text}\n"
-                    'Return: {"booking_id":"","name":null,"email":null,"phone":null,"service":null,"total_sessions":null,"sessions_text":null}'}
-            ],
-        ).choices[0].message.content
-        d = json.loads(raw)
+        d = _llm_json([
+            {"role": "system", "content": "Extract update for an appointment. Return STRICT JSON only."},
+            {"role": "user", "content":
+                f"User: {text}\n"
+                'Return: {"booking_id":"","name":null,"email":null,"phone":null,"service":null,"total_sessions":null,"sessions_text":null}'}
+        ])
         bid = (d.get("booking_id") or "").strip()
         patch = {
             k: d.get(k)
@@ -295,24 +454,26 @@ def _extract_update(text: str):
         return (m.group(1) if m else None), {}
 
 
-@csrf_exempt
-@api_view(["POST"])
-def ask(request):
-    """
-    Handle Q&A and booking intents.
-    IMPORTANT: Never build heavy indexes inside this request; if the QAEngine
-    is not ready, return 202 and build in the background.
-    """
-    q = (request.data.get("question") or "").strip()
-    if not q:
-        return Response({
-            "answer": "Tell me what you’d like to do: “show services”, “book the 5 sessions class…”, “update booking ABCD1234…”, or ask business hours.",
-            "intent": "unknown"
-        })
+_HELP_ANSWER = {
+    "answer": "Tell me what you’d like to do: “show services”, “book the 5 sessions class…”, “update booking ABCD1234…”, or ask business hours.",
+    "intent": "unknown"
+}
+_INITIALIZING_ANSWER = {"answer": "Initializing knowledge index… try again in a moment.", "intent": "qa_initializing"}
+_QA_DISABLED_ANSWER = {"answer": "Questions about the knowledge base aren't answered by this server.",
+                       "intent": "qa_unavailable"}
 
-    intent = _intent(q)
-    logging.info("=== /api/ask === %s", {"q": q, "intent": intent})
 
+def _engine_unavailable(e: RuntimeError):
+    """(payload, status) for the errors _get_engine_nonblocking raises, or None for anything else."""
+    if "engine_initializing" in str(e):
+        return _INITIALIZING_ANSWER, 202
+    if "qa_disabled" in str(e):
+        return _QA_DISABLED_ANSWER, 503
+    return None
+
+
+def _handle_action(q: str, intent: str) -> dict:
+    """Answer the non-QA intents (services list, create/update booking)."""
     # 1) services list
     if intent == "services.list":
         svcs = list_services()
@@ -328,20 +489,19 @@ def ask(request):
             if loc:   bits.append(f"@ {loc}")
             lines.append("• " + " — ".join(bits))
         summary = "Available services:\n" + ("\n".join(lines) if lines else "(none found)")
-        return Response({
+        return {
             "answer": summary,
             "intent": "services.list",
             "services": svcs
-        })
+        }
 
     # 2) create appointment
     if intent == "appointments.create":
-        svcs = list_services()
-        d = _extract_create(q, svcs)
+        d = _extract_create(q, services_catalog())
 
         missing = [k for k in ["name", "email", "phone", "service", "total_sessions"] if not d.get(k)]
         if missing:
-            return Response({
+            return {
                 "answer": (
                     "I can book that, but I still need: "
                     + ", ".join(missing)
@@ -352,59 +512,246 @@ def ask(request):
                 "intent": "appointments.create",
                 "missing": missing,
                 "parsed": d
-            })
+            }
 
         bid = create_appointment(
             d["name"], d["email"], str(d["phone"]),
             d["service"], int(d["total_sessions"]),
             d.get("sessions_text", "")
         )
-        return Response({
+        return {
             "answer": f"Booking created. Your Booking ID is {bid}.",
             "intent": "appointments.create",
             "booking_id": bid,
             "parsed": d
-        })
+        }
 
     # 3) update appointment
     if intent == "appointments.update":
         bid, patch = _extract_update(q)
         if not bid:
-            return Response({
+            return {
                 "answer": "Please include your Booking ID (e.g., ABCD1234).",
                 "intent": "appointments.update",
                 "missing": ["booking_id"]
-            })
+            }
 
-        ok = update_appointment(bid, **patch)
+        try:
+            ok = update_appointment(bid, **patch)
+        except RuntimeError as e:
+            if "booking_flushing" not in str(e):
+                raise
+            return {
+                "answer": f"Booking {bid} is being saved to the sheet right now. Try the change again in a few seconds.",
+                "intent": "appointments.update",
+                "booking_id": bid,
+                "retry": True
+            }
         if not ok:
-            return Response({
+            return {
                 "answer": "I couldn't find that Booking ID. Double-check and try again.",
                 "intent": "appointments.update",
                 "not_found": True
-            })
+            }
 
-        return Response({
+        return {
             "answer": f"Updated booking {bid}.",
             "intent": "appointments.update",
             "booking_id": bid,
             "patched": patch
-        })
+        }
+
+
+def _parse_filters(raw):
+    """Optional {"column": "value"} row filter for QA retrieval; ValueError if malformed."""
+    if not raw:
+        return None
+    if not isinstance(raw, dict) or not all(isinstance(v, (str, int, float)) for v in raw.values()):
+        raise ValueError('"filters" must be an object of column: value')
+    return {str(k): str(v) for k, v in raw.items()}
+
+
+@csrf_exempt
+@api_view(["POST"])
+def ask(request):
+    """
+    Handle Q&A and booking intents.
+    IMPORTANT: Never build heavy indexes inside this request; if the QAEngine
+    is not ready, return 202 and build in the background.
+    """
+    q = (request.data.get("question") or "").strip()
+    if not q:
+        return Response(_HELP_ANSWER)
+    try:
+        filters = _parse_filters(request.data.get("filters"))
+    except ValueError as e:
+        return Response({"error": str(e)}, status=400)
+
+    with metrics.span("intent"):
+        intent = _intent(q)
+    metrics.annotate(intent=intent)
+    logging.info("=== /api/ask === %s", {"q": q, "intent": intent})
+
+    # 1-3) services list / create / update
+    if intent != "qa":
+        return Response(_handle_action(q, intent))
 
     # 4) fallback — business-hours RAG (non-blocking build)
     try:
         engine = _get_engine_nonblocking()
     except RuntimeError as e:
-        if "engine_initializing" in str(e):
-            return Response(
-                {"answer": "Initializing knowledge index… try again in a moment.", "intent": "qa_initializing"},
-                status=202
-            )
-        raise
+        unavailable = _engine_unavailable(e)
+        if unavailable is None:
+            raise
+        payload, status = unavailable
+        return Response(payload, status=status)
 
-    answer, matches = engine.ask(q)
+    answer, matches, prompt = engine.ask(q, filters=filters)
     return Response({
         "answer": answer,
         "intent": "qa",
-        "matches": matches
+        "matches": matches,
+        "prompt": prompt
     })
+
+
+ASK_BATCH_MAX = int(os.getenv("ASK_BATCH_MAX", "100"))
+
+
+@csrf_exempt
+@api_view(["POST"])
+def ask_batch(request):
+    """
+    POST {"questions": [...], "filters": {...}?} -> {"results": [...]}, one
+    /api/ask-shaped result per question, in order ({"error": ...} in place of a
+    failed one). QA questions are embedded, searched and sent to Groq together
+    (see QAEngine.ask_batch); the other intents go through the same handlers
+    as /api/ask, one by one. 202 while the QA engine is still loading, 503 on
+    web-role workers.
+    """
+    questions = request.data.get("questions")
+    if not isinstance(questions, list) or not all(isinstance(q, str) for q in questions):
+        return Response({"error": '"questions" must be a list of strings'}, status=400)
+    if len(questions) > ASK_BATCH_MAX:
+        return Response({"error": f"At most {ASK_BATCH_MAX} questions per batch"}, status=400)
+    try:
+        filters = _parse_filters(request.data.get("filters"))
+    except ValueError as e:
+        return Response({"error": str(e)}, status=400)
+
+    questions = [q.strip() for q in questions]
+    with metrics.span("intent"):
+        intents = [_intent(q) if q else None for q in questions]
+    metrics.annotate(intent="batch", questions=len(questions))
+    logging.info("=== /api/ask_batch === %s questions", len(questions))
+
+    results = [None] * len(questions)
+    for j, (q, intent) in enumerate(zip(questions, intents)):
+        if intent is None:
+            results[j] = _HELP_ANSWER
+        elif intent != "qa":
+            try:
+                results[j] = _handle_action(q, intent)
+            except Exception as e:
+                logging.exception("ask_batch action failed: %s", e)
+                results[j] = {"error": str(e), "intent": intent}
+
+    qa = [j for j, intent in enumerate(intents) if intent == "qa"]
+    if qa:
+        try:
+            engine = _get_engine_nonblocking()
+        except RuntimeError as e:
+            unavailable = _engine_unavailable(e)
+            if unavailable is None:
+                raise
+            payload, status = unavailable
+            for j in qa:
+                results[j] = payload
+            return Response({"results": results}, status=status)
+        answers = engine.ask_batch([questions[j] for j in qa], filters=filters)
+        for j, out in zip(qa, answers):
+            if isinstance(out, Exception):
+                results[j] = {"error": str(out), "intent": "qa"}
+            else:
+                answer, matches, prompt = out
+                results[j] = {"answer": answer, "intent": "qa", "matches": matches, "prompt": prompt}
+    return Response({"results": results})
+
+
+# ---------------------------------------------------
+# /api/ask/stream: same as /api/ask, as Server-Sent Events
+# ---------------------------------------------------
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def _ask_events(q: str, filters: dict = None):
+    if not q:
+        yield _sse("answer", _HELP_ANSWER)
+        return
+    with metrics.span("intent"):
+        intent = _intent(q)
+    metrics.annotate(intent=intent)
+    logging.info("=== /api/ask/stream === %s", {"q": q, "intent": intent})
+    if intent != "qa":
+        yield _sse("answer", _handle_action(q, intent))
+        return
+    try:
+        engine = _get_engine_nonblocking()
+    except RuntimeError as e:
+        unavailable = _engine_unavailable(e)
+        if unavailable is None:
+            raise
+        yield _sse("answer", unavailable[0])
+        return
+    for kind, payload in engine.ask_stream(q, filters=filters):
+        if kind == "matches":
+            yield _sse("matches", {"intent": "qa", "matches": payload})
+        elif kind == "prompt":
+            yield _sse("prompt", payload)
+        else:
+            yield _sse("token", {"text": payload})
+
+
+async def _aiter_in_thread(it):
+    # Django buffers sync iterators under ASGI; pull events one at a time off the loop
+    done = object()
+    step = sync_to_async(lambda: next(it, done), thread_sensitive=False)
+    while (item := await step()) is not done:
+        yield item
+
+
+@csrf_exempt
+def ask_stream(request):
+    """
+    POST {"question": ..., "filters": {...}?} -> text/event-stream.
+    QA answers send `matches` and `prompt` (context size) first, then one
+    `token` event per generated piece, then `done`. Other intents (and errors) send a single `answer` event with
+    the same JSON /api/ask would return, then `done`.
+    """
+    if request.method != "POST":
+        return JsonResponse({"error": "POST required"}, status=405)
+    try:
+        data = json.loads(request.body or b"{}")
+        q = (data.get("question") or "").strip()
+        filters = _parse_filters(data.get("filters"))
+    except (json.JSONDecodeError, AttributeError):
+        return JsonResponse({"error": "Invalid JSON body"}, status=400)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+    def events():
+        try:
+            yield from _ask_events(q, filters)
+        except Exception as e:
+            logging.exception("ask_stream failed: %s", e)
+            yield _sse("error", {"error": str(e)})
+        yield _sse("done", {})
+
+    body = events()
+    if isinstance(request, ASGIRequest):
+        body = _aiter_in_thread(body)
+    resp = StreamingHttpResponse(body, content_type="text/event-stream")
+    resp["Cache-Control"] = "no-cache"
+    resp["X-Accel-Buffering"] = "no"  # don't let nginx buffer the stream
+    return resp
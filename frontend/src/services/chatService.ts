@@ -1,4 +1,4 @@
-import type { AskResponse, SyncResponse } from '../types/chat';
+import type { AskResponse, AskStreamHandlers, SyncResponse } from '../types/chat';
 
 const API_URL = import.meta.env.VITE_API_URL || 'http://localhost:8000';
 
@@ -50,4 +50,62 @@ export class ChatService {
       throw error;
     }
   }
+
+  /**
+   * Ask via /api/ask/stream (Server-Sent Events over a POST response).
+   * QA answers call onMatches first and then onToken per generated piece;
+   * other intents deliver the full /api/ask payload through onAnswer.
+   */
+  async askQuestionStream(question: string, handlers: AskStreamHandlers): Promise<void> {
+    const response = await fetch(`${API_URL}/api/ask/stream`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json', Accept: 'text/event-stream' },
+      body: JSON.stringify({ question }),
+    });
+
+    if (!response.ok || !response.body) {
+      throw new Error('Failed to get answer');
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    for (;;) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+
+      let boundary = buffer.indexOf('\n\n');
+      while (boundary !== -1) {
+        const raw = buffer.slice(0, boundary);
+        buffer = buffer.slice(boundary + 2);
+        boundary = buffer.indexOf('\n\n');
+
+        let event = 'message';
+        let data = '';
+        for (const line of raw.split('\n')) {
+          if (line.startsWith('event:')) event = line.slice(6).trim();
+          else if (line.startsWith('data:')) data += line.slice(5).trim();
+        }
+        const payload = data ? JSON.parse(data) : {};
+
+        switch (event) {
+          case 'matches':
+            handlers.onMatches?.(payload.matches);
+            break;
+          case 'token':
+            handlers.onToken?.(payload.text);
+            break;
+          case 'answer':
+            handlers.onAnswer?.(payload);
+            break;
+          case 'error':
+            throw new Error(payload.error || 'Failed to get answer');
+          case 'done':
+            return;
+        }
+      }
+    }
+  }
 }
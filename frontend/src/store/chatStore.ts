@@ -6,7 +6,8 @@ import { type ChatState, type Message } from '../types/chat';
 const chatService = ChatService.getInstance();
 
 interface ChatStore extends ChatState {
-  addMessage: (content: string, role: Message['role']) => void;
+  addMessage: (content: string, role: Message['role']) => string;
+  appendToMessage: (id: string, text: string) => void;
   sendMessage: (content: string) => Promise<void>;
   syncData: () => Promise<void>;
   clearMessages: () => void;
@@ -28,21 +29,39 @@ export const useChatStore = create<ChatStore>((set, get) => ({
     set((state) => ({
       messages: [...state.messages, message],
     }));
+    return message.id;
+  },
+
+  appendToMessage: (id, text) => {
+    set((state) => ({
+      messages: state.messages.map((m) =>
+        m.id === id ? { ...m, content: m.content + text } : m
+      ),
+    }));
   },
 
   sendMessage: async (content) => {
-    const { addMessage } = get();
+    const { addMessage, appendToMessage } = get();
     set({ isLoading: true, error: null });
     
     try {
       // Add user message
       addMessage(content, 'user');
       
-      // Get response from API
-      const response = await chatService.askQuestion(content);
-      
-      // Add assistant message
-      addMessage(response.answer, 'assistant');
+      // Stream the response; the assistant message fills in as tokens arrive
+      let assistantId: string | null = null;
+      const append = (text: string) => {
+        if (assistantId === null) {
+          assistantId = addMessage(text, 'assistant');
+          set({ isLoading: false });
+        } else {
+          appendToMessage(assistantId, text);
+        }
+      };
+      await chatService.askQuestionStream(content, {
+        onToken: append,
+        onAnswer: (response) => append(response.answer),
+      });
     } catch (error) {
       set({ error: 'Failed to send message. Please try again.' });
       console.error('Error sending message:', error);
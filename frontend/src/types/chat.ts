@@ -17,11 +17,22 @@ export interface SyncResponse {
   synced_rows: number;
 }
 
+export interface Match {
+  row: number;
+  source?: string;
+  text: string;
+  score: number;
+}
+
 export interface AskResponse {
   answer: string;
-  matches: {
-    row: number;
-    text: string;
-    score: number;
-  }[];
+  intent?: string;
+  matches: Match[];
+  prompt?: Record<string, number | boolean | null>;
+}
+
+export interface AskStreamHandlers {
+  onMatches?: (matches: Match[]) => void;
+  onToken?: (text: string) => void;
+  onAnswer?: (response: AskResponse) => void;
 }